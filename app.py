@@ -1,25 +1,316 @@
 import webview
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context, has_request_context, g, send_file
+from flask.signals import before_render_template, template_rendered
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.pagination import Pagination
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime, timedelta
-from sqlalchemy import literal
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+from werkzeug.utils import secure_filename
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_DOWN, ROUND_HALF_UP
+from sqlalchemy import literal, literal_column, event, inspect, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
 import sqlite3
+import base64
+import cProfile
+import hashlib
+import hmac
+import logging
+import math
+import operator
+import pstats
+import random
+import re
+import shutil
+import tempfile
+import time
+import tracemalloc
+import click
+import json
+import socket
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+import sys
 import os
+import threading
+import uuid
 import csv
-from io import StringIO
+import zlib
+from io import StringIO, TextIOWrapper
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///electrical_billing.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('BILLSYS_DATABASE_URL', 'sqlite:///electrical_billing.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Pool for a central server database shared by several shops. SQLite keeps
+# SQLAlchemy's defaults; pre-ping and recycle drop connections the server closed.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+# Bill numbers: {seq} is required; {fy} (e.g. 2025-26) and {counter} are optional
+# and give each financial year / POS counter its own series.
+app.config['INVOICE_NUMBER_FORMAT'] = os.environ.get('INVOICE_NUMBER_FORMAT', 'INV-{seq:03d}')
+app.config['PURCHASE_NUMBER_FORMAT'] = os.environ.get('PURCHASE_NUMBER_FORMAT', 'PUR-{seq:03d}')
+app.config['POS_COUNTER'] = os.environ.get('POS_COUNTER', '1')
+# Numbers reserved per terminal at a time; 1 keeps the series gapless
+app.config['BILL_NUMBER_BLOCK_SIZE'] = int(os.environ.get('BILL_NUMBER_BLOCK_SIZE', 1))
+# Applied to every SQLite connection. WAL lets counters keep reading while one
+# writes; busy_timeout makes a writer wait for the lock instead of failing.
+app.config['SQLITE_PRAGMAS'] = {
+    'journal_mode': os.environ.get('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': -int(os.environ.get('SQLITE_CACHE_SIZE_KB', 20000)),  # negative means KiB
+}
+# Times a write request is re-run after 'database is locked'
+app.config['DB_LOCK_RETRIES'] = int(os.environ.get('DB_LOCK_RETRIES', 5))
+# serve.py defaults
+app.config['SERVER_THREADS'] = int(os.environ.get('SERVER_THREADS', 8))
+app.config['SERVER_PROCESSES'] = int(os.environ.get('SERVER_PROCESSES', 1))
+# Background jobs: pool size, where results are cached and for how long (seconds).
+# BACKGROUND_REPORTS runs every report page as a job; desktop_app.py turns it on.
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))
+app.config['JOB_CACHE_DIR'] = os.environ.get('JOB_CACHE_DIR', os.path.join(app.instance_path, 'job_cache'))
+app.config['JOB_CACHE_TTL'] = int(os.environ.get('JOB_CACHE_TTL', 300))
+app.config['BACKGROUND_REPORTS'] = os.environ.get('BACKGROUND_REPORTS', '0') == '1'
+# In-memory report totals: entries kept, seconds before one expires, and
+# REPORT_CACHE=0 to turn it off (tests, or when debugging a report)
+app.config['REPORT_CACHE'] = os.environ.get('REPORT_CACHE', '1') == '1'
+app.config['REPORT_CACHE_SIZE'] = int(os.environ.get('REPORT_CACHE_SIZE', 256))
+app.config['REPORT_CACHE_TTL'] = int(os.environ.get('REPORT_CACHE_TTL', 300))
+# Request timing: INSTRUMENTATION=0 turns it off; TIMING_HEADERS=1 sends the
+# timing headers outside debug mode. Queries and requests slower than these
+# (ms) are logged. With METRICS_TOKEN set, /metrics wants it as a bearer token;
+# without one it is for signed-in admins and owners. METRICS_LOCALHOST=1 also lets
+# in requests from this machine (only safe without a reverse proxy in front).
+app.config['INSTRUMENTATION'] = os.environ.get('INSTRUMENTATION', '1') == '1'
+app.config['TIMING_HEADERS'] = os.environ.get('TIMING_HEADERS', '0') == '1'
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 200))
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 1000))
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN', '')
+app.config['METRICS_LOCALHOST'] = os.environ.get('METRICS_LOCALHOST', '0') == '1'
+# Seconds a signed-in user's row is reused between requests; 0 reads it every time
+app.config['PRINCIPAL_CACHE_TTL'] = float(os.environ.get('PRINCIPAL_CACHE_TTL', 30))
+# werkzeug hash method for passwords, e.g. pbkdf2:sha256:600000 or
+# scrypt:32768:8:1. Lower the cost on slow terminals; stored hashes made with
+# other settings are redone at the user's next sign-in.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', f'pbkdf2:sha256:{DEFAULT_PBKDF2_ITERATIONS}')
+# Sign-in attempts per client address and per mobile number: a burst, then this many a minute
+app.config['LOGIN_BURST'] = int(os.environ.get('LOGIN_BURST', 5))
+app.config['LOGIN_RATE_PER_MINUTE'] = float(os.environ.get('LOGIN_RATE_PER_MINUTE', 6))
+# Rows written per transaction by imports
+app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 2000))
 
 db = SQLAlchemy(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# SQLite connections
+@event.listens_for(Engine, 'connect')
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    for name, value in app.config['SQLITE_PRAGMAS'].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+def database_locked(error):
+    return isinstance(error.orig, sqlite3.OperationalError) and 'locked' in str(error.orig)
+
+def retry_on_locked(view):
+    """Roll back and re-run a write view when SQLite reports the database is locked"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        retries = app.config['DB_LOCK_RETRIES']
+        for attempt in range(retries + 1):
+            try:
+                return view(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if attempt == retries or not database_locked(e):
+                    raise
+                # Exponential backoff with jitter so waiting counters don't retry in step
+                time.sleep(min(0.05 * 2 ** attempt, 1.0) * random.uniform(0.5, 1.5))
+    return wrapper
+
+# Portable SQL
+# Models and queries run on SQLite and PostgreSQL; anything dialect-specific
+# goes through these helpers.
+class day_string(FunctionElement):
+    """'YYYY-MM-DD' text for a date or datetime column"""
+    type = db.String()
+    inherit_cache = True
+    formats = {'sqlite': '%Y-%m-%d', 'postgresql': 'YYYY-MM-DD'}
+
+class month_string(day_string):
+    """'YYYY-MM' text for a date or datetime column"""
+    inherit_cache = True
+    formats = {'sqlite': '%Y-%m', 'postgresql': 'YYYY-MM'}
+
+def compile_date_string(element, compiler, **kw):
+    # The format is inlined so GROUP BY matches the selected expression on PostgreSQL
+    column = compiler.process(element.clauses, **kw)
+    if compiler.dialect.name == 'sqlite':
+        return f"strftime('{element.formats['sqlite']}', {column})"
+    return f"to_char({column}, '{element.formats['postgresql']}')"
+
+for string_class in (day_string, month_string):
+    compiles(string_class)(compile_date_string)
+
+def upsert(table, values, keys, update=None, dialect=None):
+    """INSERT that updates (or with no update, skips) rows already present for keys.
+
+    update receives the rejected row (EXCLUDED) and returns the SET clause.
+    """
+    dialect = dialect or db.engine.dialect.name
+    insert = postgresql_insert if dialect == 'postgresql' else sqlite_insert
+    stmt = insert(table).values(**values)
+    index_elements = [table.c[key] for key in keys]
+    if update is None:
+        return stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return stmt.on_conflict_do_update(index_elements=index_elements, set_=update(stmt.excluded))
+
+# Money
+# Amounts are Decimal rupees in Python and whole paise in the database, so SQL
+# SUM is exact on every backend. Arithmetic done in SQL is in paise; wrap an
+# expression read back as an amount in db.type_coerce(expression, Money).
+PAISA = Decimal('0.01')
+
+def to_money(value):
+    """Rupees as a Decimal rounded half-up to the paisa; blank means zero"""
+    if value is None or value == '':
+        return Decimal('0.00')
+    # str() first so a float like 0.1 becomes 0.10, not its binary expansion
+    return Decimal(str(value)).quantize(PAISA, rounding=ROUND_HALF_UP)
+
+def money_fields(data, *names):
+    """to_money() of each named field of posted data, plus a list of
+    {'field', 'message'} errors for those that aren't amounts"""
+    amounts, errors = {}, []
+    for name in names:
+        try:
+            amounts[name] = to_money(data.get(name))
+            if not amounts[name].is_finite():
+                raise ArithmeticError
+        except ArithmeticError:
+            errors.append({'field': name, 'message': f"{name.replace('_', ' ').capitalize()} must be a number"})
+    return amounts, errors
+
+def split_gst(taxable, rate, inter_state=False):
+    """(cgst, sgst, igst) on taxable at rate percent.
+
+    The tax is rounded half-up to the paisa once; within a state CGST takes
+    any odd paisa so the two halves always add up to the tax.
+    """
+    zero = Decimal('0.00')
+    tax = to_money(to_money(taxable) * Decimal(str(rate)) / 100)
+    if inter_state:
+        return zero, zero, tax
+    sgst = (tax / 2).quantize(PAISA, rounding=ROUND_DOWN)
+    return tax - sgst, sgst, zero
+
+class Money(db.TypeDecorator):
+    """Rupee amount stored as a whole number of paise"""
+    impl = db.BigInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return int(to_money(value) * 100)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        # Columns converted in place on SQLite and computed expressions can come back as REAL
+        return (Decimal(str(value)) / 100).quantize(PAISA, rounding=ROUND_HALF_UP)
+
+    def coerce_compared_value(self, op, value):
+        # Only values added to, subtracted from or compared with an amount are amounts
+        if op in (operator.mul, operator.truediv, operator.floordiv, operator.mod):
+            return db.Integer() if isinstance(value, int) else db.Float()
+        return self
+
+class MoneyJSONProvider(DefaultJSONProvider):
+    """JSON with amounts as numbers; the POS and report scripts do arithmetic on them"""
+    @staticmethod
+    def default(o):
+        if isinstance(o, Decimal):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
+app.json = MoneyJSONProvider(app)
+
+def whole_paise(expression):
+    """Round a SQL paise expression half away from zero to an integer"""
+    return db.cast(db.func.round(db.cast(expression, db.Numeric)), db.BigInteger)
+
+# Passwords
+# Hashing is slow on purpose, so attempts are rate limited before any hash is
+# checked: each client address and each mobile number has a token bucket.
+def password_hash_method():
+    """PASSWORD_HASH_METHOD written out in full, as it appears in stored hashes"""
+    method = app.config['PASSWORD_HASH_METHOD']
+    parts = method.split(':')
+    defaults = {'pbkdf2': ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)], 'scrypt': ['32768', '8', '1']}.get(parts[0])
+    if defaults is None:
+        return method
+    return ':'.join(parts + defaults[len(parts) - 1:])
+
+_login_buckets = {}
+_login_buckets_lock = threading.Lock()
+
+def take_login_token(key):
+    """Spend one of key's sign-in attempts; the seconds to wait if none is left, else 0"""
+    burst = app.config['LOGIN_BURST']
+    rate = app.config['LOGIN_RATE_PER_MINUTE'] / 60
+    now = time.monotonic()
+    with _login_buckets_lock:
+        tokens, updated = _login_buckets.get(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens < 1:
+            _login_buckets[key] = (tokens, now)
+            return (1 - tokens) / rate if rate else 60
+        _login_buckets[key] = (tokens - 1, now)
+        # A refilled bucket is the same as none; drop them so the table stays small
+        if len(_login_buckets) > 10000:
+            for other, (left, at) in list(_login_buckets.items()):
+                if left + (now - at) * rate >= burst:
+                    del _login_buckets[other]
+    return 0
+
 # Models
 class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -30,24 +321,44 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = generate_password_hash(password, method=password_hash_method())
     
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        """Check password, rehashing it when it was stored with other settings
+        (the caller's commit saves the new hash)"""
+        if not check_password_hash(self.password_hash, password):
+            return False
+        if self.password_hash.split('$', 1)[0] != password_hash_method():
+            self.set_password(password)
+        return True
 
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     category = db.Column(db.String(50), nullable=False)
     brand = db.Column(db.String(50), nullable=False)
-    mrp_price = db.Column(db.Float, nullable=False)
-    cost_price = db.Column(db.Float, nullable=False)
-    selling_price = db.Column(db.Float, nullable=False)
+    mrp_price = db.Column(Money, nullable=False)
+    cost_price = db.Column(Money, nullable=False)
+    selling_price = db.Column(Money, nullable=False)
     gst_rate = db.Column(db.Float, nullable=False)
     stock_quantity = db.Column(db.Float, default=0)
     unit =db.Column(db.String(50))
     vendor_id = db.Column(db.Integer, db.ForeignKey('vendor.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def stock_value(self):
+        return to_money(self.selling_price * Decimal(str(self.stock_quantity or 0)))
+
+    __table_args__ = (
+        db.Index('ix_product_stock_quantity', 'stock_quantity'),
+        db.Index('ix_product_category', 'category'),
+        db.Index('ix_product_vendor_id', 'vendor_id'),
+        db.Index('ix_product_updated_at', 'updated_at', 'id'),
+        db.Index('ix_product_name_brand', 'name', 'brand'),
+        db.Index('ix_product_name', 'name', 'id'),
+    )
 
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -55,7 +366,14 @@ class Customer(db.Model):
     mobile_number = db.Column(db.String(15), unique=True, nullable=False)
     email = db.Column(db.String(100))
     address = db.Column(db.Text)
+    balance_due = db.Column(Money, nullable=False, default=0, server_default='0')  # owed to us across invoices
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_customer_updated_at', 'updated_at', 'id'),
+        db.Index('ix_customer_balance_due', 'balance_due'),
+        db.Index('ix_customer_name', 'name', 'id'),
+    )
 
 class Vendor(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -64,56 +382,86 @@ class Vendor(db.Model):
     gst_number = db.Column(db.String(15))
     address = db.Column(db.Text)
     products_supplied = db.Column(db.Text)
+    balance_due = db.Column(Money, nullable=False, default=0, server_default='0')  # owed by us across purchases
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_vendor_balance_due', 'balance_due'),
+        db.Index('ix_vendor_name', 'name', 'id'),
+    )
 
 class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     bill_no = db.Column(db.String(20), unique=True, nullable=False)
     customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'))
-    total_amount = db.Column(db.Float, nullable=False)
-    discount = db.Column(db.Float, default=0)
-    cgst = db.Column(db.Float, default=0)
-    sgst = db.Column(db.Float, default=0)
-    igst = db.Column(db.Float, default=0)
-    final_amount = db.Column(db.Float, nullable=False)
+    total_amount = db.Column(Money, nullable=False)
+    discount = db.Column(Money, default=0)
+    cgst = db.Column(Money, default=0)
+    sgst = db.Column(Money, default=0)
+    igst = db.Column(Money, default=0)
+    final_amount = db.Column(Money, nullable=False)
+    paid_amount = db.Column(Money, nullable=False, default=0, server_default='0')
+    balance_due = db.Column(Money, nullable=False, default=0, server_default='0')
     payment_status = db.Column(db.String(20), default='unpaid')  # paid, partial, unpaid
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     customer = db.relationship('Customer', backref='invoices')
+    __table_args__ = (
+        db.Index('ix_invoice_created_at', 'created_at'),
+        db.Index('ix_invoice_status_created_at', 'payment_status', 'created_at'),
+        db.Index('ix_invoice_customer_created_at', 'customer_id', 'created_at'),
+        db.Index('ix_invoice_balance_due', 'balance_due', 'created_at', 'customer_id'),
+    )
 
 class InvoiceItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     quantity = db.Column(db.Integer, nullable=False)
-    unit_price = db.Column(db.Float, nullable=False)
-    total_price = db.Column(db.Float, nullable=False)
+    unit_price = db.Column(Money, nullable=False)
+    total_price = db.Column(Money, nullable=False)
+    gst_rate = db.Column(db.Float)  # product's rate at the time of sale
     invoice = db.relationship('Invoice', backref='items')
     product = db.relationship('Product', backref='invoice_items')
+    __table_args__ = (
+        db.Index('ix_invoice_item_invoice_id', 'invoice_id'),
+        db.Index('ix_invoice_item_product_id', 'product_id'),
+    )
 
 class Payment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoice.id'))
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     payment_method = db.Column(db.String(20), nullable=False)  # cash, card, upi
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='completed')
     invoice = db.relationship('Invoice', backref='payments')
+    __table_args__ = (
+        db.Index('ix_payment_invoice_id', 'invoice_id'),
+        db.Index('ix_payment_payment_date', 'payment_date'),
+    )
 
 class Expense(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     category = db.Column(db.String(50), nullable=False)
     description = db.Column(db.String(200))
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     expense_date = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_expense_expense_date', 'expense_date'),
+        db.Index('ix_expense_category_expense_date', 'category', 'expense_date'),
+    )
 
 class VendorPayment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     purchase_id = db.Column(db.Integer, db.ForeignKey('purchase.id'))
-    amount = db.Column(db.Float, nullable=False)
+    amount = db.Column(Money, nullable=False)
     payment_method = db.Column(db.String(20), nullable=False)
     payment_date = db.Column(db.DateTime, default=datetime.utcnow)
     description = db.Column(db.String(200))
     purchase = db.relationship('Purchase', backref='payments')
+    __table_args__ = (
+        db.Index('ix_vendor_payment_purchase_id', 'purchase_id'),
+        db.Index('ix_vendor_payment_payment_date', 'payment_date'),
+    )
 
 class Purchase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -121,28 +469,999 @@ class Purchase(db.Model):
     po_bill_no = db.Column(db.String(50), nullable=True)  # PO Bill Number from vendor
     purchase_date = db.Column(db.Date, nullable=False, default=datetime.utcnow().date())
     vendor_id = db.Column(db.Integer, db.ForeignKey('vendor.id'))
-    total_amount = db.Column(db.Float, nullable=False)
-    discount = db.Column(db.Float, default=0)
-    cgst = db.Column(db.Float, default=0)
-    sgst = db.Column(db.Float, default=0)
-    final_amount = db.Column(db.Float, nullable=False)
+    total_amount = db.Column(Money, nullable=False)
+    discount = db.Column(Money, default=0)
+    cgst = db.Column(Money, default=0)
+    sgst = db.Column(Money, default=0)
+    final_amount = db.Column(Money, nullable=False)
+    paid_amount = db.Column(Money, nullable=False, default=0, server_default='0')
+    balance_due = db.Column(Money, nullable=False, default=0, server_default='0')
     payment_status = db.Column(db.String(20), default='unpaid')  # paid, partial, unpaid
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     vendor = db.relationship('Vendor', backref='purchases')
+    __table_args__ = (
+        db.Index('ix_purchase_created_at', 'created_at'),
+        db.Index('ix_purchase_status_created_at', 'payment_status', 'created_at'),
+        db.Index('ix_purchase_vendor_created_at', 'vendor_id', 'created_at'),
+        db.Index('ix_purchase_balance_due', 'balance_due', 'purchase_date', 'vendor_id'),
+    )
 
 class PurchaseItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     purchase_id = db.Column(db.Integer, db.ForeignKey('purchase.id'))
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     quantity = db.Column(db.Integer, nullable=False)
-    unit_price = db.Column(db.Float, nullable=False)
-    total_price = db.Column(db.Float, nullable=False)
+    unit_price = db.Column(Money, nullable=False)
+    total_price = db.Column(Money, nullable=False)
     purchase = db.relationship('Purchase', backref='items')
     product = db.relationship('Product', backref='purchase_items')
+    __table_args__ = (
+        db.Index('ix_purchase_item_purchase_id', 'purchase_id'),
+        db.Index('ix_purchase_item_product_id', 'product_id'),
+    )
+
+class StockMovement(db.Model):
+    # Append-only: every change to a product's stock is a row here, and
+    # product.stock_quantity is their running total, updated in the same transaction
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    quantity = db.Column(db.Float, nullable=False)  # signed: positive in, negative out
+    reason = db.Column(db.String(20), nullable=False)  # opening, purchase, sale, adjustment
+    document_type = db.Column(db.String(20))  # invoice, purchase
+    document_id = db.Column(db.Integer)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    product = db.relationship('Product', backref=db.backref('stock_movements', lazy='dynamic'))
+    user = db.relationship('User')
+    __table_args__ = (
+        db.Index('ix_stock_movement_product_created_at', 'product_id', 'created_at'),
+        db.Index('ix_stock_movement_document', 'document_type', 'document_id'),
+    )
+
+class StockSnapshot(db.Model):
+    # A product's stock as of a moment, so stock on a date is the latest
+    # snapshot before it plus the few movements after
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    as_of = db.Column(db.DateTime, primary_key=True)
+    quantity = db.Column(db.Float, nullable=False)
+
+class DailySummary(db.Model):
+    # One row per day, maintained alongside the writes that change it so the
+    # dashboard reads a handful of rows instead of scanning invoices/expenses.
+    day = db.Column(db.Date, primary_key=True)
+    sales_total = db.Column(Money, nullable=False, default=0)
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    expenses_total = db.Column(Money, nullable=False, default=0)
+    new_customers = db.Column(db.Integer, nullable=False, default=0)
+    low_stock_count = db.Column(db.Integer)  # snapshot after the day's last stock change
+
+class DocumentSequence(db.Model):
+    name = db.Column(db.String(50), primary_key=True)  # e.g. INV, INV/2025-26, INV/2025-26/2
+    next_value = db.Column(db.Integer, nullable=False, default=1)
+
+class DeletedRecord(db.Model):
+    # Tombstones so catalogue clients syncing with updated_since can drop rows
+    id = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(50), nullable=False)
+    record_id = db.Column(db.Integer, nullable=False)
+    deleted_at = db.Column(db.DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        db.Index('ix_deleted_record_table_deleted_at', 'table_name', 'deleted_at'),
+    )
+
+class SchemaVersion(db.Model):
+    version = db.Column(db.Integer, primary_key=True)
+    description = db.Column(db.String(200), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+LOW_STOCK_THRESHOLD = 5
+
+# Signed-in users
+# load_user runs on every request, the POS's quote calls included, so the
+# columns a request needs are cached per user for PRINCIPAL_CACHE_TTL seconds.
+# A commit that changes or deletes a user drops its entry; other processes
+# see the change once their entry expires.
+class Principal(UserMixin):
+    """The signed-in user's columns, detached from any session"""
+    def __init__(self, user):
+        self.id = user.id
+        self.mobile_number = user.mobile_number
+        self.name = user.name
+        self.role = user.role
+        self.created_at = user.created_at
+
+_principals = {}
+_principals_lock = threading.Lock()
+# Bumped whenever an entry is dropped, so a load that raced a commit isn't stored
+_principals_version = 0
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    user_id = int(user_id)
+    cached = _principals.get(user_id)
+    if cached is not None and cached[0] > time.monotonic():
+        return cached[1]
+    version = _principals_version
+    user = db.session.get(User, user_id)
+    if user is None:
+        return None
+    principal = Principal(user)
+    ttl = app.config['PRINCIPAL_CACHE_TTL']
+    with _principals_lock:
+        if ttl > 0 and version == _principals_version:
+            _principals[user_id] = (time.monotonic() + ttl, principal)
+    return principal
+
+def forget_principals(user_ids):
+    global _principals_version
+    with _principals_lock:
+        _principals_version += 1
+        for user_id in user_ids:
+            _principals.pop(user_id, None)
+
+@event.listens_for(Session, 'after_flush')
+def note_flushed_users(session, flush_context):
+    for obj in session.new | session.dirty | session.deleted:
+        if isinstance(obj, User):
+            session.info.setdefault('users_written', set()).add(obj.id)
+
+@event.listens_for(Session, 'after_commit')
+def forget_committed_users(session):
+    user_ids = session.info.pop('users_written', None)
+    if user_ids:
+        forget_principals(user_ids)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back_users(session):
+    session.info.pop('users_written', None)
+
+def role_required(*roles, api=False):
+    """Only let users with one of roles through, checked on the cached user.
+
+    Goes under @login_required. Pages flash and go back to the dashboard;
+    api views answer with a JSON 403.
+    """
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if current_user.role not in roles:
+                if api:
+                    return jsonify({'error': 'Access denied'}), 403
+                flash(f"Access denied. {'/'.join(role.title() for role in roles)} privileges required.", 'error')
+                return redirect(url_for('dashboard'))
+            return view(*args, **kwargs)
+        return wrapper
+    return decorate
+
+@app.cli.command('bench-auth')
+@click.option('--requests', 'count', default=2000, help='Requests per run')
+def bench_auth_command(count):
+    """Per-request cost of loading the signed-in user, with and without the cache"""
+    client = check_client()
+    if client is None:
+        print('No users in the database; run create_default_admin first')
+        sys.exit(1)
+    url = '/admin/report-cache'
+    ttl = app.config['PRINCIPAL_CACHE_TTL']
+    results = {}
+    with recorded_statements() as statements:
+        for label, run_ttl in (('uncached', 0), ('cached', ttl or 30)):
+            app.config['PRINCIPAL_CACHE_TTL'] = run_ttl
+            forget_principals(list(_principals))
+            timings = []
+            del statements[:]
+            for _ in range(count):
+                started = time.perf_counter()
+                # A fresh app context per request, as in the server
+                with app.app_context():
+                    client.get(url).get_data()
+                timings.append((time.perf_counter() - started) * 1e6)
+            timings.sort()
+            results[label] = timings[len(timings) // 2]
+            print(f"{label}: p50 {timings[len(timings) // 2]:.0f} us, p95 {timings[int(len(timings) * 0.95)]:.0f} us, "
+                  f"{len(statements) / count:.2f} queries per request")
+    app.config['PRINCIPAL_CACHE_TTL'] = ttl
+    print(f"Saved {results['uncached'] - results['cached']:.0f} us per request at p50")
+
+# Dashboard rollups
+def bump_daily_summary(day, **deltas):
+    """Add deltas to the summary row for day inside the caller's transaction"""
+    table = DailySummary.__table__
+    db.session.execute(upsert(
+        table, dict(day=day, **deltas), ['day'],
+        lambda excluded: {name: table.c[name] + excluded[name] for name in deltas}
+    ))
+
+def record_low_stock(day=None):
+    """Store the current low-stock product count on the summary row for day"""
+    day = day or datetime.utcnow().date()
+    count = db.session.query(db.func.count(Product.id)).filter(Product.stock_quantity <= LOW_STOCK_THRESHOLD).scalar()
+    db.session.execute(upsert(
+        DailySummary.__table__, {'day': day, 'low_stock_count': count}, ['day'],
+        lambda excluded: {'low_stock_count': excluded.low_stock_count}
+    ))
+
+def rebuild_rollups(commit=True):
+    """Recompute every DailySummary row from the source tables; commit=False
+    leaves the rows in the caller's transaction (migrations commit with their version row)"""
+    rows = {}
+
+    def row_for(day):
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+        if day not in rows:
+            rows[day] = {'day': day, 'sales_total': 0, 'invoice_count': 0,
+                         'expenses_total': 0, 'new_customers': 0, 'low_stock_count': None}
+        return rows[day]
+
+    invoice_day = day_string(Invoice.created_at)
+    for day, total, count in db.session.query(
+        invoice_day, db.func.sum(Invoice.final_amount), db.func.count(Invoice.id)
+    ).group_by(invoice_day):
+        row = row_for(day)
+        row['sales_total'] = total or 0
+        row['invoice_count'] = count
+
+    expense_day = day_string(Expense.expense_date)
+    for day, total in db.session.query(
+        expense_day, db.func.sum(Expense.amount)
+    ).group_by(expense_day):
+        row_for(day)['expenses_total'] = total or 0
+
+    customer_day = day_string(Customer.created_at)
+    for day, count in db.session.query(
+        customer_day, db.func.count(Customer.id)
+    ).group_by(customer_day):
+        row_for(day)['new_customers'] = count
+
+    db.session.query(DailySummary).delete()
+    if rows:
+        db.session.execute(db.insert(DailySummary), list(rows.values()))
+    record_low_stock()
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+@app.cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """Recompute the dashboard's daily summary rows"""
+    db.create_all()
+    count = rebuild_rollups()
+    print(f"Rebuilt {count} daily summary rows")
+
+# Schema migrations
+# Each migration runs once per database, in version order, and must be safe to
+# run against a database that db.create_all() has just built from the models.
+MIGRATIONS = []
+
+def migration(version, description):
+    def register(func):
+        MIGRATIONS.append((version, description, func))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return func
+    return register
+
+def column_names(connection, table_name):
+    return {column['name'] for column in inspect(connection).get_columns(table_name)}
+
+def add_column(connection, model, column_name):
+    """Add a model column to an existing table if it is missing"""
+    table = model.__table__
+    if column_name in column_names(connection, table.name):
+        return False
+    column = table.c[column_name]
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=connection.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    connection.execute(text(ddl))
+    return True
+
+def create_indexes(connection, *models):
+    """Create the models' indexes whose columns already exist in the database"""
+    for model in models:
+        existing = column_names(connection, model.__tablename__)
+        for index in model.__table__.indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+@migration(1, 'Add product.unit to databases created before it existed')
+def migrate_product_unit(connection):
+    add_column(connection, Product, 'unit')
+
+@migration(2, 'Indexes on report filter, sort and foreign key columns')
+def migrate_report_indexes(connection):
+    create_indexes(connection, Product, Invoice, InvoiceItem, Payment, Expense, VendorPayment, Purchase, PurchaseItem)
+
+@migration(3, 'Populate dashboard rollups from existing data')
+def migrate_daily_summary(connection):
+    rebuild_rollups(commit=False)
+
+@migration(4, 'Store the GST rate on each invoice line')
+def migrate_invoice_item_gst_rate(connection):
+    add_column(connection, InvoiceItem, 'gst_rate')
+    connection.execute(text(
+        "UPDATE invoice_item SET gst_rate = "
+        "(SELECT product.gst_rate FROM product WHERE product.id = invoice_item.product_id) "
+        "WHERE gst_rate IS NULL"
+    ))
+
+@migration(5, 'Seed bill number sequences from existing invoices and purchases')
+def migrate_document_sequences(connection):
+    for name, model in (('INV', Invoice), ('PUR', Purchase)):
+        last_id = connection.execute(db.select(db.func.max(model.id))).scalar() or 0
+        connection.execute(upsert(
+            DocumentSequence.__table__, {'name': name, 'next_value': last_id + 1}, ['name'],
+            dialect=connection.dialect.name
+        ))
+
+@migration(6, 'Track product and customer changes for catalogue sync')
+def migrate_catalogue_updated_at(connection):
+    for model in (Product, Customer):
+        add_column(connection, model, 'updated_at')
+        connection.execute(text(
+            f"UPDATE {model.__tablename__} SET updated_at = COALESCE(created_at, CURRENT_TIMESTAMP) "
+            "WHERE updated_at IS NULL"
+        ))
+    create_indexes(connection, Product, Customer)
+
+@migration(8, 'Store paid and outstanding amounts on bills, customers and vendors')
+def migrate_balances(connection):
+    for model, columns in ((Invoice, ('paid_amount', 'balance_due')), (Purchase, ('paid_amount', 'balance_due')),
+                           (Customer, ('balance_due',)), (Vendor, ('balance_due',))):
+        for column in columns:
+            add_column(connection, model, column)
+    create_indexes(connection, Invoice, Purchase, Customer, Vendor)
+    repair_balances()
+
+@migration(9, 'Store money as whole paise')
+def migrate_money_to_paise(connection):
+    for table in db.metadata.sorted_tables:
+        for column in table.c:
+            if not isinstance(column.type, Money):
+                continue
+            if connection.dialect.name == 'sqlite':
+                # SQLite can't change a declared type; a REAL column holds whole paise just as exactly
+                connection.execute(text(
+                    f"UPDATE {table.name} SET {column.name} = CAST(ROUND({column.name} * 100) AS INTEGER)"
+                ))
+            else:
+                connection.execute(text(
+                    f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT "
+                    f"USING ROUND({column.name} * 100)"
+                ))
+    # Totals derived by earlier migrations are recomputed from the converted
+    # amounts. Nothing commits before upgrade_database records the version, so
+    # an interrupted upgrade can't scale the amounts twice.
+    repair_balances()
+    rebuild_rollups(commit=False)
+
+@migration(10, 'Stock movement ledger and monthly snapshots from purchase and sale history')
+def migrate_stock_ledger(connection):
+    if connection.execute(db.select(StockMovement.id).limit(1)).first() is None:
+        seed_stock_ledger(connection)
+    rebuild_stock_snapshots(connection)
+
+@migration(11, 'Index products on name and brand for imports')
+def migrate_product_name_brand(connection):
+    create_indexes(connection, Product)
+
+@migration(12, 'Index products, customers and vendors on name for list pages')
+def migrate_name_indexes(connection):
+    create_indexes(connection, Product, Customer, Vendor)
+
+def upgrade_database():
+    """Create missing tables and apply pending migrations"""
+    db.create_all()
+    applied = {version for (version,) in db.session.query(SchemaVersion.version)}
+    for version, description, func in MIGRATIONS:
+        if version in applied:
+            continue
+        func(db.session.connection())
+        db.session.add(SchemaVersion(version=version, description=description))
+        db.session.commit()
+        print(f"Applied migration {version}: {description}")
+
+@app.cli.command('upgrade-db')
+def upgrade_db_command():
+    """Bring the database schema up to date"""
+    upgrade_database()
+
+# Search
+# SQLite FTS5 indexes over the searchable columns, kept in step with their
+# tables by triggers. Each column carries its bm25 weight for ranking.
+SEARCH_INDEXES = {
+    Product: (('name', 10.0), ('brand', 5.0), ('category', 2.0)),
+    Customer: (('name', 5.0), ('mobile_number', 5.0)),
+    Vendor: (('name', 5.0), ('mobile_number', 5.0), ('gst_number', 2.0)),
+    Invoice: (('bill_no', 1.0),),
+}
+# Ranking costs a few microseconds per match, so a short prefix that matches
+# more rows than this comes back in index order rather than by relevance.
+SEARCH_RANK_LIMIT = 1000
+search_metadata = db.MetaData()
+_search_tables = None
+
+def search_table(model):
+    name = f"{model.__tablename__}_fts"
+    if name in search_metadata.tables:
+        return search_metadata.tables[name]
+    columns = [db.Column(column) for column, weight in SEARCH_INDEXES[model]]
+    return db.Table(name, search_metadata, db.Column('rowid', db.Integer), *columns)
+
+def search_words(term):
+    return re.findall(r'\w+', term or '')
+
+def search_matches(model, words, ranked):
+    """Select index rows matching every word as a prefix, with their bm25 rank if ranked"""
+    fts = search_table(model)
+    columns = [fts.c.rowid.label('id')]
+    if ranked:
+        weights = [weight for column, weight in SEARCH_INDEXES[model]]
+        columns.append(db.func.bm25(literal_column(fts.name), *weights).label('rank'))
+    expression = ' '.join(f'"{word}"*' for word in words)
+    return db.select(*columns).where(literal_column(fts.name).op('MATCH')(expression))
+
+def rank_matches(query, model, words, connection):
+    """Join an ORM query or select to the index matches for words; returns it
+    with the matches' bm25 rank, or None when there are too many to rank"""
+    capped = search_matches(model, words, False).limit(SEARCH_RANK_LIMIT + 1).subquery()
+    ranked = connection.scalar(db.select(db.func.count()).select_from(capped)) <= SEARCH_RANK_LIMIT
+    matches = search_matches(model, words, ranked).subquery()
+    query = query.join(matches, matches.c.id == model.id)
+    return query, matches.c.rank if ranked else None
+
+def join_matches(query, model, words, connection):
+    """Join an ORM query or select to the index matches for words, best first"""
+    query, rank = rank_matches(query, model, words, connection)
+    if rank is not None:
+        query = query.order_by(rank, model.id)
+    return query
+
+def search_available(model):
+    global _search_tables
+    if _search_tables is None:
+        if db.engine.dialect.name == 'sqlite':
+            _search_tables = set(inspect(db.engine).get_table_names())
+        else:
+            _search_tables = set()
+    return f"{model.__tablename__}_fts" in _search_tables
+
+def search_fallback(model, term):
+    return db.or_(*[getattr(model, column).icontains(term) for column, weight in SEARCH_INDEXES[model]])
+
+def search_condition(model, term, key=None):
+    """Filter matching key (default model.id) against rows of model that match term"""
+    key = key if key is not None else model.id
+    words = search_words(term)
+    if not words:
+        return db.true()
+    if search_available(model):
+        return key.in_(search_matches(model, words, False))
+    return key.in_(db.select(model.id).where(search_fallback(model, term)))
+
+def search_ranked(query, model, term):
+    """Restrict an ORM query to rows of model matching term, best matches first"""
+    words = search_words(term)
+    if not words:
+        return query
+    if not search_available(model):
+        return query.filter(search_fallback(model, term))
+    return join_matches(query, model, words, db.session)
+
+def search_keys(query, model, term, keys):
+    """search_ranked for keyset_page: the query restricted to rows matching
+    term and the keys to page it on, (rank, id) when the matches are ranked"""
+    words = search_words(term)
+    if not words:
+        return query, keys
+    if not search_available(model):
+        return query.filter(search_fallback(model, term)), keys
+    query, rank = rank_matches(query, model, words, db.session)
+    return query, keys if rank is None else [rank, model.id]
+
+def create_search_index(connection, model):
+    """Create the FTS5 table and sync triggers for model and index its rows"""
+    table = model.__tablename__
+    fts = f"{table}_fts"
+    columns = [column for column, weight in SEARCH_INDEXES[model]]
+    names = ', '.join(columns)
+    new = ', '.join(f"new.{column}" for column in columns)
+    old = ', '.join(f"old.{column}" for column in columns)
+    delete_old = f"INSERT INTO {fts}({fts}, rowid, {names}) VALUES ('delete', old.id, {old});"
+    insert_new = f"INSERT INTO {fts}(rowid, {names}) VALUES (new.id, {new});"
+    for ddl in (
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({names}, "
+        f"content='{table}', content_rowid='id', prefix='2 3')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN {insert_new} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN {delete_old} END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {names} ON {table} "
+        f"BEGIN {delete_old} {insert_new} END",
+        f"INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+    ):
+        connection.execute(text(ddl))
+
+@migration(7, 'Full-text search indexes for products, customers, vendors and bills')
+def migrate_search_indexes(connection):
+    global _search_tables
+    if connection.dialect.name != 'sqlite':
+        return
+    if not connection.execute(text("SELECT sqlite_compileoption_used('ENABLE_FTS5')")).scalar():
+        print('SQLite was built without FTS5; search will use LIKE')
+        return
+    for model in SEARCH_INDEXES:
+        create_search_index(connection, model)
+    _search_tables = None
+
+@app.cli.command('bench-search')
+@click.option('--rows', default=100000, help='Products in the generated catalogue')
+@click.option('--lookups', default=500, help='Type-ahead searches to time')
+def bench_search_command(rows, lookups):
+    """Time product type-ahead searches against a generated catalogue"""
+    rng = random.Random(7)
+    syllables = ['ka', 'ro', 'mi', 'tel', 'van', 'su', 'lex', 'po', 'dri', 'na', 'bel', 'ton']
+    vocabulary = list({''.join(rng.choice(syllables) for _ in range(rng.randint(2, 4))) for _ in range(3000)})
+    brands = [word.title() for word in vocabulary[:200]]
+    categories = ['Wire', 'Switch', 'Fan', 'Light', 'MCB', 'Socket', 'Pipe', 'Tape']
+
+    with tempfile.TemporaryDirectory() as folder:
+        engine = db.create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        Product.__table__.create(engine)
+        with engine.begin() as connection:
+            for start in range(0, rows, 10000):
+                connection.execute(db.insert(Product), [
+                    {'name': ' '.join(rng.sample(vocabulary, 3)), 'category': rng.choice(categories),
+                     'brand': rng.choice(brands), 'mrp_price': 100, 'cost_price': 80,
+                     'selling_price': 90, 'gst_rate': 18, 'stock_quantity': 10}
+                    for _ in range(start, min(rows, start + 10000))
+                ])
+            create_search_index(connection, Product)
+
+        def ranked(connection, term):
+            return join_matches(db.select(Product.id, Product.name), Product, search_words(term), connection).limit(20)
+
+        def scanned(connection, term):
+            return db.select(Product.id, Product.name).where(search_fallback(Product, term)).limit(20)
+
+        prefixes = [rng.choice(vocabulary)[:rng.randint(2, 5)] for _ in range(lookups)]
+        p95s = {}
+        with engine.connect() as connection:
+            for label, build in (('fts5', ranked), ('like', scanned)):
+                timings = []
+                for term in prefixes:
+                    started = time.perf_counter()
+                    connection.execute(build(connection, term)).all()
+                    timings.append((time.perf_counter() - started) * 1000)
+                timings.sort()
+                p95s[label] = timings[int(len(timings) * 0.95)]
+                print(f"{label}: {rows} products, {lookups} lookups, "
+                      f"p50 {timings[len(timings) // 2]:.2f} ms, p95 {p95s[label]:.2f} ms, max {timings[-1]:.2f} ms")
+        engine.dispose()
+    if p95s['fts5'] >= 10:
+        sys.exit(1)
+
+# Keyset pagination
+# List pages seek past the last row shown instead of skipping OFFSET rows, so a
+# deep page costs what the first one does. Each list orders on an indexed key
+# ending in the primary key, e.g. (created_at, id); the cursor in its Previous
+# and Next links holds the key of the row to continue from and how many rows
+# come before the page, for the "Showing 41 to 50" line.
+class KeysetPage:
+    """One page of a keyset-paginated query, as the list templates use it"""
+
+    def __init__(self, items, start, next_cursor, prev_cursor, has_prev, total=None, approximate=False):
+        self.items = items
+        self.start = start
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor  # None links to the first page
+        self.has_prev = has_prev
+        self.has_next = next_cursor is not None
+        # On the last page the count is exact whatever the caller estimated
+        self.total = total if self.has_next else start + len(items)
+        self.approximate = approximate and self.has_next
+
+    @property
+    def first(self):
+        return self.start + 1
+
+    @property
+    def last(self):
+        return self.start + len(self.items)
+
+def encode_cursor(values, start, backwards=False):
+    data = {'k': [{'dt': value.isoformat()} if isinstance(value, datetime) else value for value in values],
+            'n': start}
+    if backwards:
+        data['b'] = 1
+    return base64.urlsafe_b64encode(json.dumps(data, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def cursor_value_fits(key, value):
+    try:
+        python_type = key.type.python_type
+    except NotImplementedError:  # e.g. a search rank
+        python_type = float
+    if python_type is float:
+        return isinstance(value, (int, float))
+    return isinstance(value, python_type)
+
+def decode_cursor(cursor, keys):
+    """The key values, row count before the page and direction in cursor; None if it isn't one for keys"""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values = [datetime.fromisoformat(value['dt']) if isinstance(value, dict) else value
+                  for value in data['k']]
+        if len(values) != len(keys) or not all(map(cursor_value_fits, keys, values)):
+            return None
+        return values, max(int(data['n']), 0), bool(data.get('b'))
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def keyset_page(query, keys, cursor=None, per_page=10, descending=False, total=None, approximate=False):
+    """The page of an ORM query that cursor points at (the first page without
+    one), ordered on keys, which must end in the primary key. total is the
+    row count if the caller has one; an approximate one is shown as "about"."""
+    position = decode_cursor(cursor, keys) if cursor else None
+    values, start, backwards = position or (None, 0, False)
+    # Walking back, read the rows before the boundary in reverse and flip them
+    reverse = descending != backwards
+    query = query.add_columns(*keys)
+    if values is not None:
+        row = db.tuple_(*keys)
+        boundary = db.tuple_(*[literal(value, key.type) for key, value in zip(keys, values)])
+        query = query.filter(row < boundary if reverse else row > boundary)
+    rows = query.order_by(*[key.desc() if reverse else key for key in keys]).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+        if not more:
+            start = 0
+    items = [row[0] for row in rows]
+    if not rows:
+        return KeysetPage(items, start, None, None, values is not None, total, approximate)
+
+    has_next = more or backwards
+    has_prev = more if backwards else values is not None
+    next_cursor = encode_cursor(rows[-1][1:], start + len(rows)) if has_next else None
+    prev_cursor = None
+    if has_prev and start > per_page:
+        prev_cursor = encode_cursor(rows[0][1:], start - per_page, backwards=True)
+    return KeysetPage(items, start, next_cursor, prev_cursor, has_prev, total, approximate)
+
+@app.template_global()
+def cursor_url(cursor):
+    """This list page's URL, filters kept, at cursor (the first page for None)"""
+    args = request.args.to_dict()
+    args.pop('cursor', None)
+    args.pop('page', None)
+    if cursor:
+        args['cursor'] = cursor
+    return url_for(request.endpoint, **request.view_args, **args)
+
+# Report cache
+# Report totals (summaries, charts, rankings) are kept in memory keyed on the
+# filters, so paging through a report or opening it again doesn't re-run the
+# aggregation. Each entry names the tables it reads and a commit that wrote
+# any of them drops it, whether the write went through the session or straight
+# to a connection. Commits made by other processes aren't seen here, so
+# entries also expire after REPORT_CACHE_TTL seconds.
+_report_cache = OrderedDict()
+_report_cache_lock = threading.Lock()
+_report_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+# Bumped on every commit that writes a table some report reads
+_report_data_version = 0
+# Tables read by some cached report; writes to anything else are ignored
+REPORT_TABLES = set()
+
+def cached_report(*models):
+    """Cache a report computation on its (hashable) arguments and the UTC day
+    (the day the rollups count in) until a commit writes one of models' tables
+    or the entry expires"""
+    tables = frozenset(model.__tablename__ for model in models)
+
+    def decorate(func):
+        REPORT_TABLES.update(tables)
+
+        @wraps(func)
+        def wrapper(*args):
+            if not app.config['REPORT_CACHE']:
+                return func(*args)
+            key = (func.__name__, datetime.utcnow().date()) + args
+            now = time.monotonic()
+            with _report_cache_lock:
+                entry = _report_cache.get(key)
+                if entry is not None and entry[0] > now:
+                    _report_cache.move_to_end(key)
+                    _report_cache_stats['hits'] += 1
+                    return entry[2]
+                _report_cache_stats['misses'] += 1
+                version = _report_data_version
+            value = func(*args)
+            with _report_cache_lock:
+                # A commit while computing may have made value stale already
+                if version == _report_data_version:
+                    _report_cache[key] = (now + app.config['REPORT_CACHE_TTL'], tables, value)
+                    _report_cache.move_to_end(key)
+                    while len(_report_cache) > app.config['REPORT_CACHE_SIZE']:
+                        _report_cache.popitem(last=False)
+                        _report_cache_stats['evictions'] += 1
+            return value
+        return wrapper
+    return decorate
+
+def invalidate_reports(tables):
+    """Drop cached reports that read any of tables"""
+    global _report_data_version
+    with _report_cache_lock:
+        _report_data_version += 1
+        stale = [key for key, (expires, read, value) in _report_cache.items() if read & tables]
+        for key in stale:
+            del _report_cache[key]
+        _report_cache_stats['invalidations'] += len(stale)
+
+def report_cache_stats():
+    with _report_cache_lock:
+        stats = dict(_report_cache_stats, size=len(_report_cache), enabled=app.config['REPORT_CACHE'])
+    looked_up = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / looked_up, 3) if looked_up else None
+    return stats
+
+def note_written(session, table):
+    if table in REPORT_TABLES:
+        session.info.setdefault('report_tables_written', set()).add(table)
+
+@event.listens_for(Session, 'after_flush')
+def note_flushed_tables(session, flush_context):
+    for obj in session.new | session.deleted:
+        note_written(session, obj.__tablename__)
+    for obj in session.dirty:
+        if session.is_modified(obj):
+            note_written(session, obj.__tablename__)
+
+@event.listens_for(Session, 'do_orm_execute')
+def note_executed_tables(state):
+    # Bulk INSERT/UPDATE/DELETE statements run through the session
+    if state.is_insert or state.is_update or state.is_delete:
+        note_written(state.session, state.statement.table.name)
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_committed_reports(session):
+    tables = session.info.pop('report_tables_written', None)
+    if tables:
+        invalidate_reports(tables)
+
+@event.listens_for(Session, 'after_rollback')
+def forget_rolled_back_tables(session):
+    session.info.pop('report_tables_written', None)
+
+@event.listens_for(Engine, 'after_execute')
+def note_connection_writes(conn, clauseelement, multiparams, params, execution_options, result):
+    # Writes made on a connection directly (rollup and snapshot rebuilds,
+    # imports) never pass the session hooks above
+    if getattr(clauseelement, 'is_dml', False) and clauseelement.table.name in REPORT_TABLES:
+        conn.info.setdefault('report_tables_written', set()).add(clauseelement.table.name)
+
+@event.listens_for(Engine, 'commit')
+def invalidate_connection_writes(conn):
+    tables = conn.info.pop('report_tables_written', None)
+    if tables:
+        invalidate_reports(tables)
+
+@event.listens_for(Engine, 'rollback')
+def forget_connection_writes(conn):
+    conn.info.pop('report_tables_written', None)
+
+@app.route('/admin/report-cache')
+@login_required
+@role_required('admin', 'owner', api=True)
+def report_cache_status():
+    return jsonify(report_cache_stats())
+
+# Instrumentation
+# Every request is timed along with the SQL it ran and the time spent in
+# templates. The numbers go out as Server-Timing/X- headers when debugging (or
+# with TIMING_HEADERS=1) and are added to process-wide counters served in
+# Prometheus text format at /metrics. Each worker process keeps its own.
+REQUEST_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Slowest statements kept per request, and across the process for /admin/slow-queries
+SLOWEST_PER_REQUEST = 5
+_slow_queries = deque(maxlen=50)
+_metrics_lock = threading.Lock()
+_request_metrics = {}  # (endpoint, method, status) -> count
+_endpoint_metrics = {}  # endpoint -> {'buckets': [...], 'sum', 'count', 'sql_count', 'sql_seconds', 'template_seconds'}
+_sql_totals = {'count': 0, 'seconds': 0.0, 'slow': 0}
+request_log = logging.getLogger('billsys.requests')
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_started'].pop()
+    slow = elapsed * 1000 >= app.config['SLOW_QUERY_MS']
+    with _metrics_lock:
+        _sql_totals['count'] += 1
+        _sql_totals['seconds'] += elapsed
+        _sql_totals['slow'] += slow
+    if slow:
+        query = {'ms': round(elapsed * 1000, 1), 'statement': ' '.join(statement.split()),
+                 'parameters': repr(parameters)[:500],
+                 'endpoint': request.endpoint if has_request_context() else None}
+        _slow_queries.append(query)
+        app.logger.warning('Slow query (%.1f ms): %s %s', query['ms'], query['statement'][:500], query['parameters'])
+    if has_request_context() and 'request_started' in g:
+        g.sql_count += 1
+        g.sql_seconds += elapsed
+        g.slowest_queries.append((elapsed, statement, parameters))
+        g.slowest_queries.sort(key=operator.itemgetter(0), reverse=True)
+        del g.slowest_queries[SLOWEST_PER_REQUEST:]
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    if 'request_started' in g:
+        g.template_started.append(time.perf_counter())
+
+@template_rendered.connect_via(app)
+def stop_template_timer(sender, template, context, **extra):
+    if 'request_started' in g and g.template_started:
+        g.template_seconds += time.perf_counter() - g.template_started.pop()
+
+def requested_profiler():
+    """'cprofile' or 'pyinstrument' when an admin or owner asks with ?profile=, else None"""
+    wanted = request.args.get('profile')
+    if not wanted or not current_user.is_authenticated or current_user.role not in ['admin', 'owner']:
+        return None
+    return 'pyinstrument' if wanted == 'pyinstrument' and pyinstrument is not None else 'cprofile'
+
+@app.before_request
+def start_request_timer():
+    if not app.config['INSTRUMENTATION']:
+        return
+    g.request_started = time.perf_counter()
+    g.sql_count = 0
+    g.sql_seconds = 0.0
+    g.template_seconds = 0.0
+    g.template_started = []
+    g.slowest_queries = []
+    profiler = requested_profiler()
+    if profiler == 'pyinstrument':
+        g.profiler = pyinstrument.Profiler()
+        g.profiler.start()
+    elif profiler:
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+def profile_response(profiler):
+    """Save the profile under instance/profiles and return it as the response"""
+    folder = os.path.join(app.instance_path, 'profiles')
+    os.makedirs(folder, exist_ok=True)
+    name = f"{request.endpoint or 'unmatched'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    if pyinstrument is not None and isinstance(profiler, pyinstrument.Profiler):
+        profiler.stop()
+        html = profiler.output_html()
+        with open(os.path.join(folder, name + '.html'), 'w', encoding='utf-8') as file:
+            file.write(html)
+        return Response(html, mimetype='text/html')
+    profiler.disable()
+    path = os.path.join(folder, name + '.prof')
+    profiler.dump_stats(path)
+    report = StringIO()
+    stats = pstats.Stats(profiler, stream=report)
+    stats.sort_stats('cumulative').print_stats(60)
+    return Response(f"Saved {path} (open with snakeviz or pstats)\n\n{report.getvalue()}", mimetype='text/plain')
+
+def record_request(endpoint, method, status, elapsed):
+    with _metrics_lock:
+        key = (endpoint, method, status)
+        _request_metrics[key] = _request_metrics.get(key, 0) + 1
+        metrics = _endpoint_metrics.setdefault(endpoint, {
+            'buckets': [0] * len(REQUEST_BUCKETS), 'sum': 0.0, 'count': 0,
+            'sql_count': 0, 'sql_seconds': 0.0, 'template_seconds': 0.0})
+        for index, bound in enumerate(REQUEST_BUCKETS):
+            if elapsed <= bound:
+                metrics['buckets'][index] += 1
+        metrics['sum'] += elapsed
+        metrics['count'] += 1
+        metrics['sql_count'] += g.sql_count
+        metrics['sql_seconds'] += g.sql_seconds
+        metrics['template_seconds'] += g.template_seconds
+
+@app.after_request
+def finish_request_timer(response):
+    if 'request_started' not in g:
+        return response
+    if 'profiler' in g:
+        response = profile_response(g.pop('profiler'))
+    # Streamed responses (exports) are timed up to their first byte
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = request.endpoint or 'unmatched'
+    if endpoint != 'static':
+        record_request(endpoint, request.method, response.status_code, elapsed)
+    if app.debug or app.config['TIMING_HEADERS']:
+        response.headers['Server-Timing'] = (
+            f'app;dur={elapsed * 1000:.1f}, sql;dur={g.sql_seconds * 1000:.1f};desc="{g.sql_count} queries", '
+            f'tmpl;dur={g.template_seconds * 1000:.1f}'
+        )
+        response.headers['X-Request-Time-Ms'] = f'{elapsed * 1000:.1f}'
+        response.headers['X-SQL-Queries'] = str(g.sql_count)
+        response.headers['X-SQL-Time-Ms'] = f'{g.sql_seconds * 1000:.1f}'
+        response.headers['X-Template-Time-Ms'] = f'{g.template_seconds * 1000:.1f}'
+    slow = elapsed * 1000 >= app.config['SLOW_REQUEST_MS']
+    if slow or request_log.isEnabledFor(logging.INFO):
+        request_log.log(logging.WARNING if slow else logging.INFO, json.dumps({
+            'method': request.method, 'path': request.full_path.rstrip('?'), 'endpoint': endpoint,
+            'status': response.status_code, 'ms': round(elapsed * 1000, 1),
+            'sql_count': g.sql_count, 'sql_ms': round(g.sql_seconds * 1000, 1),
+            'template_ms': round(g.template_seconds * 1000, 1),
+            'slowest_queries': [{'ms': round(seconds * 1000, 1), 'statement': ' '.join(statement.split())[:300],
+                                 'parameters': repr(parameters)[:200]}
+                                for seconds, statement, parameters in g.slowest_queries] if slow else [],
+        }))
+    return response
+
+def metrics_text():
+    """Process metrics in the Prometheus text exposition format"""
+    def labels(**values):
+        return '{' + ','.join(f'{name}="{str(value)}"' for name, value in values.items()) + '}'
+
+    lines = []
+    with _metrics_lock:
+        lines += ['# HELP billsys_requests_total Requests handled', '# TYPE billsys_requests_total counter']
+        for (endpoint, method, status), count in sorted(_request_metrics.items()):
+            lines.append(f'billsys_requests_total{labels(endpoint=endpoint, method=method, status=status)} {count}')
+        lines += ['# HELP billsys_request_duration_seconds Time to build a response',
+                  '# TYPE billsys_request_duration_seconds histogram']
+        for endpoint, metrics in sorted(_endpoint_metrics.items()):
+            for bound, count in zip(REQUEST_BUCKETS, metrics['buckets']):
+                lines.append(f'billsys_request_duration_seconds_bucket{labels(endpoint=endpoint, le=bound)} {count}')
+            lines.append(f'billsys_request_duration_seconds_bucket{labels(endpoint=endpoint, le="+Inf")} {metrics["count"]}')
+            lines.append(f'billsys_request_duration_seconds_sum{labels(endpoint=endpoint)} {metrics["sum"]:.6f}')
+            lines.append(f'billsys_request_duration_seconds_count{labels(endpoint=endpoint)} {metrics["count"]}')
+        for name, key, help_text in (
+            ('billsys_request_sql_statements_total', 'sql_count', 'SQL statements run by requests'),
+            ('billsys_request_sql_seconds_total', 'sql_seconds', 'Time requests spent in SQL'),
+            ('billsys_request_template_seconds_total', 'template_seconds', 'Time requests spent rendering templates'),
+        ):
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+            for endpoint, metrics in sorted(_endpoint_metrics.items()):
+                lines.append(f'{name}{labels(endpoint=endpoint)} {metrics[key]}')
+        lines += ['# HELP billsys_sql_statements_total SQL statements run by the process',
+                  '# TYPE billsys_sql_statements_total counter', f'billsys_sql_statements_total {_sql_totals["count"]}',
+                  '# HELP billsys_sql_seconds_total Time the process spent in SQL',
+                  '# TYPE billsys_sql_seconds_total counter', f'billsys_sql_seconds_total {_sql_totals["seconds"]:.6f}',
+                  f'# HELP billsys_slow_queries_total Statements slower than {app.config["SLOW_QUERY_MS"]} ms',
+                  '# TYPE billsys_slow_queries_total counter', f'billsys_slow_queries_total {_sql_totals["slow"]}']
+    cache = report_cache_stats()
+    for name in ('hits', 'misses', 'evictions', 'invalidations'):
+        lines += [f'# TYPE billsys_report_cache_{name}_total counter', f'billsys_report_cache_{name}_total {cache[name]}']
+    lines += ['# TYPE billsys_report_cache_entries gauge', f'billsys_report_cache_entries {cache["size"]}']
+    with _jobs_lock:
+        states = [job['state'] for job in _jobs.values()]
+    lines += ['# HELP billsys_jobs Background jobs tracked by the process', '# TYPE billsys_jobs gauge']
+    for state in ('queued', 'running', 'done', 'failed'):
+        lines.append(f'billsys_jobs{labels(state=state)} {states.count(state)}')
+    return '\n'.join(lines) + '\n'
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape target: METRICS_TOKEN as a bearer token if one is set,
+    otherwise signed-in admins (and this machine with METRICS_LOCALHOST)"""
+    token = app.config['METRICS_TOKEN']
+    if token:
+        allowed = hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')
+    else:
+        # Behind a local reverse proxy every client looks like 127.0.0.1
+        allowed = (app.config['METRICS_LOCALHOST'] and request.remote_addr in ('127.0.0.1', '::1')) or (
+            current_user.is_authenticated and current_user.role in ['admin', 'owner'])
+    if not allowed:
+        return Response('Forbidden\n', status=403, mimetype='text/plain')
+    return Response(metrics_text(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/slow-queries')
+@login_required
+@role_required('admin', 'owner', api=True)
+def slow_queries():
+    return jsonify({'threshold_ms': app.config['SLOW_QUERY_MS'], 'queries': list(reversed(_slow_queries))})
 
 # Add datetime to template context
 @app.context_processor
@@ -162,9 +1481,15 @@ def login():
         mobile_number = request.form['mobile_number']
         password = request.form['password']
         
+        wait = max(take_login_token(('address', request.remote_addr)), take_login_token(('mobile', mobile_number)))
+        if wait:
+            flash(f'Too many sign-in attempts. Try again in {math.ceil(wait)} seconds.', 'error')
+            return render_template('login.html'), 429
+        
         user = User.query.filter_by(mobile_number=mobile_number).first()
         
         if user and user.check_password(password):
+            db.session.commit()  # keeps a rehashed password
             login_user(user)
             return redirect(url_for('dashboard'))
         else:
@@ -180,36 +1505,35 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    # Calculate dashboard stats
-    total_sales = db.session.query(db.func.sum(Invoice.final_amount)).scalar() or 0
-    total_expenses = db.session.query(db.func.sum(Expense.amount)).scalar() or 0
-    customer_count = Customer.query.count()
+    today = datetime.utcnow().date()
+    week_start = today - timedelta(days=6)
+    month_ago = today - timedelta(days=30)
+    two_months_ago = today - timedelta(days=60)
+
+    def window_sum(column, start, end=None):
+        condition = DailySummary.day >= start
+        if end is not None:
+            condition = db.and_(condition, DailySummary.day < end)
+        return db.func.coalesce(db.func.sum(db.case((condition, column), else_=0)), 0)
+
+    # All-time and windowed totals in a single pass over the rollup rows
+    totals = db.session.query(
+        db.func.coalesce(db.func.sum(DailySummary.sales_total), 0),
+        db.func.coalesce(db.func.sum(DailySummary.expenses_total), 0),
+        db.func.coalesce(db.func.sum(DailySummary.new_customers), 0),
+        window_sum(DailySummary.sales_total, month_ago),
+        window_sum(DailySummary.expenses_total, month_ago),
+        window_sum(DailySummary.sales_total, two_months_ago, month_ago),
+        window_sum(DailySummary.expenses_total, two_months_ago, month_ago),
+        window_sum(DailySummary.new_customers, month_ago),
+        window_sum(DailySummary.sales_total, week_start),
+    ).one()
+    (total_sales, total_expenses, customer_count, monthly_sales, monthly_expenses,
+     previous_month_sales, previous_month_expenses, new_customers, weekly_sales) = totals
+
     vendor_count = Vendor.query.count()
     product_count = Product.query.count()
 
-    # Current period data (last 30 days)
-    month_ago = datetime.now() - timedelta(days=30)
-    monthly_sales = db.session.query(db.func.sum(Invoice.final_amount)).filter(
-        Invoice.created_at >= month_ago
-    ).scalar() or 0
-
-    # Expense uses expense_date
-    monthly_expenses = db.session.query(db.func.sum(Expense.amount)).filter(
-        Expense.expense_date >= month_ago
-    ).scalar() or 0
-
-    # Previous period data (30-60 days ago)
-    two_months_ago = datetime.now() - timedelta(days=60)
-    previous_month_sales = db.session.query(db.func.sum(Invoice.final_amount)).filter(
-        Invoice.created_at >= two_months_ago,
-        Invoice.created_at < month_ago
-    ).scalar() or 0
-
-    previous_month_expenses = db.session.query(db.func.sum(Expense.amount)).filter(
-        Expense.expense_date >= two_months_ago,
-        Expense.expense_date < month_ago
-    ).scalar() or 0
-
     # Calculate percentage changes
     sales_change = 0
     if previous_month_sales > 0:
@@ -219,35 +1543,22 @@ def dashboard():
     if previous_month_expenses > 0:
         expenses_change = ((monthly_expenses - previous_month_expenses) / previous_month_expenses) * 100
 
-    # New customers this month
-    new_customers = Customer.query.filter(Customer.created_at >= month_ago).count()
-
-    # Weekly sales data (last 7 days)
-    week_ago = datetime.now() - timedelta(days=7)
-    weekly_sales = db.session.query(db.func.sum(Invoice.final_amount)).filter(
-        Invoice.created_at >= week_ago
-    ).scalar() or 0
-
     # Generate weekly chart data (last 7 days)
-    from collections import defaultdict
-    daily_sales = defaultdict(float)
-
-    recent_invoices = Invoice.query.filter(Invoice.created_at >= week_ago).all()
-
-    for i in range(7):
-        date = (datetime.now() - timedelta(days=6 - i)).strftime('%a')
-        daily_sales[date] = 0
-
-    for invoice in recent_invoices:
-        day_name = invoice.created_at.strftime('%a')
-        daily_sales[day_name] += invoice.final_amount
-
+    week_rows = dict(db.session.query(DailySummary.day, DailySummary.sales_total).filter(
+        DailySummary.day >= week_start
+    ).all())
+    week_days = [week_start + timedelta(days=i) for i in range(7)]
     weekly_chart_data = {
-        'labels': list(daily_sales.keys()),
-        'data': list(daily_sales.values())
+        'labels': [day.strftime('%a') for day in week_days],
+        'data': [week_rows.get(day, 0) for day in week_days]
     }
 
-    low_stock_count = Product.query.filter(Product.stock_quantity <= 5).count()
+    # Low stock count is snapshotted on the most recent day stock changed
+    low_stock_count = db.session.query(DailySummary.low_stock_count).filter(
+        DailySummary.low_stock_count.isnot(None)
+    ).order_by(DailySummary.day.desc()).limit(1).scalar()
+    if low_stock_count is None:
+        low_stock_count = Product.query.filter(Product.stock_quantity <= LOW_STOCK_THRESHOLD).count()
 
     # Recent invoices (last 5)
     recent_invoices_list = [
@@ -258,7 +1569,8 @@ def dashboard():
             'amount': inv.final_amount,
             'status': inv.payment_status or 'unpaid'
         }
-        for inv in Invoice.query.order_by(Invoice.created_at.desc()).limit(5).all()
+        for inv in Invoice.query.options(db.joinedload(Invoice.customer))
+            .order_by(Invoice.created_at.desc()).limit(5).all()
     ]
 
     # Low stock list (<= 10)
@@ -290,20 +1602,19 @@ def dashboard():
 @app.route('/products')
 @login_required
 def products():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     search = request.args.get('search', '', type=str)
     category = request.args.get('category', '', type=str)
     
     query = Product.query
+    keys = [Product.name, Product.id]
     
     if search:
-        query = query.filter(Product.name.contains(search))
+        query, keys = search_keys(query, Product, search, keys)
     if category:
         query = query.filter(Product.category == category)
     
-    products = query.paginate(
-        page=page, per_page=10, error_out=False
-    )
+    products = keyset_page(query, keys, cursor, per_page=10)
     
     categories = db.session.query(Product.category).distinct().all()
     categories = [cat[0] for cat in categories]
@@ -318,15 +1629,25 @@ def add_product():
             name=request.form['name'],
             category=request.form['category'],
             brand=request.form['brand'],
-            mrp_price=float(request.form['mrp_price']),
-            cost_price=float(request.form['cost_price']),
-            selling_price=float(request.form['selling_price']),
+            mrp_price=to_money(request.form['mrp_price']),
+            cost_price=to_money(request.form['cost_price']),
+            selling_price=to_money(request.form['selling_price']),
             gst_rate=float(request.form['gst_rate']),
             unit=request.form['unit'],
-            stock_quantity=int(request.form['stock_quantity']),
+            stock_quantity=0,
             vendor_id=int(request.form['vendor_id']) if request.form['vendor_id'] else None
         )
+        try:
+            opening = stock_figure(request.form.get('stock_quantity'))
+        except ValueError:
+            flash('Stock quantity must be a number of zero or more.', 'error')
+            return redirect(url_for('add_product'))
         db.session.add(product)
+        db.session.flush()
+        if opening:
+            adjust_stock(product.id, opening, 'opening')
+        record_low_stock()
+        invalidate_price_table()
         db.session.commit()
         flash('Product added successfully!', 'success')
         return redirect(url_for('products'))
@@ -343,13 +1664,28 @@ def edit_product(product_id):
         product.name = request.form['name']
         product.category = request.form['category']
         product.brand = request.form['brand']
-        product.mrp_price = float(request.form['mrp_price'])
-        product.cost_price = float(request.form['cost_price'])
-        product.selling_price = float(request.form['selling_price'])
+        product.mrp_price = to_money(request.form['mrp_price'])
+        product.cost_price = to_money(request.form['cost_price'])
+        product.selling_price = to_money(request.form['selling_price'])
         product.gst_rate = float(request.form['gst_rate'])
         product.unit=request.form['unit']
-        product.stock_quantity = int(request.form['stock_quantity'])
         product.vendor_id = int(request.form['vendor_id']) if request.form['vendor_id'] else None
+        db.session.flush()
+        # A changed stock figure is a stock count: the difference goes on the
+        # ledger, provided nothing moved the stock since the form was shown
+        try:
+            counted = stock_figure(request.form.get('stock_quantity'))
+            shown = float(request.form.get('original_stock', counted))
+        except ValueError:
+            db.session.rollback()
+            flash('Stock quantity must be a number of zero or more.', 'error')
+            return redirect(url_for('edit_product', product_id=product_id))
+        if counted != shown and not set_stock(product.id, counted, shown):
+            db.session.rollback()
+            flash('Stock changed while you were editing; check the new figure and save again.', 'error')
+            return redirect(url_for('edit_product', product_id=product_id))
+        record_low_stock()
+        invalidate_price_table()
         
         db.session.commit()
         flash('Product updated successfully!', 'success')
@@ -363,6 +1699,9 @@ def edit_product(product_id):
 def delete_product(product_id):
     product = Product.query.get_or_404(product_id)
     db.session.delete(product)
+    record_deletion(product)
+    record_low_stock()
+    invalidate_price_table()
     db.session.commit()
     flash('Product deleted successfully!', 'success')
     return redirect(url_for('products'))
@@ -371,21 +1710,15 @@ def delete_product(product_id):
 @app.route('/customers')
 @login_required
 def customers():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     search = request.args.get('search', '', type=str)
     
     query = Customer.query
+    keys = [Customer.name, Customer.id]
     if search:
-        query = query.filter(
-            db.or_(
-                Customer.name.contains(search),
-                Customer.mobile_number.contains(search)
-            )
-        )
+        query, keys = search_keys(query, Customer, search, keys)
     
-    customers = query.paginate(
-        page=page, per_page=10, error_out=False
-    )
+    customers = keyset_page(query, keys, cursor, per_page=10)
     
     return render_template('customers.html', customers=customers, search=search)
 
@@ -401,6 +1734,8 @@ def add_customer():
         )
         try:
             db.session.add(customer)
+            db.session.flush()
+            bump_daily_summary(customer.created_at.date(), new_customers=1)
             db.session.commit()
             flash('Customer added successfully!', 'success')
             return redirect(url_for('customers'))
@@ -436,6 +1771,9 @@ def edit_customer(customer_id):
 def delete_customer(customer_id):
     customer = Customer.query.get_or_404(customer_id)
     db.session.delete(customer)
+    record_deletion(customer)
+    if customer.created_at:
+        bump_daily_summary(customer.created_at.date(), new_customers=-1)
     db.session.commit()
     flash('Customer deleted successfully!', 'success')
     return redirect(url_for('customers'))
@@ -444,21 +1782,15 @@ def delete_customer(customer_id):
 @app.route('/vendors')
 @login_required
 def vendors():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     search = request.args.get('search', '', type=str)
     
     query = Vendor.query
+    keys = [Vendor.name, Vendor.id]
     if search:
-        query = query.filter(
-            db.or_(
-                Vendor.name.contains(search),
-                Vendor.mobile_number.contains(search)
-            )
-        )
+        query, keys = search_keys(query, Vendor, search, keys)
     
-    vendors = query.paginate(
-        page=page, per_page=10, error_out=False
-    )
+    vendors = keyset_page(query, keys, cursor, per_page=10)
     
     return render_template('vendors.html', vendors=vendors, search=search)
 
@@ -515,20 +1847,20 @@ def delete_vendor(vendor_id):
 @app.route('/stock')
 @login_required
 def stock_management():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     search = request.args.get('search', '', type=str)
     low_stock = request.args.get('low_stock', False, type=bool)
     
     query = Product.query
+    keys = [Product.name, Product.id]
     
     if search:
-        query = query.filter(Product.name.contains(search))
+        query, keys = search_keys(query, Product, search, keys)
     if low_stock:
         query = query.filter(Product.stock_quantity <= 10)
     
-    products = query.paginate(
-        page=page, per_page=15, error_out=False
-    )
+    # The catalogue is small enough to count for the Total Products card
+    products = keyset_page(query, keys, cursor, per_page=15, total=query.count())
 
     return render_template('stock_management.html', products=products, search=search, low_stock=low_stock)
 
@@ -540,162 +1872,925 @@ def update_stock(product_id):
     quantity = int(request.form['quantity'])
     
     if action == 'add':
-        product.stock_quantity += quantity
+        adjust_stock(product.id, quantity, 'adjustment')
         flash(f'Added {quantity} items to {product.name}', 'success')
     elif action == 'remove':
-        if product.stock_quantity >= quantity:
-            product.stock_quantity -= quantity
+        if adjust_stock(product.id, -quantity, 'adjustment'):
             flash(f'Removed {quantity} items from {product.name}', 'success')
         else:
             flash('Insufficient stock!', 'error')
             return redirect(url_for('stock_management'))
     
+    record_low_stock()
     db.session.commit()
     return redirect(url_for('stock_management'))
 
-# POS Billing Routes
-@app.route('/pos')
-@login_required
-def pos_billing():
-    products = Product.query.filter(Product.stock_quantity > 0).all()
-    customers = Customer.query.all()
-    categories = db.session.query(Product.category).distinct().all()
-    categories = [cat[0] for cat in categories]
-    last_invoice = Invoice.query.order_by(Invoice.id.desc()).first()
-    bill_no = f"INV-{(last_invoice.id + 1) if last_invoice else 1:03d}"
+# Catalogue API
+# The POS and purchase screens keep a local copy of the catalogue and fetch only
+# rows changed since their last sync; unchanged responses come back as 304.
+CATALOGUE_PAGE_LIMIT = 1000
+# Rows stamped in the last moments may belong to transactions that commit out
+# of timestamp order, so delta syncs leave them for the next sync.
+CATALOGUE_SETTLE_TIME = timedelta(seconds=2)
 
-    # Provide JSON-serializable product dicts for client-side pagination
-    product_dicts = [
-        {
-            'id': p.id,
-            'name': p.name,
-            'category': p.category or '',
-            'brand': p.brand or '',
-            'selling_price': p.selling_price,
-            'cost_price': p.cost_price,
-            'gst_rate': p.gst_rate,
-            'unit':p.unit,
-            'stock_quantity': p.stock_quantity,
-        }
-        for p in products
-    ]
+def product_dict(product):
+    return {
+        'id': product.id,
+        'name': product.name,
+        'category': product.category or '',
+        'brand': product.brand or '',
+        'selling_price': product.selling_price,
+        'cost_price': product.cost_price,
+        'gst_rate': product.gst_rate,
+        'unit': product.unit,
+        'stock_quantity': product.stock_quantity,
+    }
 
-    customer_dicts = [
-        {
-            'id': c.id,
-            'name': c.name,
-            'mobile_number': c.mobile_number or '',
-            'address':c.address or ''
+def customer_dict(customer):
+    return {
+        'id': customer.id,
+        'name': customer.name,
+        'mobile_number': customer.mobile_number or '',
+        'email': customer.email or '',
+        'address': customer.address or '',
+        'balance_due': customer.balance_due,
+    }
+
+def record_deletion(record):
+    db.session.add(DeletedRecord(table_name=record.__tablename__, record_id=record.id))
+
+def catalogue_etag(model, cutoff):
+    """Fingerprint of the model's last change and deletion plus the request arguments"""
+    last_change = db.session.query(db.func.max(model.updated_at)).scalar()
+    last_deletion = db.session.query(db.func.max(DeletedRecord.deleted_at)).filter(
+        DeletedRecord.table_name == model.__tablename__
+    ).scalar()
+    # While a change is still settling the delta depends on the clock, not the data
+    if last_change and last_change > cutoff:
+        last_change = cutoff
+    if last_deletion and last_deletion > cutoff:
+        last_deletion = cutoff
+    key = repr((model.__tablename__, last_change, last_deletion, sorted(request.args.items(multi=True))))
+    return hashlib.sha1(key.encode()).hexdigest()
+
+def catalogue_response(model, serialize, browse_query):
+    """Browse a page of rows, or with updated_since return the rows changed after the cursor"""
+    cutoff = datetime.utcnow() - CATALOGUE_SETTLE_TIME
+    etag = catalogue_etag(model, cutoff)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    if 'updated_since' in request.args:
+        # Delta sync ignores the browse filters so that every change reaches the client
+        limit = min(request.args.get('limit', 100, type=int), CATALOGUE_PAGE_LIMIT)
+        since = None
+        if request.args['updated_since']:
+            try:
+                since = datetime.fromisoformat(request.args['updated_since'])
+            except ValueError:
+                return jsonify({'success': False, 'message': 'Invalid updated_since'}), 400
+        after_id = request.args.get('after_id', 0, type=int)
+
+        query = model.query.filter(model.updated_at <= cutoff)
+        deleted = []
+        if since:
+            query = query.filter(db.or_(
+                model.updated_at > since,
+                db.and_(model.updated_at == since, model.id > after_id)
+            ))
+            deleted = [record_id for (record_id,) in db.session.query(DeletedRecord.record_id).filter(
+                DeletedRecord.table_name == model.__tablename__,
+                DeletedRecord.deleted_at > since,
+                DeletedRecord.deleted_at <= cutoff
+            )]
+        rows = query.order_by(model.updated_at, model.id).limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        # Once caught up the cursor moves to the cutoff so the next sync starts there
+        last_seen = (rows[-1].updated_at, rows[-1].id) if has_more else (cutoff, 0)
+        payload = {
+            'items': [serialize(row) for row in rows],
+            'deleted': deleted,
+            'has_more': has_more,
+            'cursor': {'updated_since': last_seen[0].isoformat(), 'after_id': last_seen[1]},
+        }
+    else:
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = min(request.args.get('per_page', 20, type=int), CATALOGUE_PAGE_LIMIT)
+        rows = browse_query.offset((page - 1) * per_page).limit(per_page + 1).all()
+        payload = {
+            'items': [serialize(row) for row in rows[:per_page]],
+            'page': page,
+            'has_next': len(rows) > per_page,
         }
-        for c in customers
-    ]
 
-    return render_template(
-        'pos_billing.html',
-        products=products,  # still used for server-rendered cards if any
-        customers=customers,
-        categories=categories,
-        bill_no=bill_no,
-        products_json=product_dicts,
-        customers_json=customer_dicts,
-    )
+    response = jsonify(payload)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
-@app.route('/pos/addCustomer', methods=['POST'])
+@app.route('/api/products')
 @login_required
-def addCustomerFromPOS():
-    data=request.get_json()
-    customer = Customer(
-            name=data.get('name'),
-            mobile_number=data.get('mobile'),
-            email=data.get('email'),
-            address=data.get('address')
-        )
-    try:
-        db.session.add(customer)
-        db.session.commit()
-        #flash('Customer added successfully!', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash('Mobile number already exists!', 'error')
+def api_products():
+    search = request.args.get('search', '', type=str)
+    category = request.args.get('category', '', type=str)
+    query = Product.query
+    if category:
+        query = query.filter(Product.category == category)
+    if request.args.get('in_stock'):
+        query = query.filter(Product.stock_quantity > 0)
+    if search:
+        query = search_ranked(query, Product, search)
+    else:
+        query = query.order_by(Product.name, Product.id)
+    return catalogue_response(Product, product_dict, query)
 
-    return jsonify({'success': True, 'customerId': customer.id})
+@app.route('/api/customers')
+@login_required
+def api_customers():
+    search = request.args.get('search', '', type=str)
+    query = Customer.query
+    if search:
+        query = search_ranked(query, Customer, search)
+    else:
+        query = query.order_by(Customer.name, Customer.id)
+    return catalogue_response(Customer, customer_dict, query)
 
+# Bill numbering
+DOCUMENT_SERIES = {
+    'invoice': ('INV', 'INVOICE_NUMBER_FORMAT'),
+    'purchase': ('PUR', 'PURCHASE_NUMBER_FORMAT'),
+}
+_reserved_blocks = {}
+_reserved_blocks_lock = threading.Lock()
 
+def financial_year(day=None):
+    day = day or datetime.now().date()
+    start = day.year if day.month >= 4 else day.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
 
-@app.route('/pos/addVendor', methods=['POST'])
-@login_required
-def addVendorFromPO():
-    data=request.get_json()
-    vendor = Vendor(
-            name=data.get('name'),
-            mobile_number=data.get('mobile')
-        )
-    try:
-        db.session.add(vendor)
-        db.session.commit()
-        #flash('Customer added successfully!', 'success')
-    except Exception as e:
-        db.session.rollback()
-        flash('Mobile number already exists!', 'error')
+def document_series(kind, counter=None):
+    """Sequence name, number format and format fields for a document kind"""
+    prefix, config_key = DOCUMENT_SERIES[kind]
+    number_format = app.config[config_key]
+    fields = {'fy': financial_year(), 'counter': counter or app.config['POS_COUNTER']}
+    name = '/'.join([prefix] + [fields[field] for field in ('fy', 'counter') if '{%s}' % field in number_format])
+    return name, number_format, fields
 
-    return jsonify({'success': True, 'vendorId': vendor.id})
+def reserve_sequence(connection, name, count=1):
+    """Atomically take count numbers from a sequence and return the first.
 
+    The upsert both creates the counter and takes the write lock on it, so the
+    read that follows cannot race with another terminal.
+    """
+    table = DocumentSequence.__table__
+    connection.execute(upsert(
+        table, {'name': name, 'next_value': 1 + count}, ['name'],
+        lambda excluded: {'next_value': table.c.next_value + count},
+        dialect=connection.dialect.name
+    ))
+    next_value = connection.execute(db.select(table.c.next_value).where(table.c.name == name)).scalar()
+    return next_value - count
 
-@app.route('/pos/create-invoice', methods=['POST'])
-@login_required
-def create_invoice():
-    data = request.get_json()
+def next_document_number(kind, counter=None):
+    """Allocate the next bill number; call before the document's own writes"""
+    name, number_format, fields = document_series(kind, counter)
+    block_size = app.config['BILL_NUMBER_BLOCK_SIZE']
+    if block_size <= 1:
+        # Allocated inside the document's transaction, so a failed bill gives the number back
+        seq = reserve_sequence(db.session.connection(), name)
+    else:
+        with _reserved_blocks_lock:
+            seq, end = _reserved_blocks.get(name, (0, 0))
+            if seq >= end:
+                with db.engine.begin() as connection:
+                    seq = reserve_sequence(connection, name, block_size)
+                end = seq + block_size
+            _reserved_blocks[name] = (seq + 1, end)
+    return number_format.format(seq=seq, **fields)
+
+def peek_document_number(kind, counter=None):
+    """The number the next bill will most likely get, without reserving it"""
+    name, number_format, fields = document_series(kind, counter)
+    with _reserved_blocks_lock:
+        seq, end = _reserved_blocks.get(name, (0, 0))
+    if seq >= end:
+        seq = db.session.query(DocumentSequence.next_value).filter_by(name=name).scalar() or 1
+    return number_format.format(seq=seq, **fields)
+
+# Stock ledger
+# Stock only changes through these helpers (and write_document_lines), which
+# append a StockMovement for every change to product.stock_quantity.
+STOCK_EPOCH = datetime(1900, 1, 1)
+# Products per IN list when snapshotting
+STOCK_SNAPSHOT_BATCH = 500
+
+def acting_user_id():
+    if has_request_context() and current_user.is_authenticated:
+        return current_user.id
+    return None
+
+def record_movements(movements, created_at=None, user_id=None):
+    """Append ledger rows inside the caller's transaction.
+
+    Each movement is a dict with product_id, quantity and reason, and
+    optionally document_type and document_id. user_id defaults to the
+    signed-in user.
+    """
+    user_id = user_id or acting_user_id()
+    created_at = created_at or datetime.utcnow()
+    db.session.execute(db.insert(StockMovement.__table__), [{
+        'product_id': movement['product_id'],
+        'quantity': movement['quantity'],
+        'reason': movement['reason'],
+        'document_type': movement.get('document_type'),
+        'document_id': movement.get('document_id'),
+        'user_id': user_id,
+        'created_at': created_at,
+    } for movement in movements])
+
+def adjust_stock(product_id, quantity, reason):
+    """Move one product's stock by quantity; False if it would go below zero"""
+    update = db.update(Product).where(Product.id == product_id)
+    if quantity < 0:
+        update = update.where(Product.stock_quantity >= -quantity)
+    result = db.session.execute(update.values(
+        stock_quantity=Product.stock_quantity + quantity
+    ).execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        return False
+    record_movements([{'product_id': product_id, 'quantity': quantity, 'reason': reason}])
+    return True
+
+def stock_figure(value):
+    """A stock quantity typed on a form (blank is zero); ValueError unless it is a number of zero or more"""
+    quantity = float(value or 0)
+    if not math.isfinite(quantity) or quantity < 0:
+        raise ValueError(f'{value!r} is not a stock quantity')
+    return quantity
+
+def set_stock(product_id, counted, expected):
+    """Record an adjustment from expected to counted; False if the stock is no longer expected"""
+    result = db.session.execute(db.update(Product).where(
+        Product.id == product_id, db.func.coalesce(Product.stock_quantity, 0) == expected
+    ).values(stock_quantity=counted).execution_options(synchronize_session=False))
+    if result.rowcount != 1:
+        return False
+    record_movements([{'product_id': product_id, 'quantity': counted - expected, 'reason': 'adjustment'}])
+    return True
+
+def stock_as_of_query(when, product_ids=None):
+    """Stock per product at when: latest snapshot at or before it plus later movements.
+
+    Both lookups are index range reads per product, so the cost depends on
+    the movements since the last snapshot, not on the length of the ledger.
+    """
+    def snapshot(column):
+        return db.select(column).where(
+            StockSnapshot.product_id == Product.id, StockSnapshot.as_of <= when
+        ).order_by(StockSnapshot.as_of.desc()).limit(1).correlate(Product).scalar_subquery()
+
+    moved = db.select(db.func.coalesce(db.func.sum(StockMovement.quantity), 0)).where(
+        StockMovement.product_id == Product.id,
+        StockMovement.created_at > db.func.coalesce(snapshot(StockSnapshot.as_of), STOCK_EPOCH),
+        StockMovement.created_at <= when
+    ).correlate(Product).scalar_subquery()
+    query = db.select(Product.id, db.func.coalesce(snapshot(StockSnapshot.quantity), 0) + moved)
+    if product_ids is not None:
+        query = query.where(Product.id.in_(product_ids))
+    return query
+
+def stock_as_of(when, product_ids=None, connection=None):
+    """{product_id: quantity} at when"""
+    connection = connection or db.session.connection()
+    return dict(connection.execute(stock_as_of_query(when, product_ids)).all())
+
+def take_stock_snapshots(connection, as_of):
+    """Snapshot, at as_of, every product whose stock moved since its last snapshot"""
+    last = db.select(db.func.max(StockSnapshot.as_of)).where(
+        StockSnapshot.product_id == Product.id, StockSnapshot.as_of <= as_of
+    ).correlate(Product).scalar_subquery()
+    moved = db.select(StockMovement.id).where(
+        StockMovement.product_id == Product.id,
+        StockMovement.created_at > db.func.coalesce(last, STOCK_EPOCH),
+        StockMovement.created_at <= as_of
+    ).exists()
+    product_ids = connection.execute(db.select(Product.id).where(moved)).scalars().all()
+    for start in range(0, len(product_ids), STOCK_SNAPSHOT_BATCH):
+        quantities = stock_as_of(as_of, product_ids[start:start + STOCK_SNAPSHOT_BATCH], connection)
+        connection.execute(db.insert(StockSnapshot), [
+            {'product_id': product_id, 'as_of': as_of, 'quantity': quantity}
+            for product_id, quantity in quantities.items()
+        ])
+    return len(product_ids)
+
+def month_starts(first, last):
+    """The first instant of every month after first, up to and including last"""
+    month = datetime(first.year, first.month, 1)
+    while True:
+        month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+        if month > last:
+            return
+        yield month
+
+def rebuild_stock_snapshots(connection):
+    """Replace the snapshots with one per product per month it had movements"""
+    connection.execute(db.delete(StockSnapshot))
+    first = connection.execute(db.select(db.func.min(StockMovement.created_at))).scalar()
+    if first is None:
+        return 0
+    return sum(take_stock_snapshots(connection, month) for month in month_starts(first, datetime.utcnow()))
+
+def stock_ledger_total():
+    return db.select(db.func.coalesce(db.func.sum(StockMovement.quantity), 0)).where(
+        StockMovement.product_id == Product.id
+    ).scalar_subquery()
+
+def stock_mismatches():
+    """Count products whose stock_quantity disagrees with their ledger"""
+    return db.session.query(db.func.count(Product.id)).filter(
+        db.func.coalesce(Product.stock_quantity, 0) != stock_ledger_total()
+    ).scalar()
+
+def repair_stock():
+    """Recompute stock_quantity from the ledger and rebuild the snapshots"""
+    db.session.execute(db.update(Product).values(
+        stock_quantity=stock_ledger_total()
+    ).execution_options(synchronize_session=False))
+    return rebuild_stock_snapshots(db.session.connection())
+
+def seed_stock_ledger(connection):
+    """Ledger rows for existing purchase and sale lines, plus an opening balance per product.
+
+    The opening balance is whatever makes each product's ledger add up to its
+    current stock_quantity, which also absorbs manual changes made before the
+    ledger existed. It is dated when the product was created.
+    """
+    moved_at = {'purchase': Purchase.created_at, 'invoice': Invoice.created_at}
+    for document_type, line_model, document_model, key, sign in (
+        ('purchase', PurchaseItem, Purchase, PurchaseItem.purchase_id, 1),
+        ('invoice', InvoiceItem, Invoice, InvoiceItem.invoice_id, -1),
+    ):
+        connection.execute(db.insert(StockMovement).from_select(
+            ['product_id', 'quantity', 'reason', 'document_type', 'document_id', 'created_at'],
+            db.select(
+                line_model.product_id, line_model.quantity * sign,
+                literal('purchase' if sign > 0 else 'sale'), literal(document_type), document_model.id,
+                db.func.coalesce(moved_at[document_type], datetime.utcnow())
+            ).join(document_model, key == document_model.id).join(Product, line_model.product_id == Product.id)
+        ))
+    opening = db.func.coalesce(Product.stock_quantity, 0) - stock_ledger_total()
+    connection.execute(db.insert(StockMovement).from_select(
+        ['product_id', 'quantity', 'reason', 'created_at'],
+        db.select(
+            Product.id, opening, literal('opening'), db.func.coalesce(Product.created_at, datetime.utcnow())
+        ).where(opening != 0)
+    ))
+    connection.execute(db.update(Product).where(Product.stock_quantity.is_(None)).values(stock_quantity=0))
+
+@app.cli.command('check-stock')
+@click.option('--repair', is_flag=True, help='Recompute stock from the ledger and rebuild snapshots')
+def check_stock_command(repair):
+    """Compare each product's stock_quantity with its movement ledger"""
+    count = stock_mismatches()
+    print(f"product: {count} mismatched")
+    if repair:
+        snapshots = repair_stock()
+        db.session.commit()
+        print(f"Rebuilt stock from the ledger, {snapshots} snapshots")
+    elif count:
+        sys.exit(1)
+
+@app.cli.command('take-stock-snapshots')
+def take_stock_snapshots_command():
+    """Snapshot stock for products that moved since their last snapshot; run daily or monthly"""
+    count = take_stock_snapshots(db.session.connection(), datetime.utcnow())
+    db.session.commit()
+    print(f"Snapshotted {count} products")
+
+@app.cli.command('bench-stock-as-of')
+@click.option('--products', default=20000, help='SKUs in the generated ledger')
+@click.option('--movements', default=500000, help='Ledger rows spread over two years')
+@click.option('--lookups', default=20, help='Whole-catalogue stock-on-date queries to time')
+def bench_stock_as_of_command(products, movements, lookups):
+    """Time stock on a date for every SKU: snapshots plus deltas against summing the ledger"""
+    rng = random.Random(7)
+    end = datetime(2026, 1, 1)
+    start = end - timedelta(days=730)
+    span = (end - start).total_seconds()
+
+    with tempfile.TemporaryDirectory() as folder:
+        engine = db.create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        for model in (Product, StockMovement, StockSnapshot):
+            model.__table__.create(engine)
+        with engine.begin() as connection:
+            connection.execute(db.insert(Product), [
+                {'name': f'Item {number}', 'category': 'Wire', 'brand': 'Bench', 'mrp_price': 100,
+                 'cost_price': 80, 'selling_price': 90, 'gst_rate': 18, 'stock_quantity': 0}
+                for number in range(products)
+            ])
+            for first in range(0, movements, 50000):
+                connection.execute(db.insert(StockMovement), [
+                    {'product_id': rng.randint(1, products), 'quantity': rng.choice((-2, -1, -1, 1, 5)),
+                     'reason': 'adjustment', 'created_at': start + timedelta(seconds=rng.uniform(0, span))}
+                    for _ in range(first, min(movements, first + 50000))
+                ])
+            started = time.perf_counter()
+            snapshots = sum(take_stock_snapshots(connection, month) for month in month_starts(start, end))
+            print(f"{snapshots} monthly snapshots in {time.perf_counter() - started:.1f} s")
+
+        def full_sum(when):
+            return db.select(StockMovement.product_id, db.func.sum(StockMovement.quantity)).where(
+                StockMovement.created_at <= when
+            ).group_by(StockMovement.product_id)
+
+        dates = [start + timedelta(seconds=rng.uniform(0, span)) for _ in range(lookups)]
+        mismatched = 0
+        with engine.connect() as connection:
+            for label, build in (('snapshots', stock_as_of_query), ('ledger sum', full_sum)):
+                timings = []
+                for when in dates:
+                    started = time.perf_counter()
+                    quantities = dict(connection.execute(build(when)).all())
+                    timings.append((time.perf_counter() - started) * 1000)
+                    if label == 'snapshots':
+                        expected = dict(connection.execute(full_sum(when)).all())
+                        mismatched += sum(1 for product_id, quantity in quantities.items()
+                                          if quantity != expected.get(product_id, 0))
+                timings.sort()
+                print(f"{label}: {products} products, {movements} movements, {lookups} dates, "
+                      f"p50 {timings[len(timings) // 2]:.0f} ms, p95 {timings[int(len(timings) * 0.95)]:.0f} ms")
+        engine.dispose()
+    print(f"{mismatched} quantities differ from the ledger sum")
+    if mismatched:
+        sys.exit(1)
+
+# Document lines and stock
+class StockError(Exception):
+    """Raised when basket lines cannot be applied; errors are per line"""
+    def __init__(self, errors):
+        super().__init__('; '.join(error['message'] for error in errors))
+        self.errors = errors
+
+class LineError(StockError):
+    """Raised when basket lines are malformed, e.g. a fractional quantity"""
+
+def whole_quantity(value):
+    """A line quantity as a positive int; ValueError for fractions, zero and anything not a number"""
+    try:
+        quantity = Decimal(str(value).strip())
+    except ArithmeticError:
+        raise ValueError(f'{value!r} is not a number')
+    if not quantity.is_finite() or quantity <= 0 or quantity != quantity.to_integral_value():
+        raise ValueError(f'{value!r} is not a whole number above zero')
+    return int(quantity)
+
+def write_document_lines(line_model, document_id, items, stock_direction):
+    """Insert a bill's lines and move stock with set-based statements.
+
+    Products are loaded with one IN query, lines and ledger rows go in as one
+    executemany each and stock moves in one UPDATE. Sales (stock_direction -1) only decrement rows
+    that still have enough stock; if any line would oversell, StockError is
+    raised and the caller must roll back. Quantities are whole units; any
+    other quantity raises LineError before anything is written. An empty
+    basket writes nothing.
+    """
+    quantities = {}
+    lines = []
+    errors = []
+    for line, item in enumerate(items, 1):
+        try:
+            product_id = int(item['product_id'])
+            quantity = whole_quantity(item['quantity'])
+        except (KeyError, TypeError, ValueError):
+            errors.append({'line': line, 'message': f'Line {line}: quantity must be a whole number more than zero'})
+            continue
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+        lines.append((product_id, quantity, item))
+    if errors:
+        raise LineError(errors)
+    if not lines:
+        return
+
+    products = {
+        row.id: row for row in db.session.query(
+            Product.id, Product.name, Product.gst_rate, Product.stock_quantity
+        ).filter(Product.id.in_(quantities))
+    }
+
+    def line_errors(stock):
+        errors = []
+        reported = set()
+        for line, item in enumerate(items, 1):
+            product_id = int(item['product_id'])
+            if product_id in reported:
+                continue
+            reported.add(product_id)
+            if product_id not in products:
+                errors.append({'line': line, 'product_id': product_id,
+                               'message': f'Line {line}: product {product_id} does not exist'})
+            elif stock_direction < 0 and quantities[product_id] > (stock.get(product_id) or 0):
+                product = products[product_id]
+                errors.append({'line': line, 'product_id': product_id, 'product_name': product.name,
+                               'requested': quantities[product_id], 'available': stock.get(product_id) or 0,
+                               'message': f'Line {line}: only {stock.get(product_id) or 0:g} of {product.name} in stock'})
+        return errors
+
+    errors = line_errors({product_id: row.stock_quantity for product_id, row in products.items()})
+    if errors:
+        raise StockError(errors)
+
+    delta = db.case(
+        {product_id: quantity for product_id, quantity in quantities.items()},
+        value=Product.id
+    )
+    update = db.update(Product).where(Product.id.in_(quantities))
+    if stock_direction < 0:
+        update = update.where(Product.stock_quantity >= delta).values(stock_quantity=Product.stock_quantity - delta)
+    else:
+        update = update.values(stock_quantity=Product.stock_quantity + delta)
+    result = db.session.execute(update.execution_options(synchronize_session=False))
+    if result.rowcount != len(quantities):
+        # Another counter sold the same stock since we read it
+        current = dict(db.session.query(Product.id, Product.stock_quantity).filter(Product.id.in_(quantities)))
+        raise StockError(line_errors(current))
+
+    document_type = 'invoice' if line_model is InvoiceItem else 'purchase'
+    record_movements([
+        {'product_id': product_id, 'quantity': quantity * stock_direction,
+         'reason': 'sale' if stock_direction < 0 else 'purchase',
+         'document_type': document_type, 'document_id': document_id}
+        for product_id, quantity in quantities.items()
+    ])
+
+    foreign_key = 'invoice_id' if line_model is InvoiceItem else 'purchase_id'
+    rows = []
+    for product_id, quantity, item in lines:
+        row = {
+            foreign_key: document_id,
+            'product_id': product_id,
+            'quantity': quantity,
+            'unit_price': item['unit_price'],
+            'total_price': item['total_price'],
+        }
+        if line_model is InvoiceItem:
+            row['gst_rate'] = products[row['product_id']].gst_rate
+        rows.append(row)
+    db.session.execute(db.insert(line_model), rows)
+
+# Balances
+# paid_amount and balance_due on each bill, and balance_due on its customer or
+# vendor, change together inside the transaction that records the money.
+BILL_PARTIES = {
+    'invoice': ('customer_id', 'customer', Payment, 'invoice_id'),
+    'purchase': ('vendor_id', 'vendor', VendorPayment, 'purchase_id'),
+}
+
+def bill_party(bill_model):
+    """(party foreign key, party model, payment model, payment foreign key) for a bill model"""
+    key, party_table, payment_model, payment_key = BILL_PARTIES[bill_model.__tablename__]
+    party_model = Customer if party_table == 'customer' else Vendor
+    return getattr(bill_model, key), party_model, payment_model, getattr(payment_model, payment_key)
+
+def adjust_party_balance(bill, amount):
+    key, party_model, payment_model, payment_key = bill_party(type(bill))
+    party_id = getattr(bill, key.key)
+    if party_id:
+        db.session.execute(
+            db.update(party_model).where(party_model.id == party_id)
+            .values(balance_due=party_model.balance_due + amount)
+        )
+
+def open_bill_balance(bill):
+    """Start a new invoice/purchase unpaid and add it to its party's balance"""
+    bill.paid_amount = 0
+    bill.balance_due = bill.final_amount
+    adjust_party_balance(bill, bill.final_amount)
+
+def apply_bill_payment(bill, amount):
+    """Apply a payment to a bill and its party's balance and update the payment status"""
+    model = type(bill)
+    # SQL expressions so concurrent payments add up instead of overwriting each other
+    bill.paid_amount = model.paid_amount + amount
+    bill.balance_due = model.balance_due - amount
+    adjust_party_balance(bill, -amount)
+    db.session.flush()
+    bill.payment_status = 'paid' if bill.paid_amount >= bill.final_amount else 'partial'
+
+def balance_mismatches():
+    """Count bills and parties whose stored balances disagree with their payments"""
+    counts = {}
+    for bill_model in (Invoice, Purchase):
+        key, party_model, payment_model, payment_key = bill_party(bill_model)
+        paid = db.select(db.func.coalesce(db.func.sum(payment_model.amount), 0)).where(
+            payment_key == bill_model.id
+        ).scalar_subquery()
+        counts[bill_model.__tablename__] = db.session.query(db.func.count(bill_model.id)).filter(db.or_(
+            bill_model.paid_amount != paid,
+            bill_model.balance_due != bill_model.final_amount - paid
+        )).scalar()
+        owed = db.select(db.func.coalesce(db.func.sum(bill_model.balance_due), 0)).where(
+            key == party_model.id
+        ).scalar_subquery()
+        counts[party_model.__tablename__] = db.session.query(db.func.count(party_model.id)).filter(
+            party_model.balance_due != owed
+        ).scalar()
+    return counts
+
+def repair_balances():
+    """Recompute every stored balance from the payment tables"""
+    for bill_model in (Invoice, Purchase):
+        key, party_model, payment_model, payment_key = bill_party(bill_model)
+        paid = db.select(db.func.coalesce(db.func.sum(payment_model.amount), 0)).where(
+            payment_key == bill_model.id
+        ).scalar_subquery()
+        db.session.execute(db.update(bill_model).values(
+            paid_amount=paid, balance_due=bill_model.final_amount - paid
+        ).execution_options(synchronize_session=False))
+        owed = db.select(db.func.coalesce(db.func.sum(bill_model.balance_due), 0)).where(
+            key == party_model.id
+        ).scalar_subquery()
+        db.session.execute(db.update(party_model).values(
+            balance_due=owed
+        ).execution_options(synchronize_session=False))
+
+@app.cli.command('check-balances')
+@click.option('--repair', is_flag=True, help='Recompute stored balances from payments')
+def check_balances_command(repair):
+    """Compare stored bill and party balances with the payment tables"""
+    counts = balance_mismatches()
+    for table, count in counts.items():
+        print(f"{table}: {count} mismatched")
+    if not any(counts.values()):
+        return
+    if not repair:
+        sys.exit(1)
+    repair_balances()
+    db.session.commit()
+    print('Repaired balances')
+
+# Billing engine
+# Bills are priced on the server from the product table: line totals, the bill
+# discount and GST per rate. The POS asks /pos/quote as the basket changes, and
+# create_invoice stores what the same function returns for the same basket.
+class PricingError(StockError):
+    """Raised when basket lines cannot be priced; errors are per line"""
+
+# DocumentSequence row bumped whenever a price or GST rate may have changed, so
+# every worker process notices and reloads its table
+PRICE_VERSION = 'PRICES'
+_price_table = None
+_price_table_lock = threading.Lock()
+
+def invalidate_price_table():
+    """Mark cached prices stale; call inside the transaction that changes products"""
+    global _price_table
+    reserve_sequence(db.session.connection(), PRICE_VERSION)
+    with _price_table_lock:
+        _price_table = None
+
+def price_table():
+    """{product_id: (name, selling_price, gst_rate)}, reloaded when the price version moves"""
+    global _price_table
+    version = db.session.query(DocumentSequence.next_value).filter_by(name=PRICE_VERSION).scalar()
+    cached = _price_table
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    # Read after the version, so a concurrent edit can only make the table newer than its version
+    prices = {
+        product_id: (name, selling_price, Decimal(str(gst_rate or 0)))
+        for product_id, name, selling_price, gst_rate in db.session.query(
+            Product.id, Product.name, Product.selling_price, Product.gst_rate
+        )
+    }
+    with _price_table_lock:
+        _price_table = (version, prices)
+    return prices
+
+def price_basket(items, discount=0, inter_state=False):
+    """Price a basket of {product_id, quantity, discount} lines.
+
+    Line discounts come off each line and the bill discount is spread across
+    the lines in proportion to their value before GST, matching gst_lines().
+    Inter-state bills carry IGST instead of CGST/SGST. Raises PricingError.
+    """
+    prices = price_table()
+    zero = Decimal('0.00')
+    errors = []
+    lines = []
+    for line, item in enumerate(items, 1):
+        try:
+            product_id = int(item['product_id'])
+            quantity = item['quantity']
+            line_discount = to_money(item.get('discount'))
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            errors.append({'line': line, 'message': f'Line {line}: product and quantity are required'})
+            continue
+        if product_id not in prices:
+            errors.append({'line': line, 'product_id': product_id,
+                           'message': f'Line {line}: product {product_id} does not exist'})
+            continue
+        name, unit_price, rate = prices[product_id]
+        try:
+            quantity = whole_quantity(quantity)
+        except ValueError:
+            errors.append({'line': line, 'product_id': product_id, 'product_name': name,
+                           'message': f'Line {line}: quantity of {name} must be a whole number more than zero'})
+            continue
+        gross = to_money(unit_price * quantity)
+        if not zero <= line_discount <= gross:
+            errors.append({'line': line, 'product_id': product_id, 'product_name': name,
+                           'message': f'Line {line}: discount on {name} must be between 0 and {gross}'})
+            continue
+        lines.append({'product_id': product_id, 'name': name, 'quantity': quantity, 'unit_price': unit_price,
+                      'discount': line_discount, 'total_price': gross - line_discount, 'gst_rate': rate})
+
+    subtotal = sum((line['total_price'] for line in lines), zero)
+    discount = to_money(discount)
+    if not errors and not zero <= discount <= subtotal:
+        errors.append({'line': None, 'message': f'Bill discount must be between 0 and {subtotal}'})
+    if errors:
+        raise PricingError(errors)
+
+    total_amount = subtotal - discount
+    taxes = {}
+    for line in lines:
+        taxable = to_money(line['total_price'] * total_amount / subtotal) if subtotal else zero
+        cgst, sgst, igst = split_gst(taxable, line['gst_rate'], inter_state)
+        tax = taxes.setdefault(line['gst_rate'], {'rate': line['gst_rate'], 'taxable': zero,
+                                                  'cgst': zero, 'sgst': zero, 'igst': zero})
+        tax['taxable'] += taxable
+        tax['cgst'] += cgst
+        tax['sgst'] += sgst
+        tax['igst'] += igst
+
+    quote = {
+        'items': lines,
+        'subtotal': subtotal,
+        'discount': discount,
+        'total_amount': total_amount,
+        'inter_state': bool(inter_state),
+        'taxes': [taxes[rate] for rate in sorted(taxes)],
+    }
+    for part in ('cgst', 'sgst', 'igst'):
+        quote[part] = sum((tax[part] for tax in taxes.values()), zero)
+    quote['final_amount'] = total_amount + quote['cgst'] + quote['sgst'] + quote['igst']
+    return quote
+
+# POS Billing Routes
+@app.route('/pos')
+@login_required
+def pos_billing():
+    # Products and customers are fetched by the page from the catalogue API
+    categories = db.session.query(Product.category).distinct().all()
+    categories = [cat[0] for cat in categories]
+    bill_no = peek_document_number('invoice', request.args.get('counter'))
+
+    return render_template(
+        'pos_billing.html',
+        categories=categories,
+        bill_no=bill_no,
+    )
+
+@app.route('/pos/addCustomer', methods=['POST'])
+@login_required
+def addCustomerFromPOS():
+    data=request.get_json()
+    customer = Customer(
+            name=data.get('name'),
+            mobile_number=data.get('mobile'),
+            email=data.get('email'),
+            address=data.get('address')
+        )
+    try:
+        db.session.add(customer)
+        db.session.flush()
+        bump_daily_summary(customer.created_at.date(), new_customers=1)
+        db.session.commit()
+        #flash('Customer added successfully!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('Mobile number already exists!', 'error')
+
+    return jsonify({'success': True, 'customerId': customer.id})
+
+
+
+@app.route('/pos/addVendor', methods=['POST'])
+@login_required
+def addVendorFromPO():
+    data=request.get_json()
+    vendor = Vendor(
+            name=data.get('name'),
+            mobile_number=data.get('mobile')
+        )
+    try:
+        db.session.add(vendor)
+        db.session.commit()
+        #flash('Customer added successfully!', 'success')
+    except Exception as e:
+        db.session.rollback()
+        flash('Mobile number already exists!', 'error')
+
+    return jsonify({'success': True, 'vendorId': vendor.id})
+
+
+@app.route('/pos/create-invoice', methods=['POST'])
+@login_required
+@retry_on_locked
+def create_invoice():
+    data = request.get_json()
+    amounts, errors = money_fields(data, 'payment_amount')
+    if errors:
+        return jsonify({'success': False, 'message': errors[0]['message'], 'errors': errors}), 400
+    
+    # Amounts come from the billing engine; totals sent by the browser are ignored
+    try:
+        quote = price_basket(data.get('items') or [], data.get('discount'), data.get('inter_state'))
+    except PricingError as e:
+        return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 400
     
     # Generate bill number
-    last_invoice = Invoice.query.order_by(Invoice.id.desc()).first()
-    bill_no = f"INV-{(last_invoice.id + 1) if last_invoice else 1:03d}"
+    bill_no = next_document_number('invoice', data.get('counter'))
     
     # Create invoice
     invoice = Invoice(
         bill_no=bill_no,
         customer_id=data.get('customer_id'),
-        total_amount=data['total_amount'],
-        discount=data.get('discount', 0),
-        cgst=data.get('cgst', 0),
-        sgst=data.get('sgst', 0),
-        igst=data.get('igst', 0),
-        final_amount=data['final_amount']
+        total_amount=quote['total_amount'],
+        discount=quote['discount'],
+        cgst=quote['cgst'],
+        sgst=quote['sgst'],
+        igst=quote['igst'],
+        final_amount=quote['final_amount']
     )
     
     db.session.add(invoice)
+    open_bill_balance(invoice)
     db.session.flush()  # Get the invoice ID
 
-    if float(data.get('payment_amount'))!=0.0:
+    if amounts['payment_amount'] != 0:
         payment = Payment(
         invoice_id=invoice.id,
-        amount=float(data.get('payment_amount')),
+        amount=amounts['payment_amount'],
         payment_method=data.get('payment_method'),
         status='completed'
         )
         db.session.add(payment)
-        if float(data.get('payment_amount')) >= invoice.final_amount:
-            invoice.payment_status = 'paid'
-        else:
-            invoice.payment_status = 'partial'
-    
-    # Add invoice items
-    for item in data['items']:
-        invoice_item = InvoiceItem(
-            invoice_id=invoice.id,
-            product_id=item['product_id'],
-            quantity=item['quantity'],
-            unit_price=item['unit_price'],
-            total_price=item['total_price']
-        )
-        db.session.add(invoice_item)
-        
-        # Update stock
-        product = Product.query.get(item['product_id'])
-        product.stock_quantity -= item['quantity']
+        apply_bill_payment(invoice, payment.amount)
+    
+    # Add invoice items and decrement stock
+    try:
+        write_document_lines(InvoiceItem, invoice.id, quote['items'], -1)
+    except StockError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 409
     
+    bump_daily_summary(invoice.created_at.date(), sales_total=invoice.final_amount, invoice_count=1)
+    record_low_stock()
     db.session.commit()
     
-    return jsonify({'success': True, 'bill_no': bill_no, 'invoice_id': invoice.id})
+    return jsonify({'success': True, 'bill_no': bill_no, 'invoice_id': invoice.id, 'quote': quote})
+
+@app.route('/pos/quote', methods=['POST'])
+@login_required
+def pos_quote():
+    """Price the POS basket; called as the cashier edits it"""
+    data = request.get_json() or {}
+    try:
+        quote = price_basket(data.get('items') or [], data.get('discount'), data.get('inter_state'))
+    except PricingError as e:
+        return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 400
+    return jsonify(dict(quote, success=True))
+
+@app.cli.command('bench-quote')
+@click.option('--lines', default=100, help='Lines in the basket')
+@click.option('--runs', default=500, help='Quotes to time')
+def bench_quote_command(lines, runs):
+    """Time /pos/quote for a basket of the given size"""
+    client = check_client()
+    product_ids = [product_id for (product_id,) in db.session.query(Product.id).order_by(Product.id).limit(lines)]
+    if client is None or not product_ids:
+        print('Needs at least one user and one product')
+        sys.exit(1)
+    basket = {'discount': 10, 'items': [
+        {'product_id': product_ids[line % len(product_ids)], 'quantity': 1 + line % 3} for line in range(lines)
+    ]}
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        response = client.post('/pos/quote', json=basket)
+        timings.append((time.perf_counter() - started) * 1000)
+        if response.status_code != 200:
+            print(f"Quote failed: {response.status_code} {response.get_data(as_text=True)[:200]}")
+            sys.exit(1)
+    timings.sort()
+    p95 = timings[int(len(timings) * 0.95)]
+    print(f"{lines} lines, {runs} quotes, p50 {timings[len(timings) // 2]:.2f} ms, p95 {p95:.2f} ms")
+    if p95 >= 50:
+        sys.exit(1)
 
 
 
@@ -703,7 +2798,7 @@ def create_invoice():
 @app.route('/expenses')
 @login_required
 def expenses():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     category = request.args.get('category', '', type=str)
     month = request.args.get('month', datetime.now().strftime('%Y-%m'), type=str)
     current_month = datetime.now().strftime('%Y-%m')
@@ -727,19 +2822,31 @@ def expenses():
             end_date = datetime(int(year), int(month_num) + 1, 1)
         query = query.filter(Expense.expense_date >= start_date, Expense.expense_date < end_date)
     
-    expenses = query.order_by(Expense.expense_date.desc()).paginate(
-        page=page, per_page=10, error_out=False
-    )
+    expenses = keyset_page(query, [Expense.expense_date, Expense.id], cursor, per_page=10, descending=True)
     
+    categories, monthly_total, financial_year_total, fy_start, fy_end = expense_totals(month, category)
+    
+    filtered_month_display = datetime(int(year), int(month_num), 1).strftime('%B %Y')
+    
+    return render_template('expenses.html', expenses=expenses, categories=categories, monthly_total=monthly_total,yearly=financial_year_total,fy_start=fy_start,fy_end=fy_end,month=filtered_month_display)
+
+@cached_report(Expense)
+def expense_totals(month, category):
+    """Categories, the month's total and the financial year's total for the expenses page"""
     categories = db.session.query(Expense.category).distinct().all()
     categories = [cat[0] for cat in categories]
     
     # Calculate monthly total
-    monthly_total = query.with_entities(db.func.sum(Expense.amount)).scalar() or 0
+    selected_year, selected_month = map(int, month.split('-'))
+    month_start = datetime(selected_year, selected_month, 1)
+    month_end = datetime(selected_year + 1, 1, 1) if selected_month == 12 else datetime(selected_year, selected_month + 1, 1)
+    month_query = Expense.query.filter(Expense.expense_date >= month_start, Expense.expense_date < month_end)
+    if category:
+        month_query = month_query.filter(Expense.category == category)
+    monthly_total = month_query.with_entities(db.func.sum(Expense.amount)).scalar() or 0
 
     
     # Financial Year Calculation (April 1st to March 31st)
-    selected_year, selected_month = map(int, month.split('-'))
     if selected_month >= 4:
         fy_start_year = selected_year
     else:
@@ -754,10 +2861,7 @@ def expenses():
         fy_query = fy_query.filter(Expense.category == category)
 
     financial_year_total = fy_query.with_entities(db.func.sum(Expense.amount)).scalar() or 0
-    
-    filtered_month_display = datetime(int(year), int(month_num), 1).strftime('%B %Y')
-    
-    return render_template('expenses.html', expenses=expenses, categories=categories, monthly_total=monthly_total,yearly=financial_year_total,fy_start=fy_start,fy_end=fy_end,month=filtered_month_display)
+    return categories, monthly_total, financial_year_total, fy_start, fy_end
 
 @app.route('/expenses/add', methods=['GET', 'POST'])
 @login_required
@@ -766,10 +2870,11 @@ def add_expense():
         expense = Expense(
             category=request.form['category'],
             description=request.form.get('description'),
-            amount=float(request.form['amount']),
+            amount=to_money(request.form['amount']),
             expense_date=datetime.strptime(request.form['expense_date'], '%Y-%m-%d')
         )
         db.session.add(expense)
+        bump_daily_summary(expense.expense_date.date(), expenses_total=expense.amount)
         db.session.commit()
         flash('Expense added successfully!', 'success')
         return redirect(url_for('expenses'))
@@ -781,6 +2886,7 @@ def add_expense():
 def delete_expense(expense_id):
     expense = Expense.query.get_or_404(expense_id)
     db.session.delete(expense)
+    bump_daily_summary(expense.expense_date.date(), expenses_total=-expense.amount)
     db.session.commit()
     flash('Expenses deleted successfully!', 'success')
     return redirect(url_for('expenses'))
@@ -791,10 +2897,12 @@ def edit_expense(expense_id):
     expense = Expense.query.get_or_404(expense_id)
     
     if request.method == 'POST':
+        bump_daily_summary(expense.expense_date.date(), expenses_total=-expense.amount)
         expense.category=request.form['category']
         expense.description=request.form.get('description')
-        expense.amount=float(request.form['amount'])
+        expense.amount=to_money(request.form['amount'])
         expense.expense_date=datetime.strptime(request.form['expense_date'], '%Y-%m-%d')
+        bump_daily_summary(expense.expense_date.date(), expenses_total=expense.amount)
         try:
             db.session.commit()
             flash('Expense updated successfully!', 'success')
@@ -811,28 +2919,39 @@ def edit_expense(expense_id):
 @app.route('/sales')
 @login_required
 def sales():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     search = request.args.get('search', '', type=str)
     status = request.args.get('status', '', type=str)
     
-    query = Invoice.query.order_by(Invoice.created_at.desc())
+    query = Invoice.query
     
     if search:
-        query = query.filter(Invoice.bill_no.contains(search))
+        query = query.filter(db.or_(
+            search_condition(Invoice, search),
+            search_condition(Customer, search, key=Invoice.customer_id)
+        ))
     if status:
         query = query.filter(Invoice.payment_status==status)
     
     
-    sales = query.paginate(page=page, per_page=10, error_out=False)
+    # Unfiltered, the dashboard rollups give the count without scanning invoices
+    total = None
+    if not search and not status:
+        total = db.session.query(db.func.sum(DailySummary.invoice_count)).scalar() or 0
+    sales = keyset_page(query, [Invoice.created_at, Invoice.id], cursor, per_page=10, descending=True,
+                        total=total, approximate=True)
     
     return render_template('sales.html', sales=sales, search=search,status=status)
 
 @app.route('/sales/<int:invoice_id>')
 @login_required
 def sales_detail(invoice_id):
-    invoice = Invoice.query.get_or_404(invoice_id)
-    invoice = Invoice.query.get(invoice_id)
-    total_paid = sum([p.amount for p in invoice.payments])
+    invoice = Invoice.query.options(
+        db.joinedload(Invoice.customer),
+        db.selectinload(Invoice.items).joinedload(InvoiceItem.product),
+        db.selectinload(Invoice.payments)
+    ).filter_by(id=invoice_id).first_or_404()
+    total_paid = invoice.paid_amount
     return jsonify({
         'bill_no': invoice.bill_no,
         'customer_name': invoice.customer.name if invoice.customer else 'Walk-in Customer',
@@ -843,7 +2962,7 @@ def sales_detail(invoice_id):
         'final_amount': invoice.final_amount,
         'paid':total_paid,
         'items': [{
-            'product_name': item.product.name,
+            'product_name': item.product.name if item.product else 'Deleted product',
             'quantity': item.quantity,
             'unit_price': item.unit_price,
             'total_price': item.total_price
@@ -861,30 +2980,33 @@ def sales_detail(invoice_id):
 @app.route('/purchases')
 @login_required
 def purchases():
-    page = request.args.get('page', 1, type=int)
+    cursor = request.args.get('cursor', '', type=str)
     search = request.args.get('search', '', type=str)
     status = request.args.get('status', '', type=str)
     
-    query = Purchase.query.order_by(Purchase.created_at.desc())
+    query = Purchase.query
     
     if search:
-        query = query.filter(Purchase.bill_no.contains(search))
+        query = query.filter(Purchase.bill_no.icontains(search))
     if status:
         query = query.filter(Purchase.payment_status==status)
     
-    purchases = query.paginate(page=page, per_page=10, error_out=False)
+    purchases = keyset_page(query, [Purchase.created_at, Purchase.id], cursor, per_page=10, descending=True)
     
-    return render_template('purchases.html', purchases=purchases, search=search)
+    return render_template('purchases.html', purchases=purchases, search=search, status=status)
 
 @app.route('/purchases/add', methods=['GET', 'POST'])
 @login_required
+@retry_on_locked
 def add_purchase():
     if request.method == 'POST':
         data = request.get_json()
+        amounts, errors = money_fields(data, 'total_amount', 'discount', 'cgst', 'sgst', 'final_amount', 'payment_amount')
+        if errors:
+            return jsonify({'success': False, 'message': errors[0]['message'], 'errors': errors}), 400
         
         # Generate bill number
-        last_purchase = Purchase.query.order_by(Purchase.id.desc()).first()
-        bill_no = f"PUR-{(last_purchase.id + 1) if last_purchase else 1:03d}"
+        bill_no = next_document_number('purchase', data.get('counter'))
         
         # Create purchase
         purchase = Purchase(
@@ -892,71 +3014,59 @@ def add_purchase():
             po_bill_no=data.get('po_bill_no'),
             purchase_date=datetime.strptime(data['purchase_date'], '%Y-%m-%d').date(),
             vendor_id=data['vendor_id'],
-            total_amount=data['total_amount'],
-            discount=data.get('discount', 0),
-            cgst=data.get('cgst', 0),
-            sgst=data.get('sgst', 0),
-            final_amount=data['final_amount'],
+            total_amount=amounts['total_amount'],
+            discount=amounts['discount'],
+            cgst=amounts['cgst'],
+            sgst=amounts['sgst'],
+            final_amount=amounts['final_amount'],
             payment_status=data.get('payment_status', 'unpaid')
         )
         
         db.session.add(purchase)
+        open_bill_balance(purchase)
         db.session.flush()  # Get the purchase ID
         
-        # Add purchase items
-        for item in data['items']:
-            purchase_item = PurchaseItem(
-                purchase_id=purchase.id,
-                product_id=item['product_id'],
-                quantity=item['quantity'],
-                unit_price=item['unit_price'],
-                total_price=item['total_price']
-            )
-            db.session.add(purchase_item)
-            
-            # Update stock
-            product = Product.query.get(item['product_id'])
-            product.stock_quantity += item['quantity']
+        # Add purchase items and increment stock
+        try:
+            write_document_lines(PurchaseItem, purchase.id, data['items'], 1)
+        except LineError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 400
+        except StockError as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': str(e), 'errors': e.errors}), 409
         
         # Add vendor payment if payment is made
-        if data.get('payment_amount') and float(data['payment_amount']) > 0:
+        if amounts['payment_amount'] > 0:
             vendor_payment = VendorPayment(
                 purchase_id=purchase.id,
-                amount=float(data['payment_amount']),
+                amount=amounts['payment_amount'],
                 payment_method=data.get('payment_method', 'cash'),
                 description=f"Payment for purchase {bill_no}"
             )
             db.session.add(vendor_payment)
+            apply_bill_payment(purchase, vendor_payment.amount)
         
+        record_low_stock()
         db.session.commit()
         
         return jsonify({'success': True, 'bill_no': bill_no, 'purchase_id': purchase.id})
     
     vendors = Vendor.query.all()
-    products = Product.query.all()
-
-    product_dicts = [
-        {
-            'id': p.id,
-            'name': p.name,
-            'category': p.category or '',
-            'brand': p.brand or '',
-            'selling_price': p.selling_price,
-            'cost_price': p.cost_price,
-            'gst_rate': p.gst_rate,
-            'unit':p.unit,
-            'stock_quantity': p.stock_quantity,
-        }
-        for p in products
-    ]
+    categories = db.session.query(Product.category).distinct().all()
+    categories = [cat[0] for cat in categories]
 
-    return render_template('add_purchase.html', vendors=vendors, products=products, products_json=product_dicts)
+    return render_template('add_purchase.html', vendors=vendors, categories=categories)
 
 @app.route('/purchases/<int:purchase_id>')
 @login_required
 def purchase_detail(purchase_id):
-    purchase = Purchase.query.get_or_404(purchase_id)
-    total_paid = sum([p.amount for p in purchase.payments])
+    purchase = Purchase.query.options(
+        db.joinedload(Purchase.vendor),
+        db.selectinload(Purchase.items).joinedload(PurchaseItem.product),
+        db.selectinload(Purchase.payments)
+    ).filter_by(id=purchase_id).first_or_404()
+    total_paid = purchase.paid_amount
     return jsonify({
         'bill_no': purchase.bill_no,
         'vendor_name': purchase.vendor.name if purchase.vendor else 'Unknown Vendor',
@@ -967,7 +3077,7 @@ def purchase_detail(purchase_id):
         'final_amount': purchase.final_amount,
         'total_paid':total_paid,
         'items': [{
-            'product_name': item.product.name,
+            'product_name': item.product.name if item.product else 'Deleted product',
             'quantity': item.quantity,
             'unit_price': item.unit_price,
             'total_price': item.total_price
@@ -981,15 +3091,9 @@ def purchase_detail(purchase_id):
     })
 
 # Payments Routes
-@app.route('/payments')
-@login_required
-def payments():
-    page = request.args.get('page', 1, type=int)
-    category = request.args.get('category', '', type=str)
-    status = request.args.get('status', '', type=str)
-    
-    # Get all invoice payments with explicit joins
-    invoice_payments = db.session.query(
+def payment_ledger(start_date=None, end_date=None, category=None, status=None):
+    """Customer and vendor payments as a single UNION ALL subquery"""
+    invoice_payments = db.select(
         Payment.id,
         Payment.amount,
         Payment.payment_method,
@@ -998,44 +3102,64 @@ def payments():
         Invoice.bill_no,
         Customer.name.label('party_name'),
         literal('customer').label('category')
-    ).select_from(Payment).join(Invoice, Payment.invoice_id == Invoice.id).outerjoin(Customer, Invoice.customer_id == Customer.id).all()
-    
-    # Get all vendor payments with explicit joins
-    vendor_payments = db.session.query(
+    ).select_from(Payment).join(Invoice, Payment.invoice_id == Invoice.id).outerjoin(Customer, Invoice.customer_id == Customer.id)
+
+    vendor_payments = db.select(
         VendorPayment.id,
         VendorPayment.amount,
         VendorPayment.payment_method,
         VendorPayment.payment_date,
-        Purchase.bill_no,
         literal('completed').label('status'),
+        Purchase.bill_no,
         Vendor.name.label('party_name'),
         literal('vendor').label('category')
-    ).select_from(VendorPayment).join(Purchase, VendorPayment.purchase_id == Purchase.id).outerjoin(Vendor, Purchase.vendor_id == Vendor.id).all()
-    
-    # Combine and filter
-    all_payments = list(invoice_payments) + list(vendor_payments)
-    
-    if category:
-        all_payments = [p for p in all_payments if p.category == category]
+    ).select_from(VendorPayment).join(Purchase, VendorPayment.purchase_id == Purchase.id).outerjoin(Vendor, Purchase.vendor_id == Vendor.id)
+
+    # Filters are applied to each branch so both sides can use their date index
+    if start_date:
+        invoice_payments = invoice_payments.where(Payment.payment_date >= start_date)
+        vendor_payments = vendor_payments.where(VendorPayment.payment_date >= start_date)
+    if end_date:
+        invoice_payments = invoice_payments.where(Payment.payment_date <= end_date)
+        vendor_payments = vendor_payments.where(VendorPayment.payment_date <= end_date)
+    if category and category != 'customer':
+        invoice_payments = invoice_payments.where(db.false())
+    if category and category != 'vendor':
+        vendor_payments = vendor_payments.where(db.false())
     if status:
-        all_payments = [p for p in all_payments if p.status == status]
+        invoice_payments = invoice_payments.where(Payment.status == status)
+        if status != 'completed':
+            vendor_payments = vendor_payments.where(db.false())
+
+    return db.union_all(invoice_payments, vendor_payments).subquery('ledger')
+
+def ledger_page(ledger, page, per_page):
+    """Newest-first page of ledger rows; only these rows are materialised"""
+    return db.session.query(ledger).order_by(
+        ledger.c.payment_date.desc(), ledger.c.id.desc(), ledger.c.category
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+@app.route('/payments')
+@login_required
+def payments():
+    page = request.args.get('page', 1, type=int)
+    category = request.args.get('category', '', type=str)
+    status = request.args.get('status', '', type=str)
     
-    # Sort by date (newest first)
-    all_payments.sort(key=lambda x: x.payment_date, reverse=True)
+    ledger = payment_ledger(category=category, status=status)
+    total = db.session.query(db.func.count()).select_from(ledger).scalar()
     
-    # Manual pagination
     per_page = 10
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_payments = all_payments[start:end]
+    paginated_payments = ledger_page(ledger, page, per_page)
     
-    total_pages = (len(all_payments) + per_page - 1) // per_page
+    total_pages = (total + per_page - 1) // per_page
     has_prev = page > 1
     has_next = page < total_pages
     
     return render_template('payments.html', 
                          payments=paginated_payments,
                          page=page,
+                         total=total,
                          total_pages=total_pages,
                          has_prev=has_prev,
                          has_next=has_next,
@@ -1044,14 +3168,13 @@ def payments():
 
 @app.route('/payments/add', methods=['POST'])
 @login_required
+@retry_on_locked
 def add_payment():
     invoice_id = request.form.get('invoice_id')
-    amount = float(request.form['amount'])
+    amount = to_money(request.form['amount'])
     payment_method = request.form['payment_method']
 
-    # Update invoice payment status
-    invoice = Invoice.query.get(invoice_id)
-    total_paid = sum([p.amount for p in invoice.payments]) + amount
+    invoice = Invoice.query.get_or_404(invoice_id)
     
     payment = Payment(
         invoice_id=invoice_id,
@@ -1062,10 +3185,8 @@ def add_payment():
     
     db.session.add(payment)
     
-    if total_paid >= invoice.final_amount:
-        invoice.payment_status = 'paid'
-    else:
-        invoice.payment_status = 'partial'
+    # Update invoice balance and payment status
+    apply_bill_payment(invoice, amount)
     
     db.session.commit()
     flash('Payment recorded successfully!', 'success')
@@ -1073,14 +3194,13 @@ def add_payment():
 
 @app.route('/vendor-payments/add', methods=['POST'])
 @login_required
+@retry_on_locked
 def add_vendor_payment():
     purchase_id = request.form.get('purchase_id')
-    amount = float(request.form['amount'])
+    amount = to_money(request.form['amount'])
     payment_method = request.form['payment_method']
 
-    #update purchase payment status
-    purchase = Purchase.query.get(purchase_id)
-    total_paid = sum([p.amount for p in purchase.payments]) + amount
+    purchase = Purchase.query.get_or_404(purchase_id)
     
     vendor_payment = VendorPayment(
         purchase_id=purchase_id,
@@ -1089,13 +3209,9 @@ def add_vendor_payment():
     )
     
     db.session.add(vendor_payment)
-    db.session.commit()
-
 
-    if total_paid >= purchase.final_amount:
-        purchase.payment_status = 'paid'
-    else:
-        purchase.payment_status = 'partial'
+    #update purchase balance and payment status
+    apply_bill_payment(purchase, amount)
     
     db.session.commit()
     flash('Vendor payment recorded successfully!', 'success')
@@ -1106,14 +3222,19 @@ def add_vendor_payment():
 @login_required
 def customer_detail(customer_id):
     customer = Customer.query.get_or_404(customer_id)
+    page = request.args.get('page', 1, type=int)
     
-    # Get customer's invoices
-    invoices = Invoice.query.filter_by(customer_id=customer_id).order_by(Invoice.created_at.desc()).all()
+    # Get a page of the customer's invoices with their items
+    invoices = Invoice.query.options(db.selectinload(Invoice.items)).filter_by(
+        customer_id=customer_id
+    ).order_by(Invoice.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
     
-    # Calculate totals
-    total_sales = sum([inv.final_amount for inv in invoices])
-    total_paid = sum([sum([p.amount for p in inv.payments]) for inv in invoices])
-    total_pending = total_sales - total_paid
+    # Calculate totals over all of the customer's invoices
+    total_sales, total_paid = db.session.query(
+        db.func.coalesce(db.func.sum(Invoice.final_amount), 0),
+        db.func.coalesce(db.func.sum(Invoice.paid_amount), 0)
+    ).filter(Invoice.customer_id == customer_id).one()
+    total_pending = customer.balance_due
     
     return render_template('customer_detail.html', 
                          customer=customer,
@@ -1127,16 +3248,22 @@ def customer_detail(customer_id):
 def vendor_detail(vendor_id):
     vendor = Vendor.query.get_or_404(vendor_id)
     
-    # Get vendor's purchases
-    purchases = Purchase.query.filter_by(vendor_id=vendor_id).order_by(Purchase.created_at.desc()).all()
+    page = request.args.get('page', 1, type=int)
+    
+    # Get a page of the vendor's purchases with their items
+    purchases = Purchase.query.options(db.selectinload(Purchase.items)).filter_by(
+        vendor_id=vendor_id
+    ).order_by(Purchase.created_at.desc()).paginate(page=page, per_page=20, error_out=False)
     
     # Get vendor's products
     products = Product.query.filter_by(vendor_id=vendor_id).all()
     
-    # Calculate totals
-    total_purchases = sum([purch.final_amount for purch in purchases])
-    total_paid = sum([sum([p.amount for p in purchase.payments]) for purchase in purchases])
-    total_pending = total_purchases - total_paid
+    # Calculate totals over all of the vendor's purchases
+    total_purchases, total_paid = db.session.query(
+        db.func.coalesce(db.func.sum(Purchase.final_amount), 0),
+        db.func.coalesce(db.func.sum(Purchase.paid_amount), 0)
+    ).filter(Purchase.vendor_id == vendor_id).one()
+    total_pending = vendor.balance_due
     
     return render_template('vendor_detail.html', 
                          vendor=vendor,
@@ -1146,9 +3273,237 @@ def vendor_detail(vendor_id):
                          total_paid=total_paid,
                          total_pending=total_pending)
 
+# Background jobs
+# Heavy reports, exports and imports run on a small thread pool so the
+# request (and the desktop window) doesn't wait for them. A job writes its
+# result to a file in JOB_CACHE_DIR named after its parameters, so the same
+# report or export asked for again within JOB_CACHE_TTL is served from disk.
+# Jobs are tracked in memory by the process that runs them; cached results
+# on disk are shared by every process.
+JOB_HISTORY = 200
+_jobs = {}
+_jobs_lock = threading.Lock()
+_job_pool = None
+
+def job_pool():
+    global _job_pool
+    with _jobs_lock:
+        if _job_pool is None:
+            _job_pool = ThreadPoolExecutor(max_workers=app.config['JOB_WORKERS'], thread_name_prefix='billsys-job')
+        return _job_pool
+
+def job_cache_key(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:32]
+
+def evict_job_cache():
+    """Delete cached results older than JOB_CACHE_TTL"""
+    folder = app.config['JOB_CACHE_DIR']
+    cutoff = time.time() - app.config['JOB_CACHE_TTL']
+    if not os.path.isdir(folder):
+        return
+    for entry in os.scandir(folder):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.remove(entry.path)
+        except OSError:
+            pass  # another process evicted it first
+
+def fresh_cache_file(path):
+    try:
+        return time.time() - os.path.getmtime(path) < app.config['JOB_CACHE_TTL']
+    except OSError:
+        return False
+
+def submit_job(kind, name, work, description='', cache_key=None, extension='out', user_id=None):
+    """Run work(job, path) on the job pool and return the job.
+
+    work writes its result to path (if it has one) and returns a small
+    summary for the status endpoint. With a cache_key, a running job with
+    the same key is shared and a fresh result on disk finishes at once.
+    """
+    path = None
+    if cache_key is not None:
+        path = os.path.join(app.config['JOB_CACHE_DIR'], f'{job_cache_key(kind, name, cache_key)}.{extension}')
+    now = datetime.now().isoformat(sep=' ', timespec='seconds')
+    job = {'id': uuid.uuid4().hex, 'kind': kind, 'name': name, 'description': description,
+           'state': 'queued', 'progress': 0.0, 'result': None, 'error': None, 'cached': False,
+           'started_at': now, 'finished_at': None, 'path': path, 'user_id': user_id}
+    with _jobs_lock:
+        if path:
+            for other in _jobs.values():
+                if other['path'] == path and other['state'] in ('queued', 'running') and other['user_id'] == user_id:
+                    return other
+        if path and fresh_cache_file(path):
+            job.update(state='done', progress=1.0, cached=True, finished_at=now)
+        _jobs[job['id']] = job
+        while len(_jobs) > JOB_HISTORY:
+            oldest = next(iter(_jobs))
+            if _jobs[oldest]['state'] in ('queued', 'running'):
+                break
+            del _jobs[oldest]
+    if job['state'] == 'queued':
+        evict_job_cache()
+        job_pool().submit(run_job, job, work)
+    return job
+
+def run_job(job, work):
+    job['state'] = 'running'
+    with app.app_context():
+        try:
+            if job['path']:
+                os.makedirs(os.path.dirname(job['path']), exist_ok=True)
+                partial = f"{job['path']}.{job['id']}.part"
+                job['result'] = work(job, partial)
+                os.replace(partial, job['path'])
+            else:
+                job['result'] = work(job, None)
+            job.update(state='done', progress=1.0)
+        except (ExportError, ImportFileError) as error:
+            job.update(state='failed', error=str(error))
+        except Exception as error:
+            app.logger.exception('Job %s (%s %s) failed', job['id'], job['kind'], job['name'])
+            job.update(state='failed', error=f'{error.__class__.__name__}: {error}')
+        finally:
+            job['finished_at'] = datetime.now().isoformat(sep=' ', timespec='seconds')
+            if job['path'] and job['state'] != 'done':
+                try:
+                    os.remove(f"{job['path']}.{job['id']}.part")
+                except OSError:
+                    pass
+            db.session.remove()
+
+def find_job(job_id):
+    """The job if the signed-in user may see it (their own, or any for admins)"""
+    job = _jobs.get(job_id)
+    if job is None or (job['user_id'] != current_user.id and current_user.role not in ['admin', 'owner']):
+        return None
+    return job
+
+def job_status(job):
+    status = {key: job[key] for key in ('id', 'kind', 'name', 'description', 'state', 'progress', 'result',
+                                         'error', 'cached', 'started_at', 'finished_at')}
+    if job['state'] == 'done' and job['path']:
+        status['download_url'] = url_for('job_result', job_id=job['id'])
+    return status
+
+def export_job(dataset, export_format, args, compress):
+    def work(job, path):
+        filename, mimetype, chunks = export_stream(dataset, export_format, args, compress=compress)
+        size = 0
+        with open(path, 'wb') as file:
+            for chunk in chunks:
+                file.write(chunk)
+                size += len(chunk)
+                job['result'] = {'bytes': size}
+        return {'bytes': size}
+    return work
+
+def render_report(endpoint, path, args, user_id):
+    """Render a report view as the given user, outside any real request"""
+    with app.test_request_context(path, query_string=args):
+        login_user(db.session.get(User, user_id))
+        g.in_background_job = True
+        response = app.make_response(app.view_functions[endpoint]())
+        return response.get_data(as_text=True)
+
+def submit_report_job(endpoint, args, user_id):
+    """Queue a report view; the HTML is cached per report, filters and user"""
+    path = url_for(endpoint)
+
+    def work(job, result_path):
+        html = render_report(endpoint, path, args, user_id)
+        with open(result_path, 'w', encoding='utf-8') as file:
+            file.write(html)
+        return {'bytes': os.path.getsize(result_path)}
+
+    # The data version moves on every commit to a report table, so a cached
+    # page is only reused while nothing it shows has changed in this process
+    return submit_job('report', endpoint, work, description=endpoint.replace('_', ' ').title(),
+                      cache_key=[args, user_id, _report_data_version], extension='html', user_id=user_id)
+
+# Reports that can run as jobs, by the name POST /jobs takes
+REPORT_ENDPOINTS = {'sales': 'sales_report', 'payments': 'payment_report', 'gst': 'gst_report', 'aging': 'aging_report'}
+
+def background_report(view):
+    """Run a report view as a background job when asked (?background=1 or BACKGROUND_REPORTS).
+
+    The browser gets a page that polls the job and comes back with ?job=<id>
+    once it is done; the cached HTML is then served in place of the view.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if g.get('in_background_job') or request.args.get('export'):
+            return view(*args, **kwargs)
+        job_id = request.args.get('job')
+        if job_id:
+            job = find_job(job_id)
+            if job and job['state'] == 'done' and job['path'] and os.path.exists(job['path']):
+                return send_file(job['path'], mimetype='text/html', max_age=0)
+        wanted = request.args.get('background', '1' if app.config['BACKGROUND_REPORTS'] else '0') == '1'
+        if not wanted and not job_id:
+            return view(*args, **kwargs)
+        args = {key: value for key, value in request.args.items() if key not in ('background', 'job')}
+        job = submit_report_job(request.endpoint, args, current_user.id)
+        if job['state'] == 'done':
+            return send_file(job['path'], mimetype='text/html', max_age=0)
+        return render_template('job_wait.html', job=job_status(job))
+    return wrapper
+
+@app.route('/jobs', methods=['POST'])
+@login_required
+def submit_job_route():
+    """Start an export ({"type": "export", "dataset", "format", "gzip", filters...})
+    or a report ({"type": "report", "report", filters...}); returns the job"""
+    params = dict(request.get_json(silent=True) or request.form.to_dict())
+    job_type = params.pop('type', None)
+    if job_type == 'export':
+        dataset = params.pop('dataset', None)
+        export_format = params.pop('format', 'csv')
+        compress = str(params.pop('gzip', '')) in ('1', 'true', 'True')
+        try:
+            check_export(dataset, export_format)
+        except ExportError as error:
+            return jsonify({'error': str(error)}), 400
+        if not export_allowed(dataset):
+            return jsonify({'error': 'Access denied'}), 403
+        job = submit_job('export', dataset, export_job(dataset, export_format, params, compress),
+                         description=f"{dataset} .{export_format}{'.gz' if compress else ''}",
+                         cache_key=[export_format, compress, params],
+                         extension=export_format + ('.gz' if compress else ''), user_id=current_user.id)
+    elif job_type == 'report':
+        endpoint = REPORT_ENDPOINTS.get(params.pop('report', None))
+        if endpoint is None:
+            return jsonify({'error': f"Unknown report; choose from {', '.join(REPORT_ENDPOINTS)}"}), 400
+        job = submit_report_job(endpoint, params, current_user.id)
+    else:
+        return jsonify({'error': 'type must be export or report'}), 400
+    return jsonify(job_status(job)), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status_route(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'error': 'No such job'}), 404
+    return jsonify(job_status(job))
+
+@app.route('/jobs/<job_id>/result')
+@login_required
+def job_result(job_id):
+    job = find_job(job_id)
+    if job is None or job['state'] != 'done' or not job['path'] or not os.path.exists(job['path']):
+        return jsonify({'error': 'No result for this job (it may have expired)'}), 404
+    if job['kind'] == 'report':
+        return send_file(job['path'], mimetype='text/html', max_age=0)
+    extension = os.path.basename(job['path']).split('.', 1)[1]
+    stamp = datetime.fromtimestamp(os.path.getmtime(job['path'])).strftime('%Y%m%d_%H%M%S')
+    mimetype = 'application/gzip' if extension.endswith('.gz') else EXPORT_FORMATS[extension]
+    return send_file(job['path'], mimetype=mimetype, as_attachment=True, download_name=f"{job['name']}_{stamp}.{extension}")
+
 # Report Routes
 @app.route('/reports/sales')
 @login_required
+@background_report
 def sales_report():
     # Get filter parameters
     page = request.args.get('page', 1, type=int)
@@ -1156,42 +3511,69 @@ def sales_report():
     end_date = request.args.get('end_date')
     customer_id = request.args.get('customer_id')
     
-    # Base query
-    query = Invoice.query
-    
-    # Apply filters
-    if start_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        query = query.filter(Invoice.created_at >= start_date_obj)
-    if end_date:
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        query = query.filter(Invoice.created_at <= end_date_obj)
-    if customer_id:
-        query = query.filter(Invoice.customer_id == customer_id)
-    
-    # Get invoices
-    invoices = query.order_by(Invoice.created_at.desc()).all()
+    summary, chart_data, top_customers = sales_totals(start_date, end_date, customer_id)
     
-    # Calculate summary
-    total_sales = sum([inv.final_amount for inv in invoices])
-    total_transactions = len(invoices)
-    total_customers = len(set([inv.customer_id for inv in invoices if inv.customer_id]))
-    avg_order_value = total_sales / total_transactions if total_transactions > 0 else 0
+    # Customers for filter dropdown
+    customers = db.session.query(Customer.id, Customer.name).order_by(Customer.id).all()
     
-    summary = {
-        'total_sales': total_sales,
-        'total_transactions': total_transactions,
-        'total_customers': total_customers,
-        'avg_order_value': avg_order_value
-    }
+    # Database-side pagination
+    per_page = 10
+    paginated_invoices = Invoice.query.options(
+        db.joinedload(Invoice.customer), db.selectinload(Invoice.items)
+    ).filter(*sales_filters(start_date, end_date, customer_id)).order_by(
+        Invoice.created_at.desc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
     
-    # Get all customers for filter dropdown
-    customers = Customer.query.all()
+    total_pages = (summary['total_transactions'] + per_page - 1) // per_page
+    has_prev = page > 1
+    has_next = page < total_pages
     
-    # Prepare chart data - Daily sales for last 30 days or filtered period
-    from datetime import timedelta
     
-    if start_date and end_date:
+    return render_template('sales_report.html', 
+                         invoices=paginated_invoices,
+                         page=page,
+                         total_pages=total_pages,
+                         has_prev=has_prev,
+                         has_next=has_next,
+                         summary=summary,
+                         customers=customers,
+                         chart_data=chart_data,
+                         top_customers=top_customers,
+                         start_date=start_date,end_date=end_date,customer_id=customer_id)
+
+def sales_filters(start_date, end_date, customer_id):
+    """Filters shared by the summary, chart, ranking and invoice list"""
+    filters = []
+    if start_date:
+        filters.append(Invoice.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
+    if end_date:
+        filters.append(Invoice.created_at <= datetime.strptime(end_date, '%Y-%m-%d'))
+    if customer_id:
+        filters.append(Invoice.customer_id == customer_id)
+    return filters
+
+@cached_report(Invoice, Customer)
+def sales_totals(start_date, end_date, customer_id):
+    """Summary, daily chart and top customers for the sales report"""
+    filters = sales_filters(start_date, end_date, customer_id)
+    
+    # Calculate summary
+    total_sales, total_transactions, total_customers = db.session.query(
+        db.func.coalesce(db.func.sum(Invoice.final_amount), 0),
+        db.func.count(Invoice.id),
+        db.func.count(db.distinct(Invoice.customer_id))
+    ).filter(*filters).one()
+    avg_order_value = total_sales / total_transactions if total_transactions > 0 else 0
+    
+    summary = {
+        'total_sales': total_sales,
+        'total_transactions': total_transactions,
+        'total_customers': total_customers,
+        'avg_order_value': avg_order_value
+    }
+    
+    # Prepare chart data - Daily sales for last 30 days or filtered period
+    if start_date and end_date:
         chart_start = datetime.strptime(start_date, '%Y-%m-%d')
         chart_end = datetime.strptime(end_date, '%Y-%m-%d')
     else:
@@ -1205,58 +3587,36 @@ def sales_report():
         daily_sales[current_date.strftime('%Y-%m-%d')] = 0
         current_date += timedelta(days=1)
     
-    # Fill with actual sales data
-    for invoice in invoices:
-        date_key = invoice.created_at.strftime('%Y-%m-%d')
+    # Fill with per-day totals aggregated in the database
+    sale_day = day_string(Invoice.created_at)
+    for date_key, amount in db.session.query(
+        sale_day, db.func.sum(Invoice.final_amount)
+    ).filter(*filters).filter(
+        Invoice.created_at >= chart_start.replace(hour=0, minute=0, second=0, microsecond=0)
+    ).group_by(sale_day):
         if date_key in daily_sales:
-            daily_sales[date_key] += invoice.final_amount
+            daily_sales[date_key] += amount
     
     chart_data = {
         'labels': list(daily_sales.keys()),
         'sales': list(daily_sales.values())
     }
     
-    # Top customers data
-    customer_sales = {}
-    for invoice in invoices:
-        if invoice.customer_id:
-            customer_name = invoice.customer.name
-            if customer_name not in customer_sales:
-                customer_sales[customer_name] = 0
-            customer_sales[customer_name] += invoice.final_amount
-    
-    # Sort and get top 5 customers
-    sorted_customers = sorted(customer_sales.items(), key=lambda x: x[1], reverse=True)[:5]
+    # Top 5 customers by sales
+    customer_total = db.func.sum(Invoice.final_amount)
+    sorted_customers = db.session.query(Customer.name, customer_total).join(
+        Customer, Invoice.customer_id == Customer.id
+    ).filter(*filters).group_by(Customer.id, Customer.name).order_by(customer_total.desc()).limit(5).all()
     
     top_customers = {
         'names': [item[0] for item in sorted_customers],
         'amounts': [item[1] for item in sorted_customers]
     }
-    # Manual pagination
-    per_page = 10
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_invoices = invoices[start:end]
-    
-    total_pages = (len(invoices) + per_page - 1) // per_page
-    has_prev = page > 1
-    has_next = page < total_pages
-    
-    
-    return render_template('sales_report.html', 
-                         invoices=paginated_invoices,
-                         page=page,
-                         total_pages=total_pages,
-                         has_prev=has_prev,
-                         has_next=has_next,
-                         summary=summary,
-                         customers=customers,
-                         chart_data=chart_data,
-                         top_customers=top_customers,
-                         start_date=start_date,end_date=end_date,customer_id=customer_id)
+    return summary, chart_data, top_customers
 
 @app.route('/reports/payment')
 @login_required
+@background_report
 def payment_report():
     # Get filter parameters
     page = request.args.get('page', 1, type=int)
@@ -1264,58 +3624,43 @@ def payment_report():
     end_date = request.args.get('end_date')
     payment_type = request.args.get('payment_type')
     
-    # Get invoice payments
-    invoice_payments_query = db.session.query(
-        Payment.id,
-        Payment.amount,
-        Payment.payment_method,
-        Payment.payment_date,
-        Payment.status,
-        Invoice.bill_no,
-        Customer.name.label('party_name'),
-        literal('customer').label('category')
-    ).select_from(Payment).join(Invoice, Payment.invoice_id == Invoice.id).outerjoin(Customer, Invoice.customer_id == Customer.id)
-    
-    # Get vendor payments
-    vendor_payments_query = db.session.query(
-        VendorPayment.id,
-        VendorPayment.amount,
-        VendorPayment.payment_method,
-        VendorPayment.payment_date,
-        Purchase.bill_no,
-        literal('completed').label('status'),
-        Vendor.name.label('party_name'),
-        literal('vendor').label('category')
-    ).select_from(VendorPayment).join(Purchase, VendorPayment.purchase_id == Purchase.id).outerjoin(Vendor, Purchase.vendor_id==Vendor.id)
-    
-    # Apply date filters
-    if start_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        invoice_payments_query = invoice_payments_query.filter(Payment.payment_date >= start_date_obj)
-        vendor_payments_query = vendor_payments_query.filter(VendorPayment.payment_date >= start_date_obj)
-    if end_date:
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        invoice_payments_query = invoice_payments_query.filter(Payment.payment_date <= end_date_obj)
-        vendor_payments_query = vendor_payments_query.filter(VendorPayment.payment_date <= end_date_obj)
-    
-    # Get payments
-    invoice_payments = invoice_payments_query.all()
-    vendor_payments = vendor_payments_query.all()
-    
-    # Combine payments
-    all_payments = list(invoice_payments) + list(vendor_payments)
+    summary, payment_methods, monthly_trend = payment_totals(start_date, end_date, payment_type)
+
+    # Database-side pagination
+    per_page = 10
+    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+    paginated_payments = ledger_page(payment_ledger(start_date_obj, end_date_obj, category=payment_type), page, per_page)
     
-    # Apply payment type filter
-    if payment_type:
-        all_payments = [p for p in all_payments if p.category == payment_type]
+    total_pages = (summary['total_transactions'] + per_page - 1) // per_page
+    has_prev = page > 1
+    has_next = page < total_pages
     
-    # Sort by date
-    all_payments.sort(key=lambda x: x.payment_date, reverse=True)
+    return render_template('payment_report.html',
+                         payments=paginated_payments,
+                         has_next=has_next,
+                         has_prev=has_prev,
+                         page=page,
+                         total_pages=total_pages,
+                         summary=summary,
+                         payment_methods=payment_methods,
+                         monthly_trend=monthly_trend,
+                         start_date=start_date,end_date=end_date,payment_type=payment_type)
+
+@cached_report(Payment, VendorPayment, Invoice, Purchase, Customer, Vendor)
+def payment_totals(start_date, end_date, payment_type):
+    """Summary, payment method split and monthly trend for the payment report"""
+    start_date_obj = datetime.strptime(start_date, '%Y-%m-%d') if start_date else None
+    end_date_obj = datetime.strptime(end_date, '%Y-%m-%d') if end_date else None
+    ledger = payment_ledger(start_date_obj, end_date_obj, category=payment_type)
     
     # Calculate summary
-    total_received = sum([p.amount for p in all_payments if p.category == 'customer'])
-    total_paid = sum([p.amount for p in all_payments if p.category == 'vendor'])
-    total_transactions = len(all_payments)
+    is_customer = ledger.c.category == 'customer'
+    total_received, total_paid, total_transactions = db.session.query(
+        db.func.coalesce(db.func.sum(db.case((is_customer, ledger.c.amount), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((~is_customer, ledger.c.amount), else_=0)), 0),
+        db.func.count()
+    ).select_from(ledger).one()
     
     summary = {
         'total_received': total_received,
@@ -1324,37 +3669,32 @@ def payment_report():
     }
     
     # Generate chart data for payment methods
-    payment_method_counts = {}
-    for payment in all_payments:
-        method = payment.payment_method
-        if method not in payment_method_counts:
-            payment_method_counts[method] = 0
-        payment_method_counts[method] += payment.amount
+    payment_method_counts = db.session.query(
+        ledger.c.payment_method, db.func.sum(ledger.c.amount)
+    ).group_by(ledger.c.payment_method).all()
     
     payment_methods = {
-        'labels': list(payment_method_counts.keys()),
-        'data': list(payment_method_counts.values())
+        'labels': [method for method, _ in payment_method_counts],
+        'data': [amount for _, amount in payment_method_counts]
     }
     
-    # Generate monthly trend data
-    from datetime import timedelta
-    from collections import defaultdict
-    
-    # Group payments by month
-    monthly_received = defaultdict(float)
-    monthly_paid = defaultdict(float)
+    # Monthly totals per direction, summed in the database
+    monthly_received = {}
+    monthly_paid = {}
     
-    for payment in all_payments:
-        month_key = payment.payment_date.strftime('%Y-%m')
-        if payment.category == 'customer':
-            monthly_received[month_key] += payment.amount
+    month = month_string(ledger.c.payment_date)
+    for month_key, category, amount in db.session.query(
+        month, ledger.c.category, db.func.sum(ledger.c.amount)
+    ).group_by(month, ledger.c.category):
+        if category == 'customer':
+            monthly_received[month_key] = amount
         else:
-            monthly_paid[month_key] += payment.amount
+            monthly_paid[month_key] = amount
     
     # Get all months in range
     if start_date and end_date:
-        start_month = datetime.strptime(start_date, '%Y-%m-%d')
-        end_month = datetime.strptime(end_date, '%Y-%m-%d')
+        start_month = start_date_obj
+        end_month = end_date_obj
     else:
         end_month = datetime.now()
         start_month = end_month - timedelta(days=365)  # Last 12 months
@@ -1373,59 +3713,243 @@ def payment_report():
     
     monthly_trend = {
         'labels': month_labels,
-        'received': [monthly_received[month] for month in month_labels],
-        'paid': [monthly_paid[month] for month in month_labels]
+        'received': [monthly_received.get(month, 0) for month in month_labels],
+        'paid': [monthly_paid.get(month, 0) for month in month_labels]
     }
 
-    # Manual pagination
-    per_page = 10
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_payments = all_payments[start:end]
-    
-    total_pages = (len(all_payments) + per_page - 1) // per_page
-    has_prev = page > 1
-    has_next = page < total_pages
-    
-    return render_template('payment_report.html',
-                         payments=paginated_payments,
-                         has_next=has_next,
-                         has_prev=has_prev,
-                         page=page,
-                         total_pages=total_pages,
+    return summary, payment_methods, monthly_trend
+
+# Aging report
+class RowsPagination(Pagination):
+    """Pagination over a page of rows already fetched, with the total they carry"""
+
+    def _query_items(self):
+        return self._query_args['items']
+
+    def _query_count(self):
+        return self._query_args['total']
+
+AGING_BUCKETS = (('0-30 days', 0, 30), ('31-60 days', 31, 60), ('61-90 days', 61, 90), ('90+ days', 91, None))
+
+def aging_columns(date_column, amount):
+    """SUM(CASE ...) of amount for each aging bucket, by the bill's age in days"""
+    today = datetime.utcnow().date()
+
+    def day_start(days_ago):
+        day = today - timedelta(days=days_ago)
+        return day if isinstance(date_column.type, db.Date) else datetime.combine(day, datetime.min.time())
+
+    columns = []
+    for index, (label, low, high) in enumerate(AGING_BUCKETS):
+        conditions = []
+        if low:
+            conditions.append(date_column < day_start(low - 1))
+        if high is not None:
+            conditions.append(date_column >= day_start(high))
+        columns.append(db.func.coalesce(db.func.sum(
+            db.case((db.and_(*conditions), amount), else_=0)
+        ), 0).label(f'bucket_{index}'))
+    return columns
+
+@app.route('/reports/aging')
+@login_required
+@background_report
+def aging_report():
+    party = request.args.get('party', 'customer', type=str)
+    page = request.args.get('page', 1, type=int)
+    if party not in ('customer', 'vendor'):
+        party = 'customer'
+
+    bill_model = Invoice if party == 'customer' else Purchase
+    key, party_model, payment_model, payment_key = bill_party(bill_model)
+    date_column = Invoice.created_at if party == 'customer' else Purchase.purchase_date
+    outstanding = bill_model.balance_due > 0
+    buckets = aging_columns(date_column, bill_model.balance_due)
+    total_due = db.func.sum(bill_model.balance_due).label('total_due')
+    bill_count = db.func.count(bill_model.id).label('bill_count')
+
+    # One row per party from the balance_due index; window sums over the
+    # grouped rows carry the report totals and the party count on every row of
+    # the page, so the summary cards and pagination need no queries of their own
+    grouped = db.session.query(
+        key.label('party_id'), party_model.name, party_model.mobile_number, *buckets, total_due, bill_count
+    ).outerjoin(party_model, party_model.id == key).filter(outstanding).group_by(
+        key, party_model.name, party_model.mobile_number
+    ).subquery()
+    totalled = [column.name for column in buckets] + ['total_due', 'bill_count']
+    per_page = 20
+
+    def party_page(page):
+        return db.session.query(
+            grouped, *[db.func.sum(grouped.c[name]).over().label(f'all_{name}') for name in totalled],
+            db.func.count().over().label('party_count')
+        ).order_by(grouped.c.total_due.desc(), grouped.c.party_id).limit(per_page).offset((page - 1) * per_page).all()
+
+    rows = party_page(page)
+    if not rows and page > 1:
+        page = 1
+        rows = party_page(page)
+    summary = {name: rows[0]._mapping[f'all_{name}'] if rows else 0 for name in totalled}
+    parties = RowsPagination(page=page, per_page=per_page, error_out=False,
+                             items=rows, total=rows[0].party_count if rows else 0)
+
+    return render_template('aging_report.html',
+                         party=party,
+                         buckets=[label for label, low, high in AGING_BUCKETS],
                          summary=summary,
-                         payment_methods=payment_methods,
-                         monthly_trend=monthly_trend,
-                         start_date=start_date,end_date=end_date,payment_type=payment_type)
+                         parties=parties)
+
+# GST engine
+STANDARD_GST_RATES = (0, 5, 12, 18, 28)
+
+def gst_lines(filters):
+    """Invoice lines with their GST rate, taxable value and tax split.
+
+    The invoice discount is spread across lines in proportion to their value,
+    and inter-state invoices (those billed with IGST) carry the whole tax as
+    IGST instead of a CGST/SGST split. Amounts are rounded per line in paise
+    the same way as split_gst().
+    """
+    rate = db.func.coalesce(InvoiceItem.gst_rate, Product.gst_rate, 0)
+    gross = Invoice.total_amount + db.func.coalesce(Invoice.discount, 0)
+    taxable = whole_paise(db.case(
+        (gross > 0, InvoiceItem.total_price * Invoice.total_amount / gross),
+        else_=InvoiceItem.total_price
+    ))
+    tax = whole_paise(taxable * rate / 100)
+    sgst = tax // 2
+    inter_state = db.func.coalesce(Invoice.igst, 0) > 0
+    return db.select(
+        Invoice.id.label('invoice_id'),
+        rate.label('rate'),
+        db.type_coerce(taxable, Money).label('taxable'),
+        db.type_coerce(db.case((inter_state, 0), else_=tax - sgst), Money).label('cgst'),
+        db.type_coerce(db.case((inter_state, 0), else_=sgst), Money).label('sgst'),
+        db.type_coerce(db.case((inter_state, tax), else_=0), Money).label('igst'),
+    ).select_from(InvoiceItem).join(
+        Invoice, InvoiceItem.invoice_id == Invoice.id
+    ).outerjoin(Product, InvoiceItem.product_id == Product.id).where(*filters).subquery('gst_line')
+
+def gst_by_rate(filters):
+    """Taxable amount, tax split and invoice count per GST rate"""
+    lines = gst_lines(filters)
+    buckets = {rate: {'rate': rate, 'transaction_count': 0, 'taxable_amount': 0,
+                      'cgst': 0, 'sgst': 0, 'igst': 0, 'total_gst': 0}
+               for rate in STANDARD_GST_RATES}
+    for rate, count, taxable, cgst, sgst, igst in db.session.query(
+        lines.c.rate,
+        db.func.count(db.distinct(lines.c.invoice_id)),
+        db.func.sum(lines.c.taxable),
+        db.func.sum(lines.c.cgst),
+        db.func.sum(lines.c.sgst),
+        db.func.sum(lines.c.igst),
+    ).group_by(lines.c.rate):
+        buckets[rate] = {
+            'rate': rate,
+            'transaction_count': count,
+            'taxable_amount': taxable or 0,
+            'cgst': cgst or 0,
+            'sgst': sgst or 0,
+            'igst': igst or 0,
+            'total_gst': (cgst or 0) + (sgst or 0) + (igst or 0),
+        }
+    return [buckets[rate] for rate in sorted(buckets)]
 
+def gst_export_rows(filters):
+    """One row per invoice and GST rate, for the export engine to stream"""
+    lines = gst_lines(filters)
+    return db.select(
+        Invoice.bill_no,
+        day_string(Invoice.created_at),
+        db.func.coalesce(Customer.name, 'Walk-in Customer'),
+        lines.c.rate,
+        db.func.sum(lines.c.taxable),
+        db.func.sum(lines.c.cgst),
+        db.func.sum(lines.c.sgst),
+        db.func.sum(lines.c.igst),
+        db.type_coerce(db.func.sum(lines.c.cgst + lines.c.sgst + lines.c.igst), Money),
+    ).select_from(lines).join(Invoice, lines.c.invoice_id == Invoice.id).outerjoin(
+        Customer, Invoice.customer_id == Customer.id
+    ).group_by(Invoice.id, lines.c.rate).order_by(Invoice.created_at, Invoice.id, lines.c.rate)
 
+def stream_csv(header, rows, chunk_size=500):
+    """Encode rows as CSV in chunks so memory stays flat for any row count"""
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
 
 @app.route('/reports/gst')
 @login_required
+@background_report
 def gst_report():
     # Get filter parameters
     page = request.args.get('page', 1, type=int)
     start_date = request.args.get('start_date')
     end_date = request.args.get('end_date')
     
-    # Base query
-    query = Invoice.query
+    filters = gst_filters(start_date, end_date)
+    
+    # Stream a GSTR-style file straight to the client
+    if request.args.get('export'):
+        try:
+            return export_response('gst', request.args['export'], request.args,
+                                   compress=request.args.get('gzip') == '1')
+        except ExportError as error:
+            flash(str(error), 'error')
+            return redirect(url_for('gst_report'))
     
-    # Apply filters
+    gst_summary, gst_rates, monthly_gst, total_invoices = gst_totals(start_date, end_date)
+    
+    # Database-side pagination
+    per_page = 10
+    paginated_invoices = Invoice.query.options(db.joinedload(Invoice.customer)).filter(*filters).order_by(
+        Invoice.created_at.desc()
+    ).limit(per_page).offset((page - 1) * per_page).all()
+    
+    total_pages = (total_invoices + per_page - 1) // per_page
+    has_prev = page > 1
+    has_next = page < total_pages
+    
+    
+    return render_template('gst_report.html',
+                        page=page,  
+                        has_next=has_next,
+                         has_prev=has_prev,
+                         total=total_invoices,
+                         total_pages=total_pages,
+                         start_date=start_date,end_date=end_date,
+                         invoices=paginated_invoices,
+                         gst_summary=gst_summary,
+                         gst_by_rate=gst_rates,
+                         monthly_gst=monthly_gst)
+
+def gst_filters(start_date, end_date):
+    filters = []
     if start_date:
-        start_date_obj = datetime.strptime(start_date, '%Y-%m-%d')
-        query = query.filter(Invoice.created_at >= start_date_obj)
+        filters.append(Invoice.created_at >= datetime.strptime(start_date, '%Y-%m-%d'))
     if end_date:
-        end_date_obj = datetime.strptime(end_date, '%Y-%m-%d')
-        query = query.filter(Invoice.created_at <= end_date_obj)
-    
-    # Get invoices
-    invoices = query.order_by(Invoice.created_at.desc()).all()
+        filters.append(Invoice.created_at <= datetime.strptime(end_date, '%Y-%m-%d'))
+    return filters
+
+@cached_report(Invoice, InvoiceItem, Product)
+def gst_totals(start_date, end_date):
+    """Tax summary, split by rate, monthly totals and invoice count for the GST report"""
+    filters = gst_filters(start_date, end_date)
     
     # Calculate GST summary
-    total_cgst = sum([inv.cgst for inv in invoices])
-    total_sgst = sum([inv.sgst for inv in invoices])
-    total_igst = sum([inv.igst for inv in invoices])
+    total_cgst, total_sgst, total_igst, total_invoices = db.session.query(
+        db.func.coalesce(db.func.sum(Invoice.cgst), 0),
+        db.func.coalesce(db.func.sum(Invoice.sgst), 0),
+        db.func.coalesce(db.func.sum(Invoice.igst), 0),
+        db.func.count(Invoice.id)
+    ).filter(*filters).one()
     total_gst = total_cgst + total_sgst + total_igst
     
     gst_summary = {
@@ -1435,28 +3959,21 @@ def gst_report():
         'total_gst': total_gst
     }
     
-    # Calculate GST by rate (simplified)
-    gst_by_rate = [
-        {'rate': 5, 'transaction_count': 0, 'total_gst': 0, 'taxable_amount': 0},
-        {'rate': 12, 'transaction_count': 0, 'total_gst': 0, 'taxable_amount': 0},
-        {'rate': 18, 'transaction_count': 0, 'total_gst': 0, 'taxable_amount': 0},
-        {'rate': 28, 'transaction_count': 0, 'total_gst': 0, 'taxable_amount': 0}
-    ]
-    
-    # Generate monthly GST trend data
-    from datetime import timedelta
-    from collections import defaultdict
+    # Calculate GST by rate from the invoice lines
+    gst_rates = gst_by_rate(filters)
     
-    # Group GST by month
-    monthly_cgst = defaultdict(float)
-    monthly_sgst = defaultdict(float)
-    monthly_igst = defaultdict(float)
+    # Monthly GST totals, summed in the database
+    monthly_cgst = {}
+    monthly_sgst = {}
+    monthly_igst = {}
     
-    for invoice in invoices:
-        month_key = invoice.created_at.strftime('%Y-%m')
-        monthly_cgst[month_key] += invoice.cgst
-        monthly_sgst[month_key] += invoice.sgst
-        monthly_igst[month_key] += invoice.igst
+    month = month_string(Invoice.created_at)
+    for month_key, cgst, sgst, igst in db.session.query(
+        month, db.func.sum(Invoice.cgst), db.func.sum(Invoice.sgst), db.func.sum(Invoice.igst)
+    ).filter(*filters).group_by(month):
+        monthly_cgst[month_key] = cgst or 0
+        monthly_sgst[month_key] = sgst or 0
+        monthly_igst[month_key] = igst or 0
     
     # Get month range
     if start_date and end_date:
@@ -1480,66 +3997,644 @@ def gst_report():
     
     monthly_gst = {
         'labels': month_labels,
-        'cgst': [monthly_cgst[month] for month in month_labels],
-        'sgst': [monthly_sgst[month] for month in month_labels],
-        'igst': [monthly_igst[month] for month in month_labels]
+        'cgst': [monthly_cgst.get(month, 0) for month in month_labels],
+        'sgst': [monthly_sgst.get(month, 0) for month in month_labels],
+        'igst': [monthly_igst.get(month, 0) for month in month_labels]
     }
-    
-    # If export is requested, save CSV to server
-    if request.args.get('export') == 'csv':
-        filename = f"gst_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
-        filepath = os.path.join("exports", filename)  # Ensure 'exports' folder exists
-        os.makedirs("exports", exist_ok=True)
-
-        with open(filepath, mode='w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(['Invoice ID', 'Date', 'CGST', 'SGST', 'IGST', 'Total GST'])
-
-            for inv in invoices:
-                total_gst = inv.cgst + inv.sgst + inv.igst
-                writer.writerow([
-                    inv.id,
-                    inv.created_at.strftime('%Y-%m-%d'),
-                    inv.cgst,
-                    inv.sgst,
-                    inv.igst,
-                    total_gst
+
+    return gst_summary, gst_rates, monthly_gst, total_invoices
+
+
+# Exports
+# Any table or report streams out as CSV, JSONL or XLSX, optionally gzipped.
+# Rows are fetched in batches (a server-side cursor on PostgreSQL) and encoded
+# as they arrive, so memory stays flat however many rows there are.
+EXPORT_BATCH_SIZE = 1000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Whole tables; users (password hashes) and bookkeeping tables are left out
+EXPORT_TABLES = (Product, Customer, Vendor, Invoice, InvoiceItem, Payment, Purchase, PurchaseItem,
+                 VendorPayment, Expense, StockMovement, DailySummary)
+# start_date/end_date filter a table on the first of these it has
+EXPORT_DATE_COLUMNS = ('expense_date', 'payment_date', 'purchase_date', 'day', 'created_at')
+
+class ExportError(Exception):
+    """The export can't be produced (unknown dataset or format, bad filter)"""
+
+def export_dates(args):
+    """start_date/end_date filters, inclusive like the report screens"""
+    try:
+        return [datetime.strptime(args[name], '%Y-%m-%d') if args.get(name) else None
+                for name in ('start_date', 'end_date')]
+    except ValueError:
+        raise ExportError('Dates must look like 2025-04-01')
+
+def date_range(column, start, end):
+    conditions = []
+    if start:
+        conditions.append(column >= start)
+    if end:
+        conditions.append(column <= end)
+    return conditions
+
+def table_export(model):
+    def build(args):
+        table = model.__table__
+        statement = db.select(table)
+        date_column = next((table.c[name] for name in EXPORT_DATE_COLUMNS if name in table.c), None)
+        if date_column is not None:
+            statement = statement.where(*date_range(date_column, *export_dates(args)))
+        return table.c.keys(), statement.order_by(*table.primary_key.columns)
+    return build
+
+def sales_export(args):
+    start, end = export_dates(args)
+    statement = db.select(
+        Invoice.bill_no, Invoice.created_at, Customer.name, Customer.mobile_number, Invoice.total_amount,
+        Invoice.discount, Invoice.cgst, Invoice.sgst, Invoice.igst, Invoice.final_amount,
+        Invoice.paid_amount, Invoice.balance_due, Invoice.payment_status
+    ).outerjoin(Customer, Invoice.customer_id == Customer.id).where(*date_range(Invoice.created_at, start, end))
+    if args.get('customer_id'):
+        statement = statement.where(Invoice.customer_id == int(args['customer_id']))
+    header = ['Invoice No', 'Date', 'Customer', 'Mobile', 'Total', 'Discount', 'CGST', 'SGST', 'IGST',
+              'Final Amount', 'Paid', 'Balance Due', 'Status']
+    return header, statement.order_by(Invoice.created_at, Invoice.id)
+
+def payments_export(args):
+    ledger = payment_ledger(*export_dates(args), category=args.get('payment_type') or args.get('category'),
+                            status=args.get('status'))
+    header = ['Date', 'Type', 'Bill No', 'Party', 'Amount', 'Method', 'Status']
+    return header, db.select(
+        ledger.c.payment_date, ledger.c.category, ledger.c.bill_no, ledger.c.party_name,
+        ledger.c.amount, ledger.c.payment_method, ledger.c.status
+    ).order_by(ledger.c.payment_date, ledger.c.category, ledger.c.id)
+
+def expenses_export(args):
+    statement = db.select(Expense.expense_date, Expense.category, Expense.description, Expense.amount).where(
+        *date_range(Expense.expense_date, *export_dates(args))
+    )
+    if args.get('category'):
+        statement = statement.where(Expense.category == args['category'])
+    return ['Date', 'Category', 'Description', 'Amount'], statement.order_by(Expense.expense_date, Expense.id)
+
+def stock_export(args):
+    """Current stock, or stock on as_of (a date) from the ledger"""
+    quantity = Product.stock_quantity
+    statement = db.select(Product.id)
+    if args.get('as_of'):
+        try:
+            when = datetime.strptime(args['as_of'], '%Y-%m-%d') + timedelta(days=1)
+        except ValueError:
+            raise ExportError('as_of must look like 2025-04-01')
+        on_date = stock_as_of_query(when).subquery()
+        quantity = on_date.c[1]
+        statement = statement.join(on_date, on_date.c.id == Product.id)
+    value = db.type_coerce(db.func.round(Product.selling_price * quantity), Money)
+    header = ['ID', 'Name', 'Category', 'Brand', 'Unit', 'Stock', 'Selling Price', 'Stock Value']
+    return header, statement.add_columns(
+        Product.name, Product.category, Product.brand, Product.unit, quantity, Product.selling_price, value
+    ).order_by(Product.id)
+
+def gst_export(args):
+    header = ['Invoice No', 'Date', 'Customer', 'GST Rate', 'Taxable Value', 'CGST', 'SGST', 'IGST', 'Total GST']
+    return header, gst_export_rows(date_range(Invoice.created_at, *export_dates(args)))
+
+EXPORT_REPORTS = ('sales', 'payments', 'expenses', 'stock', 'gst')
+EXPORTS = {
+    'sales': sales_export,
+    'payments': payments_export,
+    'expenses': expenses_export,
+    'stock': stock_export,
+    'gst': gst_export,
+    **{model.__tablename__: table_export(model) for model in EXPORT_TABLES},
+}
+
+def export_rows(connection, statement):
+    """Yield rows a batch at a time from a streaming cursor"""
+    result = connection.execute(statement.execution_options(stream_results=True, yield_per=EXPORT_BATCH_SIZE))
+    try:
+        for row in result:
+            yield tuple(row)
+    finally:
+        result.close()
+
+def export_json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def stream_jsonl(header, rows, chunk_size=500):
+    """Encode rows as one JSON object per line, in chunks"""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(header, row)), default=export_json_value))
+        if len(lines) == chunk_size:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def stream_xlsx(header, rows, sheet_name='Export', chunk_size=64 * 1024):
+    """Write a workbook in openpyxl's write-only mode to a temp file, then stream it.
+
+    An .xlsx is a zip whose directory comes last, so it can't be sent before
+    it is finished; write-only mode keeps the rows out of memory meanwhile.
+    """
+    if openpyxl is None:
+        raise ExportError('XLSX export needs openpyxl (pip install openpyxl); use csv or jsonl instead')
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet(sheet_name[:31])
+    sheet.append(header)
+    for row in rows:
+        sheet.append(row)
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(chunk_size):
+            yield chunk
+
+def encode_chunks(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+
+def gzip_chunks(chunks, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        if compressed := compressor.compress(chunk):
+            yield compressed
+    yield compressor.flush()
+
+def check_export(dataset, export_format):
+    if dataset not in EXPORTS:
+        raise ExportError(f'Unknown export {dataset}; choose from {", ".join(sorted(EXPORTS))}')
+    if export_format not in EXPORT_FORMATS:
+        raise ExportError(f'Unknown format {export_format}; choose from {", ".join(EXPORT_FORMATS)}')
+    if export_format == 'xlsx' and openpyxl is None:
+        raise ExportError('XLSX export needs openpyxl (pip install openpyxl); use csv or jsonl instead')
+
+def export_allowed(dataset):
+    """Reports are open to every user; whole tables to admins and owners"""
+    return dataset in EXPORT_REPORTS or current_user.role in ['admin', 'owner']
+
+def export_stream(dataset, export_format, args=None, connection=None, compress=False):
+    """(filename, mimetype, byte chunks) for a dataset in export_format"""
+    check_export(dataset, export_format)
+    header, statement = EXPORTS[dataset](args or {})
+    rows = export_rows(connection or db.session.connection(), statement)
+    if export_format == 'csv':
+        chunks = stream_csv(header, rows)
+    elif export_format == 'jsonl':
+        chunks = stream_jsonl(header, rows)
+    else:
+        chunks = stream_xlsx(header, rows, dataset)
+    chunks = encode_chunks(chunks)
+    filename = f"{dataset}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+    mimetype = EXPORT_FORMATS[export_format]
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return filename, mimetype, chunks
+
+def export_response(dataset, export_format, args, compress=False):
+    filename, mimetype, chunks = export_stream(dataset, export_format, args, compress=compress)
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@app.route('/export/<dataset>')
+@login_required
+def export_data(dataset):
+    """?format=csv|jsonl|xlsx&gzip=1 plus the dataset's report filters"""
+    if not export_allowed(dataset):
+        flash('Access denied. Admin/Owner privileges required.', 'error')
+        return redirect(url_for('dashboard'))
+    try:
+        return export_response(dataset, request.args.get('format', 'csv'), request.args,
+                               compress=request.args.get('gzip') == '1')
+    except ExportError as error:
+        return jsonify({'error': str(error)}), 400
+
+@app.cli.command('export')
+@click.argument('datasets', nargs=-1)
+@click.option('--format', 'export_format', default='csv', type=click.Choice(list(EXPORT_FORMATS)))
+@click.option('--gzip', 'compress', is_flag=True, help='Compress each file with gzip')
+@click.option('--folder', default='exports', type=click.Path(file_okay=False), help='Where the files are written')
+@click.option('--start-date', help='Only rows from this date (YYYY-MM-DD)')
+@click.option('--end-date', help='Only rows up to this date (YYYY-MM-DD)')
+def export_command(datasets, export_format, compress, folder, start_date, end_date):
+    """Dump tables or reports to timestamped files; every table when none are named"""
+    os.makedirs(folder, exist_ok=True)
+    args = {'start_date': start_date, 'end_date': end_date}
+    for dataset in datasets or [model.__tablename__ for model in EXPORT_TABLES]:
+        started = time.perf_counter()
+        try:
+            filename, mimetype, chunks = export_stream(dataset, export_format, args, compress=compress)
+            path = os.path.join(folder, filename)
+            # Written under a temporary name so a scheduled copy never picks up half a file
+            with open(path + '.part', 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+            os.replace(path + '.part', path)
+        except ExportError as error:
+            print(f"{dataset}: {error}")
+            sys.exit(1)
+        print(f"{path}: {os.path.getsize(path):,} bytes in {time.perf_counter() - started:.1f} s")
+
+@app.cli.command('bench-export')
+@click.option('--rows', default=1000000, help='Rows in the generated expense table')
+def bench_export_command(rows):
+    """Time exporting a generated table in each format and track peak Python memory"""
+    rng = random.Random(7)
+    categories = ['Rent', 'Salary', 'Electricity', 'Transport', 'Tea', 'Repairs']
+    start = datetime(2024, 4, 1)
+    formats = ['csv', 'jsonl'] + (['xlsx'] if openpyxl is not None else [])
+    with tempfile.TemporaryDirectory() as folder:
+        engine = db.create_engine(f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        Expense.__table__.create(engine)
+        with engine.begin() as connection:
+            for first in range(0, rows, 50000):
+                connection.execute(db.insert(Expense.__table__), [
+                    {'category': rng.choice(categories), 'description': f'Voucher {number}',
+                     'amount': Decimal(rng.randint(100, 500000)) / 100,
+                     'expense_date': start + timedelta(minutes=number), 'created_at': start}
+                    for number in range(first, min(rows, first + 50000))
                 ])
+        with engine.connect() as connection:
+            def run(export_format, compress):
+                filename, mimetype, chunks = export_stream('expense', export_format, connection=connection,
+                                                           compress=compress)
+                return sum(len(chunk) for chunk in chunks)
 
-        flash(f"CSV report saved to server at: {filepath}")
-    
+            for export_format in formats:
+                for compress in (False, True):
+                    started = time.perf_counter()
+                    size = run(export_format, compress)
+                    elapsed = time.perf_counter() - started
+                    print(f"{export_format}{' gzip' if compress else ''}: {rows:,} rows, {size / 1e6:,.1f} MB "
+                          f"in {elapsed:.1f} s ({rows / elapsed:,.0f} rows/s)")
+                # Traced separately: tracemalloc slows everything it watches
+                tracemalloc.start()
+                run(export_format, False)
+                print(f"{export_format}: peak Python memory {tracemalloc.get_traced_memory()[1] / 1e6:.1f} MB")
+                tracemalloc.stop()
+        engine.dispose()
 
-    # Manual pagination
-    per_page = 10
-    start = (page - 1) * per_page
-    end = start + per_page
-    paginated_invoices = invoices[start:end]
-    
-    total_pages = (len(invoices) + per_page - 1) // per_page
-    has_prev = page > 1
-    has_next = page < total_pages
-    
-    
-    return render_template('gst_report.html',
-                        page=page,  
-                        has_next=has_next,
-                         has_prev=has_prev,
-                         total_pages=total_pages,
-                         start_date=start_date,end_date=end_date,
-                         invoices=paginated_invoices,
-                         gst_summary=gst_summary,
-                         gst_by_rate=gst_by_rate,
-                         monthly_gst=monthly_gst)
+# Bulk import
+# Product, customer and vendor files are read a row at a time and written in
+# batches, one transaction per batch, matched to existing rows on a natural
+# key. A bad row is rejected with its line number; the rest of the file loads.
+class ImportFileError(Exception):
+    """The file as a whole can't be imported (format, missing columns)"""
+
+# Rejected rows kept on the result; the rest are only counted (and written to rejects)
+IMPORT_REJECT_LIMIT = 1000
+
+def import_text(row, column, required=False):
+    value = row.get(column)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise ValueError(f'{column} is required')
+    return value or None
+
+def import_number(row, column, parse=float, required=True):
+    value = import_text(row, column, required)
+    if value is None:
+        return None
+    try:
+        number = parse(value)
+    except (ValueError, ArithmeticError):
+        raise ValueError(f'{column} is not a number: {value}')
+    if number < 0:
+        raise ValueError(f'{column} cannot be negative')
+    return number
+
+def import_mobile(row):
+    mobile = import_text(row, 'mobile_number', required=True)
+    if not re.fullmatch(r'\+?[0-9]{6,15}', mobile):
+        raise ValueError(f'mobile_number is not a phone number: {mobile}')
+    return mobile
+
+def parse_product_row(row):
+    values = {
+        'name': import_text(row, 'name', required=True),
+        'category': import_text(row, 'category', required=True),
+        'brand': import_text(row, 'brand', required=True),
+        'mrp_price': import_number(row, 'mrp_price', to_money),
+        'cost_price': import_number(row, 'cost_price', to_money),
+        'selling_price': import_number(row, 'selling_price', to_money),
+        'gst_rate': import_number(row, 'gst_rate'),
+        'unit': import_text(row, 'unit'),
+        'vendor_id': import_number(row, 'vendor_id', int, required=False),
+        # Blank leaves an existing product's stock alone
+        'stock_quantity': import_number(row, 'stock_quantity', required=False),
+    }
+    if values['gst_rate'] > 100:
+        raise ValueError(f"gst_rate is not a percentage: {values['gst_rate']:g}")
+    return values
 
+def parse_customer_row(row):
+    return {
+        'name': import_text(row, 'name', required=True),
+        'mobile_number': import_mobile(row),
+        'email': import_text(row, 'email'),
+        'address': import_text(row, 'address'),
+    }
+
+def parse_vendor_row(row):
+    return {
+        'name': import_text(row, 'name', required=True),
+        'mobile_number': import_mobile(row),
+        'gst_number': import_text(row, 'gst_number'),
+        'address': import_text(row, 'address'),
+        'products_supplied': import_text(row, 'products_supplied'),
+    }
+
+# kind: (model, natural key columns, row parser, required columns)
+IMPORTERS = {
+    'product': (Product, ('name', 'brand'), parse_product_row,
+                ('name', 'category', 'brand', 'mrp_price', 'cost_price', 'selling_price', 'gst_rate')),
+    'customer': (Customer, ('mobile_number',), parse_customer_row, ('name', 'mobile_number')),
+    'vendor': (Vendor, ('mobile_number',), parse_vendor_row, ('name', 'mobile_number')),
+}
+
+def import_header(name):
+    return str(name or '').strip().strip('"').strip().lower().replace(' ', '_')
+
+def import_cell(value):
+    # Spreadsheets hand back 9876543210.0 for a mobile number typed as a number
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def read_csv_rows(path):
+    """Yield (line, row, fraction of the file read) from a CSV file"""
+    with open(path, 'rb') as raw:
+        size = os.fstat(raw.fileno()).st_size or 1
+        reader = csv.reader(TextIOWrapper(raw, encoding='utf-8-sig', newline=''), skipinitialspace=True)
+        header = [import_header(name) for name in next(reader, [])]
+        yield 1, header, 0.0
+        for values in reader:
+            if any(value.strip() for value in values):
+                yield reader.line_num, dict(zip(header, values)), raw.tell() / size
+
+def read_xlsx_rows(path):
+    """Yield (line, row, fraction of the sheet read) from the first sheet of a workbook"""
+    if openpyxl is None:
+        raise ImportFileError('Reading .xlsx files needs openpyxl (pip install openpyxl); save the sheet as CSV instead')
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        sheet = workbook.worksheets[0]
+        total = sheet.max_row or 1
+        rows = sheet.iter_rows(values_only=True)
+        header = [import_header(name) for name in next(rows, ())]
+        yield 1, header, 0.0
+        for line, values in enumerate(rows, 2):
+            if any(value not in (None, '') for value in values):
+                yield line, dict(zip(header, map(import_cell, values))), min(line / total, 1.0)
+    finally:
+        workbook.close()
+
+def read_import_file(path, filename=None):
+    extension = os.path.splitext(filename or path)[1].lower()
+    if extension in ('.csv', '.txt'):
+        return read_csv_rows(path)
+    if extension == '.xlsx':
+        return read_xlsx_rows(path)
+    raise ImportFileError(f'Unsupported file type {extension or "(none)"}; use .csv or .xlsx')
+
+def write_import_batch(kind, batch, user_id=None):
+    """Insert or update one batch of parsed rows; returns (inserted, updated).
+
+    Existing rows are compared with the file and only changed columns are
+    written, so re-importing an unchanged price list costs one SELECT a batch.
+    """
+    model, keys, parse, required = IMPORTERS[kind]
+    key_columns = [getattr(model, key) for key in keys]
+    names = list(next(iter(batch.values())))
+    existing = {}
+    existing_rows = db.session.query(model.id, *(getattr(model, name) for name in names))
+    if model is Product:
+        existing_rows = existing_rows.with_for_update()
+    for row in existing_rows.filter(
+        db.tuple_(*key_columns).in_(list(batch)) if len(keys) > 1 else key_columns[0].in_([key[0] for key in batch])
+    ).order_by(model.id.desc()):
+        # Several products may share a name and brand; the oldest one is updated
+        existing[tuple(getattr(row, key) for key in keys)] = row
+
+    now = datetime.utcnow()
+    inserts, updates, movements, restocks = [], [], [], []
+    for key, values in batch.items():
+        row = existing.get(key)
+        if row is None:
+            values = dict(values)
+            if model is Product:
+                values['stock_quantity'] = values['stock_quantity'] or 0
+            inserts.append(values)
+            continue
+        changes = {name: value for name, value in values.items() if value != getattr(row, name)}
+        if model is Product:
+            # A blank stock figure keeps the current stock; a new one is an
+            # adjustment, applied to the stored stock as a difference so a sale
+            # committed since the read above isn't overwritten
+            stock = changes.pop('stock_quantity', None)
+            if stock is not None:
+                movements.append({'product_id': row.id, 'quantity': stock - (row.stock_quantity or 0), 'reason': 'adjustment'})
+                restocks.append({'product_id': row.id, 'difference': stock - (row.stock_quantity or 0)})
+                if not changes:
+                    changes['updated_at'] = now
+        if changes:
+            changes['id'] = row.id
+            if model is not Vendor:
+                changes['updated_at'] = now
+            updates.append(changes)
+
+    if inserts:
+        # Matching ids to rows by key lets the inserts go out as multi-row VALUES
+        ids = {tuple(row[1:]): row[0] for row in db.session.execute(
+            db.insert(model.__table__).returning(model.id, *key_columns), inserts
+        )}
+        if model is Product:
+            movements += [{'product_id': ids[(values['name'], values['brand'])],
+                           'quantity': values['stock_quantity'], 'reason': 'opening'}
+                          for values in inserts if values['stock_quantity']]
+        elif model is Customer:
+            bump_daily_summary(now.date(), new_customers=len(ids))
+    # One executemany per set of changed columns
+    for columns in {tuple(sorted(changes)) for changes in updates}:
+        db.session.execute(db.update(model), [changes for changes in updates if tuple(sorted(changes)) == columns])
+    if restocks:
+        table = Product.__table__
+        db.session.execute(db.update(table).where(table.c.id == db.bindparam('product_id')).values(
+            stock_quantity=db.func.coalesce(table.c.stock_quantity, 0) + db.bindparam('difference')
+        ), restocks)
+    if movements:
+        record_movements(movements, user_id=user_id)
+    return len(inserts), len(updates)
+
+def import_rows(kind, rows, progress=None, rejects=None, batch_size=None, user_id=None):
+    """Import (line, row, fraction) tuples as read_import_file yields them.
+
+    Returns counts plus the first IMPORT_REJECT_LIMIT rejected rows; every
+    rejected row also goes to rejects (a csv.writer) when one is given.
+    progress(result, fraction) is called after each batch commits.
+    """
+    model, keys, parse, required = IMPORTERS[kind]
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    line, header, fraction = next(rows, (1, [], 0.0))
+    missing = [column for column in required if column not in header]
+    if missing:
+        raise ImportFileError(f"Missing column(s): {', '.join(missing)}")
+    result = {'kind': kind, 'rows': 0, 'inserted': 0, 'updated': 0, 'unchanged': 0, 'rejected': 0, 'errors': []}
+
+    def reject(line, message):
+        result['rejected'] += 1
+        if len(result['errors']) < IMPORT_REJECT_LIMIT:
+            result['errors'].append({'line': line, 'message': message})
+        if rejects is not None:
+            rejects.writerow([line, message])
+
+    def flush(batch):
+        try:
+            inserted, updated = write_import_batch(kind, {key: values for key, (line, values) in batch.items()}, user_id)
+            if kind == 'product':
+                invalidate_price_table()
+                record_low_stock()
+            db.session.commit()
+        except Exception as error:
+            db.session.rollback()
+            for line, values in batch.values():
+                reject(line, f'not saved: {error.__class__.__name__}: {str(error).splitlines()[0]}')
+            return
+        result['inserted'] += inserted
+        result['updated'] += updated
+        result['unchanged'] += len(batch) - inserted - updated
+
+    batch = {}
+    for line, row, fraction in rows:
+        result['rows'] += 1
+        try:
+            values = parse(row)
+        except ValueError as error:
+            reject(line, str(error))
+            continue
+        # A key repeated within a batch keeps its last row
+        batch[tuple(values[key] for key in keys)] = (line, values)
+        if len(batch) >= batch_size:
+            flush(batch)
+            batch = {}
+            if progress:
+                progress(result, fraction)
+    if batch:
+        flush(batch)
+    if progress:
+        progress(result, 1.0)
+    return result
+
+def import_file(kind, path, filename=None, **options):
+    return import_rows(kind, read_import_file(path, filename), **options)
+
+@app.cli.command('import-data')
+@click.argument('kind', type=click.Choice(sorted(IMPORTERS)))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--rejects', type=click.Path(dir_okay=False), help='Write rejected rows (line, reason) to this CSV')
+@click.option('--batch-size', type=int, help='Rows per transaction')
+def import_data_command(kind, path, rejects, batch_size):
+    """Load products, customers or vendors from a .csv or .xlsx file"""
+    started = time.perf_counter()
+
+    def progress(result, fraction):
+        print(f"\r{fraction:4.0%}  {result['rows']} rows, {result['rejected']} rejected", end='', file=sys.stderr)
+
+    with open(rejects, 'w', newline='') if rejects else open(os.devnull, 'w') as reject_file:
+        writer = csv.writer(reject_file)
+        writer.writerow(['line', 'reason'])
+        try:
+            result = import_file(kind, path, progress=progress, rejects=writer, batch_size=batch_size)
+        except ImportFileError as error:
+            print(f"Cannot import {path}: {error}")
+            sys.exit(1)
+    elapsed = time.perf_counter() - started
+    print(file=sys.stderr)
+    print(f"{result['rows']} rows in {elapsed:.1f} s ({result['rows'] / max(elapsed, 1e-9):,.0f} rows/s): "
+          f"{result['inserted']} added, {result['updated']} updated, {result['unchanged']} unchanged, "
+          f"{result['rejected']} rejected")
+    for error in result['errors'][:20]:
+        print(f"  line {error['line']}: {error['message']}")
+
+@app.cli.command('bench-import')
+@click.option('--rows', default=30000, help='Products in the generated price list')
+def bench_import_command(rows):
+    """Time importing a generated price list into a scratch database, then re-importing it"""
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'price_list.csv')
+        with open(path, 'w', newline='') as price_list:
+            writer = csv.writer(price_list)
+            writer.writerow(['name', 'category', 'brand', 'mrp_price', 'cost_price', 'selling_price', 'gst_rate', 'unit', 'stock_quantity'])
+            for number in range(rows):
+                mrp = rng.randint(50, 5000)
+                writer.writerow([f'Item {number}', rng.choice(['Wire', 'Switch', 'Fan', 'MCB']), f'Brand {number % 200}',
+                                 mrp, round(mrp * 0.7, 2), round(mrp * 0.9, 2), rng.choice([5, 12, 18, 28]), 'pcs',
+                                 rng.randint(0, 100)])
+        env = dict(os.environ, BILLSYS_DATABASE_URL=f"sqlite:///{os.path.join(folder, 'bench.db')}")
+        flask = [sys.executable, '-m', 'flask', '--app', 'app']
+        subprocess.run(flask + ['upgrade-db'], env=env, cwd=app.root_path, check=True, stdout=subprocess.DEVNULL)
+        for label in ('new products', 'same file again'):
+            output = subprocess.run(flask + ['import-data', 'product', path], env=env, cwd=app.root_path,
+                                    check=True, capture_output=True, text=True).stdout
+            print(f"{label}: {output.strip()}")
+
+def start_import_job(kind, upload, user_id=None):
+    """Save an uploaded file and import it as a background job"""
+    folder = tempfile.mkdtemp(prefix='billsys-import-')
+    path = os.path.join(folder, secure_filename(upload.filename) or 'upload.csv')
+    upload.save(path)
+    filename = upload.filename
+
+    def work(job, result_path):
+        def progress(result, fraction):
+            job.update(progress=fraction, result=dict(result, errors=result['errors'][:50]))
+
+        try:
+            result = import_file(kind, path, filename, progress=progress, user_id=user_id)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+        return dict(result, errors=result['errors'][:50])
+
+    return submit_job('import', kind, work, description=filename, user_id=user_id)
+
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required
+@role_required('admin', 'owner')
+def admin_import():
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        if kind not in IMPORTERS or not upload or not upload.filename:
+            flash('Choose what to import and a .csv or .xlsx file.', 'error')
+            return redirect(url_for('admin_import'))
+        job = start_import_job(kind, upload, current_user.id)
+        flash(f"Importing {upload.filename}; progress is shown below.", 'success')
+        return redirect(url_for('admin_import', job=job['id']))
+
+    with _jobs_lock:
+        jobs = [job_status(job) for job in reversed(_jobs.values()) if job['kind'] == 'import'][:10]
+    columns = {kind: (required, IMPORTERS[kind][0].__table__.c.keys()) for kind, (model, keys, parse, required) in IMPORTERS.items()}
+    return render_template('admin_import.html', jobs=jobs, columns=columns, current_job=request.args.get('job'))
 
 # Admin Routes
 @app.route('/admin/users')
 @login_required
+@role_required('admin', 'owner')
 def admin_users():
-    if current_user.role not in ['admin', 'owner']:
-        flash('Access denied. Admin/Owner privileges required.', 'error')
-        return redirect(url_for('dashboard'))
-    
     users = User.query.all()
     
     # Calculate user statistics
@@ -1555,21 +4650,15 @@ def admin_users():
 
 @app.route('/admin/passwords')
 @login_required
+@role_required('admin', 'owner')
 def manage_passwords():
-    if current_user.role not in ['admin', 'owner']:
-        flash('Access denied. Admin/Owner privileges required.', 'error')
-        return redirect(url_for('dashboard'))
-    
     users = User.query.all()
     return render_template('manage_passwords.html', users=users)
 
 @app.route('/admin/users/add', methods=['POST'])
 @login_required
+@role_required('admin', 'owner')
 def add_user():
-    if current_user.role not in ['admin', 'owner']:
-        flash('Access denied. Admin/Owner privileges required.', 'error')
-        return redirect(url_for('dashboard'))
-    
     user = User(
         mobile_number=request.form['mobile_number'],
         name=request.form['name'],
@@ -1589,11 +4678,8 @@ def add_user():
 
 @app.route('/admin/users/delete/<int:user_id>', methods=['POST'])
 @login_required
+@role_required('admin', 'owner')
 def delete_user(user_id):
-    if current_user.role not in ['admin', 'owner']:
-        flash('Access denied. Admin/Owner privileges required.', 'error')
-        return redirect(url_for('dashboard'))
-    
     if user_id == current_user.id:
         flash('Cannot delete your own account.', 'error')
         return redirect(url_for('admin_users'))
@@ -1606,11 +4692,8 @@ def delete_user(user_id):
 
 @app.route('/admin/users/reset-password/<int:user_id>', methods=['POST'])
 @login_required
+@role_required('admin')
 def reset_user_password_by_id(user_id):
-    if current_user.role != 'admin':
-        flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('dashboard'))
-    
     user = User.query.get_or_404(user_id)
     new_password = request.form['new_password']
     user.set_password(new_password)
@@ -1625,8 +4708,10 @@ def change_password():
     new_password = request.form['new_password']
     confirm_password = request.form.get('confirm_password', '')
     
+    user = db.session.get(User, current_user.id)
+    
     # Validate current password
-    if not current_user.check_password(current_password):
+    if not user.check_password(current_password):
         flash('Current password is incorrect.', 'error')
         return redirect(request.referrer or url_for('manage_passwords'))
     
@@ -1640,18 +4725,15 @@ def change_password():
         flash('New passwords do not match.', 'error')
         return redirect(request.referrer or url_for('manage_passwords'))
     
-    current_user.set_password(new_password)
+    user.set_password(new_password)
     db.session.commit()
     flash('Password changed successfully!', 'success')
     return redirect(request.referrer or url_for('manage_passwords'))
 
 @app.route('/admin/reset-password', methods=['POST'])
 @login_required
+@role_required('admin', 'owner')
 def reset_user_password():
-    if current_user.role not in ['admin', 'owner']:
-        flash('Access denied. Admin/Owner privileges required.', 'error')
-        return redirect(url_for('dashboard'))
-    
     user_id = request.form['user_id']
     new_password = request.form['new_password']
     confirm_password = request.form.get('confirm_password', '')
@@ -1685,12 +4767,674 @@ def reset_user_password():
 
 @app.route('/admin/settings')
 @login_required
+@role_required('admin')
 def admin_settings():
-    if current_user.role != 'admin':
-        flash('Access denied. Admin privileges required.', 'error')
-        return redirect(url_for('dashboard'))
     return render_template('admin_settings.html')
 
+# Query plan check
+# Tables that grow with every bill; a plain SCAN of one of these means a view
+# has lost its index and will slow down as the shop's history grows.
+PLAN_CHECK_TABLES = ('invoice', 'invoice_item', 'payment', 'vendor_payment', 'purchase', 'purchase_item', 'expense')
+
+def plan_check_urls():
+    today = datetime.utcnow()
+    start = (today - timedelta(days=30)).strftime('%Y-%m-%d')
+    end = today.strftime('%Y-%m-%d')
+    urls = [
+        '/sales',
+        '/sales?status=unpaid',
+        f'/reports/sales?start_date={start}&end_date={end}',
+        f'/reports/sales?start_date={start}&end_date={end}&customer_id=1',
+        f'/reports/payment?start_date={start}&end_date={end}',
+        f'/reports/gst?start_date={start}&end_date={end}',
+        f"/expenses?month={today.strftime('%Y-%m')}",
+        f"/expenses?month={today.strftime('%Y-%m')}&category=Rent",
+        '/reports/aging',
+        '/reports/aging?party=vendor',
+    ]
+    customer = Customer.query.order_by(Customer.id).first()
+    if customer:
+        urls.append(url_for('customer_detail', customer_id=customer.id))
+    return urls
+
+def full_scans(connection, statement, parameters):
+    plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    scans = []
+    for row in plan:
+        detail = row[-1]
+        words = detail.split()
+        if len(words) >= 2 and words[0] == 'SCAN' and words[1] in PLAN_CHECK_TABLES and 'USING' not in words:
+            scans.append(detail)
+    return scans
+
+def check_client():
+    """Test client signed in as the first user, or None if there are no users"""
+    user = User.query.order_by(User.id).first()
+    if user is None:
+        return None
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = str(user.id)
+        sess['_fresh'] = True
+    return client
+
+@contextmanager
+def recorded_statements():
+    """Collect (statement, parameters) for everything run on the engine"""
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """Fail if a report or list view falls back to a full table scan"""
+    if db.engine.dialect.name != 'sqlite':
+        print('Query plan checks read SQLite plans; use EXPLAIN on other databases')
+        sys.exit(1)
+    client = check_client()
+    if client is None:
+        print('No users in the database; run create_default_admin first')
+        sys.exit(1)
+
+    with app.test_request_context():
+        urls = plan_check_urls()
+
+    failures = 0
+    with recorded_statements() as statements:
+        for url in urls:
+            del statements[:]
+            response = client.get(url)
+            selects = [(statement, parameters) for statement, parameters in statements
+                       if statement.lstrip().upper().startswith('SELECT')]
+            with db.engine.connect() as connection:
+                scans = [(statement, detail) for statement, parameters in selects
+                         for detail in full_scans(connection, statement, parameters)]
+            if response.status_code != 200 or scans:
+                failures += 1
+                print(f"FAIL {url} ({response.status_code})")
+                for statement, detail in scans:
+                    print(f"    {detail}: {' '.join(statement.split())[:160]}")
+            else:
+                print(f"ok   {url} ({len(selects)} queries)")
+    if failures:
+        sys.exit(1)
+
+# Query count check
+# Statements a detail view may issue however long the customer's or vendor's
+# history is; going over it means rows are being loaded one at a time.
+QUERY_COUNT_LIMIT = 10
+
+def query_count_urls():
+    """Detail pages for the customer, vendor, invoice and purchase with the most rows"""
+    urls = []
+    for key, endpoint, argument in (
+        (Invoice.customer_id, 'customer_detail', 'customer_id'),
+        (Purchase.vendor_id, 'vendor_detail', 'vendor_id'),
+        (InvoiceItem.invoice_id, 'sales_detail', 'invoice_id'),
+        (PurchaseItem.purchase_id, 'purchase_detail', 'purchase_id'),
+    ):
+        busiest = db.session.query(key).filter(key.isnot(None)).group_by(key) \
+            .order_by(db.func.count().desc()).limit(1).scalar()
+        if busiest is not None:
+            urls.append(url_for(endpoint, **{argument: busiest}))
+    return urls
+
+@app.cli.command('check-query-counts')
+def check_query_counts_command():
+    """Fail if a detail view issues more than QUERY_COUNT_LIMIT statements"""
+    client = check_client()
+    if client is None:
+        print('No users in the database; run create_default_admin first')
+        sys.exit(1)
+
+    with app.test_request_context():
+        urls = query_count_urls()
+
+    failures = 0
+    with recorded_statements() as statements:
+        for url in urls:
+            del statements[:]
+            response = client.get(url)
+            if response.status_code != 200 or len(statements) > QUERY_COUNT_LIMIT:
+                failures += 1
+                print(f"FAIL {url} ({response.status_code}, {len(statements)} queries)")
+                for statement, parameters in statements:
+                    print(f"    {' '.join(statement.split())[:160]}")
+            else:
+                print(f"ok   {url} ({len(statements)} queries)")
+    if failures:
+        sys.exit(1)
+
+PORTABLE_DIALECTS = {'sqlite': sqlite.dialect(), 'postgresql': postgresql.dialect()}
+
+def portable_statements():
+    """Dialect-dependent statements the app builds, keyed by a short label"""
+    summary = DailySummary.__table__
+    sequence = DocumentSequence.__table__
+    return {
+        'daily summary upsert': lambda dialect: upsert(
+            summary, {'day': datetime.utcnow().date(), 'sales_total': 1}, ['day'],
+            lambda excluded: {'sales_total': summary.c.sales_total + excluded.sales_total}, dialect=dialect),
+        'sequence seed': lambda dialect: upsert(
+            sequence, {'name': 'INV', 'next_value': 1}, ['name'], dialect=dialect),
+        'sales by day': lambda dialect: db.select(day_string(Invoice.created_at), db.func.sum(Invoice.final_amount))
+            .group_by(day_string(Invoice.created_at)),
+        'tax by month': lambda dialect: db.select(month_string(Invoice.created_at), db.func.sum(Invoice.cgst))
+            .group_by(month_string(Invoice.created_at)),
+    }
+
+@app.cli.command('check-portability')
+def check_portability_command():
+    """Compile dialect-specific SQL for every supported backend, then load the
+    main pages against the configured database.
+
+    Run once per backend, e.g. with BILLSYS_DATABASE_URL pointing at a local
+    PostgreSQL, to cover the SQLite/PostgreSQL matrix.
+    """
+    failures = 0
+    for label, build in portable_statements().items():
+        for name, dialect in PORTABLE_DIALECTS.items():
+            try:
+                build(name).compile(dialect=dialect)
+                print(f"ok   {name}: {label}")
+            except Exception as e:
+                failures += 1
+                print(f"FAIL {name}: {label} ({e})")
+
+    client = check_client()
+    if client is None:
+        print('No users in the database; run create_default_admin first')
+        sys.exit(1)
+    with app.test_request_context():
+        urls = list(dict.fromkeys(plan_check_urls() + query_count_urls()))
+    for url in urls:
+        response = client.get(url)
+        if response.status_code != 200:
+            failures += 1
+            print(f"FAIL {db.engine.dialect.name}: {url} ({response.status_code})")
+        else:
+            print(f"ok   {db.engine.dialect.name}: {url}")
+    if failures:
+        sys.exit(1)
+
+# Load test
+LOAD_TEST_MOBILE = '0000000000'
+LOAD_TEST_PASSWORD = 'load-test'
+
+def load_test_database(source, folder):
+    """Copy the database for a load test and add a sign-in and a well-stocked product"""
+    path = os.path.join(folder, 'load_test.db')
+    with sqlite3.connect(source) as original, sqlite3.connect(path) as copy:
+        original.backup(copy)
+        copy.execute(
+            "INSERT INTO user (mobile_number, password_hash, role, name, created_at) VALUES (?, ?, 'admin', 'Load Test', ?) "
+            "ON CONFLICT (mobile_number) DO UPDATE SET password_hash = excluded.password_hash",
+            (LOAD_TEST_MOBILE, generate_password_hash(LOAD_TEST_PASSWORD, method=password_hash_method()), datetime.utcnow())
+        )
+        product = db.session.query(Product.id, Product.selling_price).order_by(Product.id).first()
+        if product:
+            copy.execute("UPDATE product SET stock_quantity = stock_quantity + 1000000 WHERE id = ?", (product[0],))
+            copy.execute(
+                "INSERT INTO stock_movement (product_id, quantity, reason, created_at) VALUES (?, 1000000, 'adjustment', ?)",
+                (product[0], datetime.utcnow())
+            )
+    return path, product
+
+def load_test_client(base_url, product, start, seconds, results):
+    """Sign in, wait for the other clients, then send a mix of reads and POS sales"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor())
+    opener.open(base_url + '/login', urllib.parse.urlencode(
+        {'mobile_number': LOAD_TEST_MOBILE, 'password': LOAD_TEST_PASSWORD}
+    ).encode())
+    # Password hashing is slow by design, so timing starts once everyone is signed in
+    start.wait()
+    deadline = time.perf_counter() + seconds
+    reads = ['/dashboard', '/api/products?search=a', '/sales', '/reports/aging']
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        if product and rng.random() < 0.3:
+            price = float(product[1])
+            sale = json.dumps({'customer_id': None, 'total_amount': price, 'final_amount': price,
+                               'payment_amount': price, 'payment_method': 'cash',
+                               'items': [{'product_id': product[0], 'quantity': 1,
+                                          'unit_price': price, 'total_price': price}]}).encode()
+            outgoing = urllib.request.Request(base_url + '/pos/create-invoice', sale,
+                                              {'Content-Type': 'application/json'})
+        else:
+            outgoing = urllib.request.Request(base_url + rng.choice(reads))
+        started = time.perf_counter()
+        try:
+            with opener.open(outgoing) as response:
+                response.read()
+            results.append(time.perf_counter() - started)
+        except (urllib.error.URLError, OSError):
+            results.append(None)
+
+@app.cli.command('load-test')
+@click.option('--workers', default='1,2,4', help='Comma-separated worker counts to compare')
+@click.option('--clients', default=8, help='Concurrent simulated counters')
+@click.option('--seconds', default=10.0, help='Duration of each run')
+def load_test_command(workers, clients, seconds):
+    """Measure serve.py throughput per worker count on a scratch copy of the database"""
+    source = db.engine.url.database
+    if db.engine.dialect.name != 'sqlite' or not source or source == ':memory:':
+        print('The load test copies a SQLite database file; point BILLSYS_DATABASE_URL at one')
+        sys.exit(1)
+    # Forked worker processes sidestep the GIL; without fork, compare thread counts
+    option = '--processes' if hasattr(os, 'fork') else '--threads'
+    serve_script = os.path.join(app.root_path, 'serve.py')
+
+    with tempfile.TemporaryDirectory() as folder:
+        path, product = load_test_database(source, folder)
+        for count in [int(value) for value in workers.split(',')]:
+            with socket.socket() as probe:
+                probe.bind(('127.0.0.1', 0))
+                port = probe.getsockname()[1]
+            env = dict(os.environ, BILLSYS_DATABASE_URL=f'sqlite:///{path}')
+            server = subprocess.Popen(
+                [sys.executable, serve_script, '--host', '127.0.0.1', '--port', str(port), option, str(count)],
+                env=env, cwd=app.root_path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+            )
+            try:
+                for _ in range(300):
+                    try:
+                        socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+                        break
+                    except OSError:
+                        time.sleep(0.1)
+                results = []
+                start = threading.Barrier(clients)
+                threads = [threading.Thread(target=load_test_client,
+                                            args=(f'http://127.0.0.1:{port}', product, start, seconds, results))
+                           for _ in range(clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+            finally:
+                server.terminate()
+                server.wait()
+            timings = sorted(result for result in results if result is not None)
+            errors = len(results) - len(timings)
+            p95 = timings[int(len(timings) * 0.95)] * 1000 if timings else 0
+            print(f"{option[2:]}={count}: {len(timings) / seconds:.1f} req/s, "
+                  f"p95 {p95:.1f} ms, {errors} errors")
+
+# Synthetic data
+# A made-up shop's history at any scale, for benchmarks. The same seed gives
+# the same data. Bills are priced with price_basket() like the POS does, and
+# stock, balances, rollups and snapshots are rebuilt so every check passes.
+SYNTHETIC_PRODUCTS = {
+    'Wires & Cables': ['Copper Wire', 'Flexible Cable', 'Armoured Cable', 'Coaxial Cable'],
+    'Switchgear': ['MCB', 'RCCB', 'Isolator', 'Distribution Board', 'Changeover Switch'],
+    'Switches & Sockets': ['Modular Switch', 'Socket', 'Plug Top', 'Bell Push', 'Fan Regulator'],
+    'Lighting': ['LED Bulb', 'Tube Light', 'Panel Light', 'Flood Light', 'Batten'],
+    'Fans': ['Ceiling Fan', 'Exhaust Fan', 'Pedestal Fan', 'Wall Fan'],
+    'Accessories': ['Conduit Pipe', 'Junction Box', 'Insulation Tape', 'Cable Tie', 'Holder', 'Extension Board'],
+}
+SYNTHETIC_SPECS = ['6A', '16A', '32A', '63A', '1 sq mm', '1.5 sq mm', '2.5 sq mm', '4 sq mm',
+                   '9W', '12W', '20W', '36W', '600mm', '1200mm', '20mm', '25mm']
+SYNTHETIC_BRANDS = ['Havells', 'Polycab', 'Anchor', 'Finolex', 'Legrand', 'Schneider', 'Crompton',
+                    'Philips', 'Syska', 'Orient', 'Bajaj', 'Wipro']
+SYNTHETIC_NAMES = ['Ravi', 'Suresh', 'Lakshmi', 'Priya', 'Arun', 'Kavitha', 'Mohan', 'Divya', 'Ganesh',
+                   'Meena', 'Prakash', 'Anitha', 'Senthil', 'Revathi', 'Karthik', 'Deepa']
+SYNTHETIC_SURNAMES = ['Kumar', 'Raj', 'Devi', 'Murugan', 'Reddy', 'Nair', 'Iyer', 'Pillai', 'Rao', 'Sharma']
+SYNTHETIC_EXPENSES = ['Rent', 'Salary', 'Electricity', 'Transport', 'Tea & Snacks', 'Repairs', 'Stationery']
+PAYMENT_METHODS = ['cash', 'upi', 'card']
+
+def next_id(model):
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+def synthetic_when(rng, start, span, number, count):
+    """The number-th of count moments spread evenly (with jitter) over span from start"""
+    return start + span * ((number + rng.random()) / count)
+
+def synthetic_payment(rng, final_amount, walk_in=False):
+    """(amount paid at billing, payment_status): most bills are settled on the spot"""
+    roll = rng.random()
+    if walk_in or roll < 0.75:
+        return final_amount, 'paid'
+    if roll < 0.9:
+        return to_money(final_amount * Decimal(rng.randint(20, 80)) / 100), 'partial'
+    return Decimal('0.00'), 'unpaid'
+
+def generate_shop_data(rng, years, invoices, products, customers, vendors, purchases, expenses_per_month,
+                       batch_size, progress=print):
+    """Add a synthetic history ending now; only the rows it creates are referenced"""
+    end = datetime.utcnow().replace(microsecond=0)
+    start = end - timedelta(days=round(365 * years))
+    span = end - start
+    opened = start - timedelta(days=1)
+
+    first_vendor = next_id(Vendor)
+    db.session.execute(db.insert(Vendor.__table__), [{
+        'id': first_vendor + number, 'name': f'{rng.choice(SYNTHETIC_BRANDS)} Distributors {first_vendor + number}',
+        'mobile_number': f'5{first_vendor + number:09d}', 'gst_number': f'33ABCDE{first_vendor + number:04d}F1Z5',
+        'address': 'Synthetic', 'balance_due': 0, 'created_at': opened,
+    } for number in range(vendors)])
+
+    first_product = next_id(Product)
+    product_rows = []
+    for number in range(products):
+        category = rng.choice(list(SYNTHETIC_PRODUCTS))
+        cost = to_money(Decimal(str(round(10 ** rng.uniform(1, 3.7), 2))))
+        selling = to_money(cost * Decimal('1.25'))
+        product_rows.append({
+            'id': first_product + number, 'category': category, 'brand': rng.choice(SYNTHETIC_BRANDS),
+            'name': f"{rng.choice(SYNTHETIC_PRODUCTS[category])} {rng.choice(SYNTHETIC_SPECS)} {rng.randint(100, 999)}",
+            'cost_price': cost, 'selling_price': selling, 'mrp_price': to_money(selling * Decimal('1.1')),
+            'gst_rate': rng.choices([5, 12, 18, 28], [1, 2, 6, 1])[0], 'stock_quantity': 0, 'unit': 'pcs',
+            'vendor_id': first_vendor + rng.randrange(vendors) if vendors else None,
+            'created_at': opened, 'updated_at': opened,
+        })
+    for first in range(0, len(product_rows), batch_size):
+        db.session.execute(db.insert(Product.__table__), product_rows[first:first + batch_size])
+
+    first_customer = next_id(Customer)
+    for first in range(0, customers, batch_size):
+        db.session.execute(db.insert(Customer.__table__), [{
+            'id': first_customer + number, 'mobile_number': f'6{first_customer + number:09d}',
+            'name': f'{rng.choice(SYNTHETIC_NAMES)} {rng.choice(SYNTHETIC_SURNAMES)}',
+            'address': 'Synthetic', 'balance_due': 0,
+            'created_at': synthetic_when(rng, start, span, number, customers), 'updated_at': end,
+        } for number in range(first, min(customers, first + batch_size))])
+    invalidate_price_table()
+    db.session.commit()
+    progress(f"{vendors:,} vendors, {products:,} products, {customers:,} customers")
+
+    # A few products sell far more than the rest
+    def pick_product():
+        return first_product + int(products * rng.random() ** 2)
+
+    net_stock = {}
+    first_invoice = next_id(Invoice)
+    for first in range(0, invoices, batch_size):
+        bills, lines, payments, movements = [], [], [], []
+        for number in range(first, min(invoices, first + batch_size)):
+            invoice_id = first_invoice + number
+            when = synthetic_when(rng, start, span, number, invoices)
+            walk_in = not customers or rng.random() < 0.3
+            basket = [{'product_id': pick_product(), 'quantity': rng.randint(1, 5)} for _ in range(rng.randint(1, 5))]
+            quote = price_basket(basket, inter_state=rng.random() < 0.05)
+            if rng.random() < 0.1:
+                quote = price_basket(basket, discount=to_money(quote['subtotal'] / 20), inter_state=quote['inter_state'])
+            paid, status = synthetic_payment(rng, quote['final_amount'], walk_in)
+            bills.append({
+                'id': invoice_id, 'bill_no': f'SYN-{invoice_id}',
+                'customer_id': None if walk_in else first_customer + rng.randrange(customers),
+                'total_amount': quote['total_amount'], 'discount': quote['discount'], 'cgst': quote['cgst'],
+                'sgst': quote['sgst'], 'igst': quote['igst'], 'final_amount': quote['final_amount'],
+                'paid_amount': paid, 'balance_due': quote['final_amount'] - paid, 'payment_status': status,
+                'created_at': when,
+            })
+            for line in quote['items']:
+                quantity = int(line['quantity'])
+                lines.append({'invoice_id': invoice_id, 'product_id': line['product_id'], 'quantity': quantity,
+                              'unit_price': line['unit_price'], 'total_price': line['total_price'],
+                              'gst_rate': float(line['gst_rate'])})
+                movements.append({'product_id': line['product_id'], 'quantity': -quantity, 'reason': 'sale',
+                                  'document_type': 'invoice', 'document_id': invoice_id, 'created_at': when})
+                net_stock[line['product_id']] = net_stock.get(line['product_id'], 0) - quantity
+            if paid:
+                payments.append({'invoice_id': invoice_id, 'amount': paid, 'payment_method': rng.choice(PAYMENT_METHODS),
+                                 'payment_date': when, 'status': 'completed'})
+        db.session.execute(db.insert(Invoice.__table__), bills)
+        db.session.execute(db.insert(InvoiceItem.__table__), lines)
+        db.session.execute(db.insert(StockMovement.__table__), movements)
+        if payments:
+            db.session.execute(db.insert(Payment.__table__), payments)
+        db.session.commit()
+        progress(f"{first + len(bills):,} / {invoices:,} invoices")
+
+    first_purchase = next_id(Purchase)
+    for first in range(0, purchases if vendors else 0, batch_size):
+        bills, lines, payments, movements = [], [], [], []
+        for number in range(first, min(purchases, first + batch_size)):
+            purchase_id = first_purchase + number
+            when = synthetic_when(rng, start, span, number, purchases)
+            total = cgst = sgst = Decimal('0.00')
+            for _ in range(rng.randint(1, 6)):
+                product = product_rows[pick_product() - first_product]
+                quantity = rng.randint(10, 100)
+                line_total = to_money(product['cost_price'] * quantity)
+                line_cgst, line_sgst, igst = split_gst(line_total, product['gst_rate'])
+                total += line_total
+                cgst += line_cgst
+                sgst += line_sgst
+                lines.append({'purchase_id': purchase_id, 'product_id': product['id'], 'quantity': quantity,
+                              'unit_price': product['cost_price'], 'total_price': line_total})
+                movements.append({'product_id': product['id'], 'quantity': quantity, 'reason': 'purchase',
+                                  'document_type': 'purchase', 'document_id': purchase_id, 'created_at': when})
+                net_stock[product['id']] = net_stock.get(product['id'], 0) + quantity
+            final_amount = total + cgst + sgst
+            paid, status = synthetic_payment(rng, final_amount)
+            bills.append({
+                'id': purchase_id, 'bill_no': f'SYN-P{purchase_id}', 'po_bill_no': f'PO-{rng.randint(1000, 99999)}',
+                'purchase_date': when.date(), 'vendor_id': first_vendor + rng.randrange(vendors),
+                'total_amount': total, 'discount': 0, 'cgst': cgst, 'sgst': sgst, 'final_amount': final_amount,
+                'paid_amount': paid, 'balance_due': final_amount - paid, 'payment_status': status, 'created_at': when,
+            })
+            if paid:
+                payments.append({'purchase_id': purchase_id, 'amount': paid, 'payment_date': when,
+                                 'payment_method': rng.choice(PAYMENT_METHODS), 'description': 'Synthetic'})
+        db.session.execute(db.insert(Purchase.__table__), bills)
+        db.session.execute(db.insert(PurchaseItem.__table__), lines)
+        db.session.execute(db.insert(StockMovement.__table__), movements)
+        if payments:
+            db.session.execute(db.insert(VendorPayment.__table__), payments)
+        db.session.commit()
+        progress(f"{first + len(bills):,} / {purchases:,} purchases")
+
+    expenses = []
+    for month in [start] + list(month_starts(start, end)):
+        days = (min(end, datetime(month.year + month.month // 12, month.month % 12 + 1, 1)) - month).days or 1
+        expenses += [{'category': rng.choice(SYNTHETIC_EXPENSES), 'description': 'Synthetic',
+                      'amount': to_money(Decimal(rng.randint(100, 2500000)) / 100),
+                      'expense_date': month + timedelta(days=rng.randrange(days), minutes=rng.randrange(1440))}
+                     for _ in range(expenses_per_month)]
+    for first in range(0, len(expenses), batch_size):
+        db.session.execute(db.insert(Expense.__table__), expenses[first:first + batch_size])
+
+    # Opening stock makes every product end with a plausible count
+    stock = [{'product_id': row['id'], 'stock': max(rng.randint(0, 200), net_stock.get(row['id'], 0))}
+             for row in product_rows]
+    table = Product.__table__
+    for first in range(0, len(stock), batch_size):
+        db.session.execute(table.update().where(table.c.id == db.bindparam('product_id')).values(
+            stock_quantity=db.bindparam('stock')), stock[first:first + batch_size])
+        db.session.execute(db.insert(StockMovement.__table__), [
+            {'product_id': row['product_id'], 'quantity': row['stock'] - net_stock.get(row['product_id'], 0),
+             'reason': 'opening', 'created_at': opened}
+            for row in stock[first:first + batch_size]
+        ])
+    db.session.commit()
+    progress(f"{len(expenses):,} expenses; rebuilding balances, rollups and stock snapshots")
+
+    repair_balances()
+    db.session.commit()
+    rebuild_rollups()
+    rebuild_stock_snapshots(db.session.connection())
+    db.session.commit()
+
+@app.cli.command('generate-data')
+@click.option('--years', default=2.0, help='Length of the history, ending today')
+@click.option('--invoices', default=100000, help='Sales bills over the whole history')
+@click.option('--purchases', default=None, type=int, help='Purchase bills (default: one per 20 invoices)')
+@click.option('--products', default=2000)
+@click.option('--customers', default=5000)
+@click.option('--vendors', default=50)
+@click.option('--expenses-per-month', default=30)
+@click.option('--seed', default=1, help='Same seed, same data')
+@click.option('--batch-size', default=5000, help='Bills written per transaction')
+def generate_data_command(years, invoices, purchases, products, customers, vendors, expenses_per_month, seed, batch_size):
+    """Add a synthetic shop's history to the database for benchmarks"""
+    if products < 1:
+        print('--products must be at least 1')
+        sys.exit(1)
+    upgrade_database()
+    create_default_admin()
+    started = time.perf_counter()
+    generate_shop_data(random.Random(seed), years, invoices, products, customers, vendors,
+                       invoices // 20 if purchases is None else purchases, expenses_per_month, batch_size)
+    print(f"Generated in {time.perf_counter() - started:.0f} s")
+
+# Route benchmark
+# Times every page the app serves over GET through the test client, on
+# whatever database BILLSYS_DATABASE_URL names (generate-data fills one), and
+# compares the results with a saved run.
+BENCH_SKIP = {
+    'static', 'login', 'logout',
+    'export_data',  # whole tables; bench-export covers exports
+    'job_status_route', 'job_result',  # need a job id
+}
+# Pages whose cost depends on their query string
+BENCH_EXTRA_URLS = [
+    '/products?search=wire', '/customers?search=kumar', '/api/products?search=led', '/stock?low_stock=1',
+    '/sales?status=unpaid', '/payments?category=vendor', '/reports/sales?page=500',
+    '/reports/payment?payment_type=customer', '/reports/aging?party=vendor',
+]
+# A route has regressed when its p95 is more than this fraction (and at least
+# BENCH_NOISE_MS) slower than the baseline, or it runs more statements
+BENCH_TOLERANCE = 0.25
+BENCH_NOISE_MS = 5
+
+def bench_urls():
+    """Every GET route, with the busiest customer, vendor, bill and product as arguments"""
+    arguments = {}
+    for argument, key in (
+        ('customer_id', Invoice.customer_id), ('vendor_id', Purchase.vendor_id),
+        ('invoice_id', InvoiceItem.invoice_id), ('purchase_id', PurchaseItem.purchase_id),
+        ('product_id', InvoiceItem.product_id),
+    ):
+        busiest = db.session.query(key).filter(key.isnot(None)).group_by(key) \
+            .order_by(db.func.count().desc()).limit(1).scalar()
+        if busiest is not None:
+            arguments[argument] = busiest
+    expense_id = db.session.query(db.func.max(Expense.id)).scalar()
+    if expense_id is not None:
+        arguments['expense_id'] = expense_id
+
+    urls = []
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' in rule.methods and rule.endpoint not in BENCH_SKIP and rule.arguments <= set(arguments):
+            urls.append(url_for(rule.endpoint, **{name: arguments[name] for name in rule.arguments}))
+    # A deep page of sales, to show it costs what the first one does
+    deep = db.session.query(Invoice.created_at, Invoice.id) \
+        .order_by(Invoice.created_at.desc(), Invoice.id.desc()).offset(5000).limit(1).first()
+    if deep is not None:
+        urls.append(url_for('sales', cursor=encode_cursor(deep, 5001)))
+    return urls + BENCH_EXTRA_URLS
+
+def bench_route(client, url, statements, repeat):
+    """p50/p95 of repeat runs, the statements one run issues and its peak Python memory"""
+    timings = []
+    for _ in range(repeat):
+        del statements[:]
+        started = time.perf_counter()
+        # A fresh app context per request, as in the server: otherwise the
+        # command's context would keep g (and the signed-in user) and the session
+        with app.app_context():
+            response = client.get(url)
+            response.get_data()
+        timings.append((time.perf_counter() - started) * 1000)
+    queries = len(statements)
+    timings.sort()
+    # Traced separately: tracemalloc slows everything it watches
+    tracemalloc.start()
+    with app.app_context():
+        client.get(url).get_data()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'status': response.status_code, 'p50_ms': round(timings[len(timings) // 2], 2),
+            'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+            'queries': queries, 'peak_kb': round(peak / 1024)}
+
+def bench_regressions(routes, baseline):
+    """{url: reasons} for routes slower or chattier than in the baseline run"""
+    regressions = {}
+    for url, now in routes.items():
+        before = baseline['routes'].get(url)
+        if before is None:
+            continue
+        reasons = []
+        if now['p95_ms'] > before['p95_ms'] * (1 + BENCH_TOLERANCE) and now['p95_ms'] - before['p95_ms'] > BENCH_NOISE_MS:
+            reasons.append(f"p95 {before['p95_ms']:.1f} -> {now['p95_ms']:.1f} ms")
+        if now['queries'] > before['queries']:
+            reasons.append(f"{before['queries']} -> {now['queries']} queries")
+        if now['status'] != before['status']:
+            reasons.append(f"status {before['status']} -> {now['status']}")
+        if reasons:
+            regressions[url] = reasons
+    return regressions
+
+def bench_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=app.root_path, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+@app.cli.command('bench-routes')
+@click.option('--repeat', default=10, help='Timed requests per route')
+@click.option('--output', default=None, help='Where to write the results (default instance/bench/routes-<time>.json)')
+@click.option('--baseline', default=None, help='Earlier results to compare with; exits 1 on a regression')
+@click.option('--match', default='', help='Only routes whose URL contains this')
+@click.option('--report-cache', is_flag=True, help='Leave the report cache on (repeat runs then measure hits)')
+def bench_routes_command(repeat, output, baseline, match, report_cache):
+    """Time every page, count its queries and peak memory, and compare with a baseline"""
+    client = check_client()
+    if client is None:
+        print('No users in the database; run generate-data or create_default_admin first')
+        sys.exit(1)
+    app.config['REPORT_CACHE'] = report_cache
+    app.config['BACKGROUND_REPORTS'] = False
+    with app.test_request_context():
+        urls = [url for url in bench_urls() if match in url]
+    if baseline:
+        with open(baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+
+    routes = {}
+    with recorded_statements() as statements:
+        for url in urls:
+            with app.app_context():
+                client.get(url).get_data()  # warm up caches and the connection pool
+            routes[url] = result = bench_route(client, url, statements, repeat)
+            print(f"{url}: {result['status']}, p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+                  f"{result['queries']} queries, peak {result['peak_kb']:,} KB")
+
+    results = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'revision': bench_revision(),
+        'database': db.engine.dialect.name,
+        'rows': {model.__tablename__: db.session.query(db.func.count()).select_from(model).scalar()
+                 for model in (Product, Customer, Vendor, Invoice, InvoiceItem, Payment, Purchase, Expense)},
+        'repeat': repeat,
+        'report_cache': report_cache,
+        'routes': routes,
+    }
+    if output is None:
+        output = os.path.join(app.instance_path, 'bench', f"routes-{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=2)
+    print(f"Saved {output}")
+
+    if baseline:
+        regressions = bench_regressions(routes, baseline)
+        for url, reasons in regressions.items():
+            print(f"REGRESSION {url}: {', '.join(reasons)}")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {baseline['created_at']} ({baseline['revision'] or 'unknown revision'})")
+
 def create_default_admin():
     """Create default admin user if none exists"""
     admin = User.query.filter_by(role='admin').first()
@@ -1706,8 +5450,8 @@ def create_default_admin():
         print("Default admin created - Mobile: 9999999999, Password: admin123")
 
 if __name__ == '__main__':
-    #with app.app_context():
-        #db.create_all()
+    with app.app_context():
+        upgrade_database()
         #create_default_admin()
     app.run(debug=True,) 
     #webview.create_window('Electrical Billing App', app,min_size=(700,500),frameless=False,resizable=True)
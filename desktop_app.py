@@ -1,9 +1,11 @@
 import webview
-from app import app
+from app import app, upgrade_database
 
 if __name__ == '__main__':
-    #with app.app_context():
-        #db.create_all()
+    # Reports run as background jobs so the window stays responsive
+    app.config['BACKGROUND_REPORTS'] = True
+    with app.app_context():
+        upgrade_database()
         #create_default_admin()
     #app.run(debug=True) 
     webview.create_window('Electrical Billing App', app,min_size=(700,500),frameless=False,resizable=True)
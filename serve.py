@@ -0,0 +1,35 @@
+import argparse
+import os
+from werkzeug.serving import run_simple
+from app import app, db, upgrade_database
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+def serve(host, port, threads, processes):
+    """Serve the app to several counters at once"""
+    with app.app_context():
+        upgrade_database()
+        # Worker processes must open their own SQLite connections
+        db.engine.dispose()
+    if processes > 1:
+        run_simple(host, port, app, processes=processes)
+    elif waitress is not None:
+        waitress.serve(app, host=host, port=port, threads=threads)
+    else:
+        run_simple(host, port, app, threaded=threads > 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run the billing server for multiple counters')
+    parser.add_argument('--host', default=os.environ.get('SERVER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('SERVER_PORT', 5000)))
+    parser.add_argument('--threads', type=int, default=app.config['SERVER_THREADS'],
+                        help='request threads (uses waitress when installed)')
+    parser.add_argument('--processes', type=int, default=app.config['SERVER_PROCESSES'],
+                        help='worker processes; more than 1 needs a platform with fork')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.threads, args.processes)
@@ -0,0 +1,65 @@
+// Client-side product catalogue kept in sync with /api/products.
+// The first visit downloads the catalogue in pages; after that only rows
+// changed or deleted since the stored cursor are fetched.
+const ProductCatalogue = {
+    storageKey: 'billsys-products-v1',
+    pageSize: 1000,
+    products: new Map(),
+    cursor: null,
+
+    load() {
+        try {
+            const saved = JSON.parse(localStorage.getItem(this.storageKey) || 'null');
+            if (saved) {
+                this.products = new Map(saved.products.map(product => [product.id, product]));
+                this.cursor = saved.cursor;
+            }
+        } catch (e) {
+            console.error('Error loading cached products:', e);
+        }
+        return this;
+    },
+
+    save() {
+        try {
+            localStorage.setItem(this.storageKey, JSON.stringify({
+                cursor: this.cursor,
+                products: Array.from(this.products.values())
+            }));
+        } catch (e) {
+            // Storage full or unavailable: keep the in-memory copy only
+            console.warn('Product cache not saved:', e);
+        }
+    },
+
+    async sync() {
+        let hasMore = true;
+        let changed = false;
+        while (hasMore) {
+            const params = new URLSearchParams({
+                limit: this.pageSize,
+                updated_since: this.cursor ? this.cursor.updated_since : '',
+                after_id: this.cursor ? this.cursor.after_id : 0
+            });
+            const response = await fetch('/api/products?' + params.toString(), { credentials: 'same-origin' });
+            if (!response.ok) {
+                throw new Error('Catalogue sync failed: ' + response.status);
+            }
+            const data = await response.json();
+            // Deletions first: a reused id may come back as a new product
+            data.deleted.forEach(id => this.products.delete(id));
+            data.items.forEach(product => this.products.set(product.id, product));
+            changed = changed || data.items.length > 0 || data.deleted.length > 0;
+            this.cursor = data.cursor;
+            hasMore = data.has_more;
+        }
+        if (changed) {
+            this.save();
+        }
+        return changed;
+    },
+
+    all() {
+        return Array.from(this.products.values());
+    }
+};
@@ -0,0 +1,36 @@
+"""The app on a throwaway SQLite database holding a small synthetic shop.
+
+app.py reads BILLSYS_DATABASE_URL when it is imported, so the database is
+chosen before the first import of it.
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def billing(tmp_path_factory):
+    """The app module, inside an app context, on a migrated database with data"""
+    folder = tmp_path_factory.mktemp('billing')
+    os.environ['BILLSYS_DATABASE_URL'] = f"sqlite:///{folder / 'billing.db'}"
+    os.environ['JOB_CACHE_DIR'] = str(folder / 'job_cache')
+    # Counts and plans should come from the database, not cached report totals
+    os.environ['REPORT_CACHE'] = '0'
+    import app as billing
+
+    with billing.app.app_context():
+        billing.upgrade_database()
+        billing.create_default_admin()
+        billing.generate_shop_data(random.Random(1), years=1, invoices=600, products=80, customers=60, vendors=6,
+                                   purchases=40, expenses_per_month=4, batch_size=200, progress=lambda message: None)
+        yield billing
+        billing.db.session.remove()
+
+
+@pytest.fixture
+def client(billing):
+    return billing.check_client()
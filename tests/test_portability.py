@@ -0,0 +1,138 @@
+"""The dialect-dependent paths on every supported backend.
+
+SQLite runs on a scratch file. PostgreSQL runs when BILLSYS_TEST_POSTGRES_URL
+names a scratch database (its tables are dropped before and after each test)
+and is skipped otherwise.
+"""
+import os
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from flask import Flask
+from sqlalchemy import inspect, text
+
+BACKENDS = ['sqlite', 'postgresql']
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, billing, tmp_path):
+    """An app context on an empty database of the backend; yields the app module"""
+    if request.param == 'sqlite':
+        url = f"sqlite:///{tmp_path / 'portability.db'}"
+    else:
+        url = os.environ.get('BILLSYS_TEST_POSTGRES_URL')
+        if not url:
+            pytest.skip('BILLSYS_TEST_POSTGRES_URL is not set')
+    backend_app = Flask(__name__)
+    backend_app.config.update(billing.app.config)
+    backend_app.config['SQLALCHEMY_DATABASE_URI'] = url
+    billing.db.init_app(backend_app)
+    with backend_app.app_context():
+        billing.db.drop_all()
+        # The FTS table list is cached from whichever database asked first
+        billing._search_tables = None
+        try:
+            yield billing
+        finally:
+            billing.db.session.remove()
+            billing.db.drop_all()
+            billing.db.engine.dispose()
+            billing._search_tables = None
+
+
+def legacy_database(billing):
+    """Tables as they stood before migration 9: amounts as floating-point rupees"""
+    db = billing.db
+    db.create_all()
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        for table in db.metadata.sorted_tables:
+            for column in table.c:
+                if isinstance(column.type, billing.Money):
+                    connection.execute(text(
+                        f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE DOUBLE PRECISION"
+                    ))
+    for version, description, func in billing.MIGRATIONS:
+        if version < 9:
+            db.session.add(billing.SchemaVersion(version=version, description=description))
+    # Plain SQL, so the amounts aren't converted to paise on the way in
+    now = datetime(2025, 8, 12, 10, 30)
+    for statement, values in (
+        ("INSERT INTO customer (id, name, mobile_number, balance_due, created_at) "
+         "VALUES (1, 'Ravi Kumar', '9876543210', 0, :now)", {}),
+        ("INSERT INTO product (id, name, category, brand, mrp_price, cost_price, selling_price, gst_rate, "
+         "stock_quantity, unit, created_at) VALUES (1, 'Modular Switch 6A', 'Switches', 'Havells', 120.5, 80.25, "
+         "100.25, 18, 10, 'pcs', :now)", {}),
+        ("INSERT INTO invoice (id, bill_no, customer_id, total_amount, discount, cgst, sgst, igst, final_amount, "
+         "paid_amount, balance_due, payment_status, created_at) VALUES (1, 'INV-001', 1, 1002.5, 0, 90.23, 90.22, "
+         "0, 1182.95, 0, 0, 'partial', :now)", {}),
+        ("INSERT INTO invoice_item (invoice_id, product_id, quantity, unit_price, total_price, gst_rate) "
+         "VALUES (1, 1, 10, 100.25, 1002.5, 18)", {}),
+        ("INSERT INTO payment (invoice_id, amount, payment_method, payment_date, status) "
+         "VALUES (1, 500.1, 'cash', :now, 'completed')", {}),
+    ):
+        connection.execute(text(statement), dict(values, now=now))
+    db.session.commit()
+
+
+def test_money_migration_converts_rupees_to_paise(backend):
+    legacy_database(backend)
+    backend.upgrade_database()
+
+    invoice = backend.db.session.get(backend.Invoice, 1)
+    assert invoice.final_amount == Decimal('1182.95')
+    assert invoice.cgst == Decimal('90.23')
+    assert invoice.paid_amount == Decimal('500.10')
+    assert invoice.balance_due == Decimal('682.85')
+    assert backend.db.session.get(backend.Customer, 1).balance_due == Decimal('682.85')
+    assert backend.db.session.get(backend.Product, 1).selling_price == Decimal('100.25')
+    assert backend.db.session.get(backend.DailySummary, invoice.created_at.date()).sales_total == Decimal('1182.95')
+
+    if backend.db.engine.dialect.name == 'postgresql':
+        types = {column['name']: column['type'] for column in inspect(backend.db.engine).get_columns('invoice')}
+        assert types['final_amount'].python_type is int
+
+    # A second run has nothing left to apply and leaves the amounts alone
+    backend.upgrade_database()
+    backend.db.session.expire_all()
+    assert backend.db.session.get(backend.Invoice, 1).final_amount == Decimal('1182.95')
+
+
+def test_bill_numbers_come_from_the_sequence_upsert(backend):
+    backend.upgrade_database()
+    name, number_format, fields = backend.document_series('invoice')
+    numbers = [backend.next_document_number('invoice') for _ in range(3)]
+    backend.db.session.commit()
+    assert numbers == [number_format.format(seq=seq, **fields) for seq in (1, 2, 3)]
+
+    with backend.db.engine.begin() as connection:
+        assert backend.reserve_sequence(connection, 'TEST', 10) == 1
+        assert backend.reserve_sequence(connection, 'TEST', 10) == 11
+
+
+@pytest.mark.parametrize('label', ['daily summary upsert', 'sequence seed', 'sales by day', 'tax by month'])
+def test_portable_statement_runs(backend, label):
+    backend.upgrade_database()
+    build = backend.portable_statements()[label]
+    backend.db.session.execute(build(backend.db.engine.dialect.name))
+    backend.db.session.commit()
+
+
+def test_search_fallback_ignores_case(backend):
+    backend.upgrade_database()
+    db = backend.db
+    db.session.add(backend.Product(name='Modular Switch 6A', category='Switches', brand='Havells',
+                                   mrp_price=120, cost_price=80, selling_price=100, gst_rate=18))
+    db.session.add(backend.Product(name='LED Bulb 9W', category='Lighting', brand='Philips',
+                                   mrp_price=150, cost_price=90, selling_price=110, gst_rate=12))
+    db.session.add(backend.Customer(name='Ravi Kumar', mobile_number='9876543210'))
+    db.session.commit()
+
+    fallback = backend.Product.query.filter(backend.search_fallback(backend.Product, 'HAVELLS')).all()
+    assert [product.name for product in fallback] == ['Modular Switch 6A']
+    # Through FTS5 on SQLite, and the fallback again on PostgreSQL
+    ranked = backend.search_ranked(backend.Product.query, backend.Product, 'switch').all()
+    assert [product.name for product in ranked] == ['Modular Switch 6A']
+    customers = backend.Customer.query.filter(backend.search_condition(backend.Customer, 'kumar')).all()
+    assert [customer.name for customer in customers] == ['Ravi Kumar']
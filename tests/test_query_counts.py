@@ -0,0 +1,52 @@
+"""Detail views run a fixed number of statements however long the history is"""
+import pytest
+from sqlalchemy import event
+
+# endpoint, its URL argument, the child column that references it, and the
+# most statements the page may run (one of them can be the signed-in user)
+DETAIL_VIEWS = [
+    ('customer_detail', 'customer_id', 'Invoice.customer_id', 6),
+    ('vendor_detail', 'vendor_id', 'Purchase.vendor_id', 7),
+    ('sales_detail', 'invoice_id', 'InvoiceItem.invoice_id', 4),
+    ('purchase_detail', 'purchase_id', 'PurchaseItem.purchase_id', 4),
+]
+
+
+def statement_count(billing, client, url):
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(billing.db.engine, 'before_cursor_execute', count)
+    try:
+        response = client.get(url)
+    finally:
+        event.remove(billing.db.engine, 'before_cursor_execute', count)
+    assert response.status_code == 200, url
+    return len(statements)
+
+
+def detail_urls(billing, endpoint, argument, column):
+    """URLs for the record with the most and the fewest rows referencing it"""
+    model, name = column.split('.')
+    key = getattr(getattr(billing, model), name)
+    urls = []
+    for order in (billing.db.func.count().desc(), billing.db.func.count()):
+        record = billing.db.session.query(key).filter(key.isnot(None)).group_by(key) \
+            .order_by(order, key).limit(1).scalar()
+        with billing.app.test_request_context():
+            urls.append(billing.url_for(endpoint, **{argument: record}))
+    return urls
+
+
+@pytest.mark.parametrize('endpoint, argument, column, limit', DETAIL_VIEWS, ids=[view[0] for view in DETAIL_VIEWS])
+def test_detail_view_statement_count(billing, client, endpoint, argument, column, limit):
+    busiest, quietest = detail_urls(billing, endpoint, argument, column)
+    assert busiest != quietest
+    # Loads the signed-in user, so both counts below are of the page alone
+    client.get(quietest)
+    quiet = statement_count(billing, client, quietest)
+    busy = statement_count(billing, client, busiest)
+    assert busy <= limit
+    assert busy == quiet
@@ -0,0 +1,29 @@
+"""Report and list views must read the big tables through an index"""
+
+
+def test_views_avoid_full_table_scans(billing, client):
+    with billing.app.test_request_context():
+        urls = billing.plan_check_urls()
+
+    failures = {}
+    with billing.recorded_statements() as statements:
+        for url in urls:
+            del statements[:]
+            response = client.get(url)
+            assert response.status_code == 200, url
+            selects = [(statement, parameters) for statement, parameters in statements
+                       if statement.lstrip().upper().startswith('SELECT')]
+            assert selects, url
+            with billing.db.engine.connect() as connection:
+                scans = [detail for statement, parameters in selects
+                         for detail in billing.full_scans(connection, statement, parameters)]
+            if scans:
+                failures[url] = scans
+    assert failures == {}
+
+
+def test_full_scans_reads_the_plan(billing):
+    # The check itself has to notice a scan, or the test above proves nothing
+    with billing.db.engine.connect() as connection:
+        assert billing.full_scans(connection, 'SELECT * FROM invoice WHERE paid_amount > ?', (0,)) == ['SCAN invoice']
+        assert billing.full_scans(connection, 'SELECT * FROM invoice WHERE id = ?', (1,)) == []